@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import atexit
 import subprocess
 import logging
 import shlex
@@ -21,8 +22,14 @@ import pty
 import os
 import codecs
 import errno
+import select
+import threading
+import uuid
 from collections import deque
 from cloudinstall import utils
+from cloudinstall.api.inotify import FileWatcher
+from cloudinstall.log import stop_logger
+import re
 import stat
 import tempfile
 import time
@@ -32,6 +39,17 @@ log = logging.getLogger("cloudinstall.api.container")
 
 BLACKLIST_GW = [b'10.0.3.1', b'192.168.122.1']
 
+# Written before the entries add_config_entries appends to an LXC
+# config, so publish_image can leave them out of the cached image.
+CONFIG_ENTRIES_MARKER = "# openstack-installer entries"
+
+IMAGE_SNAPSHOT_NAME = "uoi-image-cache"
+
+# Cached Single install images are named IMAGE_CACHE_PREFIX + a hash of
+# what went into them; prune_images keeps the IMAGE_CACHE_KEEP newest.
+IMAGE_CACHE_PREFIX = "uoi-cache-"
+IMAGE_CACHE_KEEP = 2
+
 
 class NoContainerIPException(Exception):
 
@@ -43,8 +61,199 @@ class ContainerRunException(Exception):
     "Running cmd in container failed"
 
 
-class LXCContainer:
+# Shared by every ssh invocation into the container. ControlPath is
+# what makes ControlMaster/ControlPersist actually reuse one connection.
+SSH_OPTIONS = ("-o \"StrictHostKeyChecking=no\" "
+               "-o \"UserKnownHostsFile=/dev/null\" "
+               "-o \"ControlMaster=auto\" "
+               "-o \"ControlPersist=600\" "
+               "-o \"ControlPath=~/.ssh/uoi-%r@%h:%p\"")
+
+
+class ContainerSession:
+
+    """ Long-lived shell inside a container
+
+    Short commands are written to a single attached /bin/sh instead of
+    spawning a new lxc-attach/lxc exec (and pty) for each of them.
+    Each command is followed by a unique marker carrying its exit
+    status, which is how the end of its output is detected.
+
+    :param str attach_cmd: host command that opens a shell in the
+                           container, reading commands from stdin
+    """
+
+    def __init__(self, attach_cmd):
+        self.attach_cmd = attach_cmd
+        self.proc = None
+        self.lock = threading.Lock()
+
+    def _spawn(self):
+        log.debug("Starting container session: {}".format(self.attach_cmd))
+        self.proc = subprocess.Popen(self.attach_cmd, shell=True,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL)
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def close(self):
+        if self.proc is None:
+            return
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        self.proc.stdin.close()
+        self.proc.stdout.close()
+        self.proc = None
+
+    def run(self, cmd, timeout=30):
+        """ runs cmd in the session shell
+
+        :param str cmd: single line shell command
+        :param int timeout: seconds to wait for the command to finish
+        :returns: stripped stdout of the command
+        :raises: ContainerRunException with the command's return code,
+                 or 255 if the session itself failed
+        """
+        with self.lock:
+            if not self.is_alive():
+                self._spawn()
+            marker = uuid.uuid4().hex
+            line = ("( {} ) </dev/null 2>/dev/null; "
+                    "printf '\\n{}:%d\\n' $?\n".format(cmd, marker))
+            try:
+                self.proc.stdin.write(line.encode())
+                self.proc.stdin.flush()
+                output, returncode = self._read_until(marker.encode(),
+                                                      timeout)
+            except (OSError, ContainerRunException) as e:
+                self.close()
+                raise ContainerRunException("Session failed running {0}: "
+                                            "{1}".format(cmd, e), 255)
+
+        if returncode != 0:
+            raise ContainerRunException("Problem running {0} in container "
+                                        "session".format(cmd), returncode)
+        return output
+
+    def _read_until(self, marker, timeout):
+        fd = self.proc.stdout.fileno()
+        deadline = time.time() + timeout
+        buf = b''
+        tag = b'\n' + marker + b':'
+        while True:
+            idx = buf.find(tag)
+            if idx >= 0:
+                end = buf.find(b'\n', idx + len(tag))
+                if end >= 0:
+                    returncode = int(buf[idx + len(tag):end])
+                    output = buf[:idx].decode('utf-8', 'replace')
+                    return output.replace('\r', '').strip(), returncode
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise ContainerRunException("timed out", 255)
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                continue
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                raise ContainerRunException("session exited", 255)
+            buf += chunk
+
+
+class ContainerBase:
+
+    """ IP cache, persistent sessions and host paths shared by the
+    container drivers, which keep their own _ip_cache and _sessions
+    """
+    _ip_cache = {}
+    _sessions = {}
+
+    @classmethod
+    def ip(cls, name):
+        """ returns container IP, cached until the container restarts
+        """
+        if name not in cls._ip_cache:
+            ip = cls._lookup_ip(name)
+            if ip is None:
+                return None
+            cls._ip_cache[name] = ip
+        return cls._ip_cache[name]
+
+    @classmethod
+    def invalidate_ip(cls, name):
+        cls._ip_cache.pop(name, None)
+
+    @classmethod
+    def session(cls, name):
+        """ returns the shared ContainerSession for a container
+        """
+        if name not in cls._sessions:
+            cls._sessions[name] = ContainerSession(
+                cls.session_attach_cmd(name))
+        return cls._sessions[name]
+
+    @classmethod
+    def close_session(cls, name):
+        sess = cls._sessions.pop(name, None)
+        if sess is not None:
+            sess.close()
+
+    @classmethod
+    def probe(cls, name, cmd, timeout=30):
+        """ runs a short command in the container's persistent session
+
+        Use for frequent, quick reads (status files, log tails). Long
+        running commands that need live output should use run().
+
+        :param str name: name of container
+        :param str cmd: command to run
+        """
+        return cls.session(name).run(cmd, timeout)
+
+    @classmethod
+    def host_path(cls, name, path):
+        """ returns the host path of 'path' as seen inside the running
+        container, or None if it can't be reached from the host.
+
+        Goes through /proc/<pid>/root of the container's init so that
+        tmpfs mounts like /run are visible.
+        """
+        pid = cls.init_pid(name)
+        if pid is None:
+            return None
+        root = '/proc/{}/root'.format(pid)
+        if not os.access(root, os.R_OK | os.X_OK):
+            return None
+        return os.path.join(root, path.lstrip('/'))
+
+    @classmethod
+    def prune_images(cls, keep=IMAGE_CACHE_KEEP, in_use=None):
+        """ deletes all but the 'keep' newest cached images
+
+        :param int keep: number of images to keep
+        :param str in_use: image the current install was created from or
+                           saved as, never deleted
+        """
+        images = [i for i in cls.list_images() if i != in_use]
+        if in_use is not None:
+            keep -= 1
+        for image in images[:max(0, len(images) - keep)]:
+            log.info("Removing cached container image {}".format(image))
+            try:
+                cls.delete_image(image)
+            except Exception:
+                log.exception("Unable to remove cached container image "
+                              "{}".format(image))
+
+
+class LXCContainer(ContainerBase):
     container_root = '/var/lib/lxc'
+    _ip_cache = {}
+    _sessions = {}
 
     @classmethod
     def exists(cls, name):
@@ -61,7 +270,11 @@ class LXCContainer:
         return s.decode('utf-8')
 
     @classmethod
-    def ip(cls, name):
+    def session_attach_cmd(cls, name):
+        return "lxc-attach -n {} -- /bin/sh".format(name)
+
+    @classmethod
+    def _lookup_ip(cls, name):
         try:
             ips = subprocess.check_output("sudo lxc-info -n {}"
                                           " -i -H".format(name),
@@ -90,14 +303,12 @@ class LXCContainer:
             ip = cls.ip(name)
             quoted_cmd = shlex.quote(cmd)
             wrapped_cmd = ("sudo -H -u {3} TERM=xterm256-color ssh -t -q "
-                           "-l ubuntu -o \"StrictHostKeyChecking=no\" "
-                           "-o \"UserKnownHostsFile=/dev/null\" "
-                           "-o \"ControlMaster=auto\" "
-                           "-o \"ControlPersist=600\" "
+                           "-l ubuntu {4} "
                            "-i {2} "
                            "{0} {1}".format(ip, quoted_cmd,
                                             utils.ssh_privkey(),
-                                            utils.install_user()))
+                                            utils.install_user(),
+                                            SSH_OPTIONS))
         else:
             ip = "-"
             quoted_cmd = cmd
@@ -170,16 +381,16 @@ class LXCContainer:
         """
         ip = cls.ip(name)
         cmd = ("sudo -H -u {2} TERM=xterm256-color ssh -t -q "
-               "-l ubuntu -o \"StrictHostKeyChecking=no\" "
-               "-o \"UserKnownHostsFile=/dev/null\" "
-               "-o \"ControlMaster=auto\" "
-               "-o \"ControlPersist=600\" "
+               "-l ubuntu {4} "
                "-i {1} "
                "{0} {3}".format(ip, utils.ssh_privkey(),
-                                utils.install_user(), cmd))
+                                utils.install_user(), cmd, SSH_OPTIONS))
         log.debug("Running command without waiting "
                   "for response.: {}".format(cmd))
         args = deque(shlex.split(cmd))
+        # exec skips atexit handlers
+        config.flush()
+        stop_logger()
         os.execlp(args.popleft(), *args)
 
     @classmethod
@@ -206,13 +417,26 @@ class LXCContainer:
                                 src, name, ip, ret['output'], ret['err'], cmd))
 
     @classmethod
-    def create(cls, name, userdata):
+    def create(cls, name, userdata, image=None):
         """ creates a container from ubuntu-cloud template
 
         Arguments:
         name: name of container
         userdata: cloud-init config
+        image: name of a cached image (see publish_image) to clone
+               instead of running the template
         """
+        if image is not None:
+            cmd = 'sudo lxc-clone -s -B overlayfs -o {} -n {}'.format(
+                image, name)
+            log.debug("Running command: {}".format(cmd))
+            out = utils.get_command_output(cmd)
+            if out['status'] > 0:
+                raise Exception("Unable to clone container from {}: "
+                                "{} ({})".format(image, out['output'],
+                                                 out['err'].strip()))
+            return out['status']
+
         # NOTE: the -F template arg is a workaround. it flushes the lxc
         # ubuntu template's image cache and forces a re-download. It
         # should be removed after https://github.com/lxc/lxc/issues/381 is
@@ -261,15 +485,89 @@ class LXCContainer:
     def add_config_entries(cls, name, configlines):
         container_abspath = os.path.join(cls.container_root, name)
         with open(os.path.join(container_abspath, 'config'), 'a') as f:
+            f.write(CONFIG_ENTRIES_MARKER + "\n")
             for line in configlines:
                 f.write(line + "\n")
 
+    @classmethod
+    def image_exists(cls, image):
+        return cls.exists(image)
+
+    @classmethod
+    def list_images(cls):
+        """ returns the names of the cached images, oldest first
+        """
+        images = []
+        for entry in os.listdir(cls.container_root):
+            config = os.path.join(cls.container_root, entry, 'config')
+            if entry.startswith(IMAGE_CACHE_PREFIX) and \
+               not entry.endswith('.partial') and os.path.isfile(config):
+                images.append((os.path.getmtime(config), entry))
+        return [entry for _, entry in sorted(images)]
+
+    @classmethod
+    def delete_image(cls, image):
+        """ destroys a cached image, lxc-destroy refuses while overlay
+        clones of it still exist
+        """
+        out = utils.get_command_output('sudo lxc-destroy -n {}'.format(image))
+        if out['status'] > 0:
+            raise Exception("Unable to destroy {}: {} ({})".format(
+                image, out['output'], out['err'].strip()))
+
+    @classmethod
+    def publish_image(cls, name, image):
+        """ saves a copy of a container to clone later installs from
+
+        The copy is a stopped container named 'image' with the
+        per-install config entries and bind mounts left out. Its SSH host
+        keys and machine-id are removed so that clones generate their
+        own on first boot.
+
+        :param str name: name of the container to copy
+        :param str image: name of the cached image
+        """
+        src = os.path.join(cls.container_root, name)
+        dst = os.path.join(cls.container_root, image)
+        tmp = dst + '.partial'
+        utils.get_command_output('sudo rm -rf {}'.format(tmp))
+        os.makedirs(tmp)
+
+        with open(os.path.join(src, 'config')) as f:
+            config = f.read().split(CONFIG_ENTRIES_MARKER)[0]
+        config = config.replace(src, dst)
+        config = re.sub(r'(?m)^lxc\.utsname\s*=.*$',
+                        'lxc.utsname = {}'.format(image), config)
+        with open(os.path.join(tmp, 'config'), 'w') as f:
+            f.write(config)
+        open(os.path.join(tmp, 'fstab'), 'w').close()
+
+        # apt is done at this point, so copying the live rootfs is
+        # consistent enough; /run and bind mounts live in the
+        # container's mount namespace and are not copied.
+        out = utils.get_command_output(
+            'sudo cp -a --reflink=auto {} {}'.format(
+                os.path.join(src, 'rootfs'), os.path.join(tmp, 'rootfs')))
+        if out['status'] > 0:
+            utils.get_command_output('sudo rm -rf {}'.format(tmp))
+            raise Exception("Unable to copy container rootfs: "
+                            "{} ({})".format(out['output'],
+                                             out['err'].strip()))
+
+        rootfs = os.path.join(tmp, 'rootfs')
+        utils.get_command_output(
+            'sudo rm -f {0}/etc/ssh/ssh_host_* {0}/var/lib/dbus/machine-id '
+            '&& sudo truncate -s 0 {0}/etc/machine-id'.format(rootfs))
+        os.rename(tmp, dst)
+
     @classmethod
     def start(cls, name, lxc_logfile):
         """ starts lxc container
 
         :param str name: name of container
         """
+        cls.invalidate_ip(name)
+        cls.close_session(name)
         out = utils.get_command_output(
             'sudo lxc-start -n {0} -d -o {1}'.format(name,
                                                      lxc_logfile))
@@ -285,6 +583,8 @@ class LXCContainer:
 
         :param str name: name of container
         """
+        cls.invalidate_ip(name)
+        cls.close_session(name)
         out = utils.get_command_output(
             'sudo lxc-stop -n {0}'.format(name))
 
@@ -300,6 +600,8 @@ class LXCContainer:
 
         :param str name: name of container
         """
+        cls.invalidate_ip(name)
+        cls.close_session(name)
         out = utils.get_command_output(
             'sudo lxc-destroy -n {0}'.format(name))
 
@@ -312,7 +614,7 @@ class LXCContainer:
     @classmethod
     def wait_checked(cls, name, check_logfile, interval=20):
         """waits for container to be in RUNNING state, checking
-        'check_logfile' every 'interval' seconds for error messages.
+        'check_logfile' for error messages whenever it is written.
 
         Intended to be used with container_start, which uses 'lxc-start
         -d', which returns 0 immediately and does not detect errors.
@@ -320,19 +622,47 @@ class LXCContainer:
         returns when the container 'name' is in RUNNING state.
         raises an exception if errors are detected.
         """
-        while True:
-            out = utils.get_command_output('sudo lxc-wait -n {} -s RUNNING '
-                                           '-t {}'.format(name, interval))
-            if out['status'] == 0:
-                return
-            log.debug("{} not RUNNING after {} seconds, "
-                      "checking '{}' for errors".format(name, interval,
-                                                        check_logfile))
-            grepout = utils.get_command_output(
-                'grep -q ERROR {}'.format(check_logfile))
-            if grepout['status'] == 0:
-                raise Exception("Error detected starting container. See {} "
-                                "for details.".format(check_logfile))
+        with FileWatcher(check_logfile, max_interval=interval) as watcher:
+            while True:
+                waiter = subprocess.Popen(
+                    'sudo lxc-wait -n {} -s RUNNING -t {}'.format(name,
+                                                                  interval),
+                    shell=True, stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL)
+                try:
+                    while waiter.poll() is None:
+                        if watcher.wait(timeout=0.5):
+                            cls._check_logfile(check_logfile)
+                finally:
+                    if waiter.poll() is None:
+                        waiter.kill()
+                        waiter.wait()
+                if waiter.returncode == 0:
+                    return
+                log.debug("{} not RUNNING after {} seconds, "
+                          "checking '{}' for errors".format(name, interval,
+                                                            check_logfile))
+                cls._check_logfile(check_logfile)
+
+    @classmethod
+    def _check_logfile(cls, check_logfile):
+        try:
+            with open(check_logfile) as f:
+                contents = f.read()
+        except OSError:
+            return
+        if 'ERROR' in contents:
+            raise Exception("Error detected starting container. See {} "
+                            "for details.".format(check_logfile))
+
+    @classmethod
+    def init_pid(cls, name):
+        out = utils.get_command_output(
+            'sudo lxc-info -n {} -p -H'.format(name))
+        if out['status'] > 0:
+            return None
+        pid = out['output'].strip()
+        return int(pid) if pid.isdigit() else None
 
     @classmethod
     def wait(cls, name):
@@ -345,7 +675,9 @@ class LXCContainer:
         return out['status']
 
 
-class LXDContainer:
+class LXDContainer(ContainerBase):
+    _ip_cache = {}
+    _sessions = {}
 
     @classmethod
     def exists(cls, name):
@@ -367,7 +699,11 @@ class LXDContainer:
         return s
 
     @classmethod
-    def ip(cls, name):
+    def session_attach_cmd(cls, name):
+        return "lxc exec {} -- /bin/sh".format(name)
+
+    @classmethod
+    def _lookup_ip(cls, name):
         try:
             ips = subprocess.check_output("lxc list {}".format(name),
                                           shell=True).decode()
@@ -403,14 +739,12 @@ class LXDContainer:
             ip = cls.ip(name)
             quoted_cmd = shlex.quote(cmd)
             wrapped_cmd = ("sudo -H -u {3} TERM=xterm256-color ssh -t -q "
-                           "-l ubuntu -o \"StrictHostKeyChecking=no\" "
-                           "-o \"UserKnownHostsFile=/dev/null\" "
-                           "-o \"ControlMaster=auto\" "
-                           "-o \"ControlPersist=600\" "
+                           "-l ubuntu {4} "
                            "-i {2} "
                            "{0} {1}".format(ip, quoted_cmd,
                                             utils.ssh_privkey(),
-                                            utils.install_user()))
+                                            utils.install_user(),
+                                            SSH_OPTIONS))
         else:
             quoted_cmd = cmd
             wrapped_cmd = ("lxc exec {container_name} -- "
@@ -479,16 +813,16 @@ class LXDContainer:
         """
         ip = cls.ip(name)
         cmd = ("sudo -H -u {2} TERM=xterm256-color ssh -t -q "
-               "-l ubuntu -o \"StrictHostKeyChecking=no\" "
-               "-o \"UserKnownHostsFile=/dev/null\" "
-               "-o \"ControlMaster=auto\" "
-               "-o \"ControlPersist=600\" "
+               "-l ubuntu {4} "
                "-i {1} "
                "{0} {3}".format(ip, utils.ssh_privkey(),
-                                utils.install_user(), cmd))
+                                utils.install_user(), cmd, SSH_OPTIONS))
         log.debug("Running command without waiting "
                   "for response.: {}".format(cmd))
         args = deque(shlex.split(cmd))
+        # exec skips atexit handlers
+        config.flush()
+        stop_logger()
         os.execlp(args.popleft(), *args)
 
     @classmethod
@@ -513,11 +847,12 @@ class LXDContainer:
                                                cmd))
 
     @classmethod
-    def create(cls, name, userdata):
-        """ creates a container from an image with the alias 'ubuntu'
+    def create(cls, name, userdata, image=None):
+        """ creates a container from an image with the alias 'ubuntu',
+        or from 'image' if given
         """
 
-        imgname = os.getenv("LXD_IMAGE_NAME", "ubuntu")
+        imgname = image or os.getenv("LXD_IMAGE_NAME", "ubuntu")
         out = utils.get_command_output('lxc image list | '
                                        'grep {}'.format(imgname),
                                        user_sudo=True)
@@ -598,6 +933,56 @@ class LXDContainer:
 
         return 0
 
+    @classmethod
+    def image_exists(cls, image):
+        out = utils.get_command_output('lxc image info {}'.format(image),
+                                       user_sudo=True)
+        return out['status'] == 0
+
+    @classmethod
+    def publish_image(cls, name, image):
+        """ publishes a snapshot of a container as image 'image'
+
+        :param str name: name of the container to publish
+        :param str image: alias of the cached image
+        """
+        snapshot = '{}/{}'.format(name, IMAGE_SNAPSHOT_NAME)
+        cmds = ['lxc snapshot {} {}'.format(name, IMAGE_SNAPSHOT_NAME),
+                'lxc publish {} --alias {}'.format(snapshot, image)]
+        try:
+            for cmd in cmds:
+                out = utils.get_command_output(cmd, user_sudo=True)
+                if out['status'] > 0:
+                    raise Exception("Unable to publish image: "
+                                    "out:{}\nerr{}".format(out['output'],
+                                                           out['err']))
+        finally:
+            utils.get_command_output('lxc delete ' + snapshot,
+                                     user_sudo=True)
+
+    @classmethod
+    def list_images(cls):
+        """ returns the aliases of the cached images, oldest first
+        """
+        out = utils.get_command_output('lxc image alias list',
+                                       user_sudo=True)
+        images = []
+        for alias in re.findall(r'\|\s*({}\S+)\s*\|'.format(
+                IMAGE_CACHE_PREFIX), out['output']):
+            info = utils.get_command_output('lxc image info ' + alias,
+                                            user_sudo=True)
+            uploaded = re.search(r'(?m)^Uploaded:\s*(.*)$', info['output'])
+            images.append((uploaded.group(1) if uploaded else '', alias))
+        return [alias for _, alias in sorted(images)]
+
+    @classmethod
+    def delete_image(cls, image):
+        out = utils.get_command_output('lxc image delete ' + image,
+                                       user_sudo=True)
+        if out['status'] > 0:
+            raise Exception("Unable to delete image {}: {}".format(
+                image, out['err']))
+
     @classmethod
     def add_bind_mounts(cls, name, mounts):
         return ["lxc.mount.entry = {} {} "
@@ -633,6 +1018,8 @@ class LXDContainer:
 
         :param str name: name of container
         """
+        cls.invalidate_ip(name)
+        cls.close_session(name)
         out = utils.get_command_output('lxc start ' + name,
                                        user_sudo=True)
 
@@ -648,6 +1035,8 @@ class LXDContainer:
 
         :param str name: name of container
         """
+        cls.invalidate_ip(name)
+        cls.close_session(name)
         out = utils.get_command_output('lxc stop ' + name, user_sudo=True)
 
         if out['status'] > 0:
@@ -662,6 +1051,8 @@ class LXDContainer:
 
         :param str name: name of container
         """
+        cls.invalidate_ip(name)
+        cls.close_session(name)
         out = utils.get_command_output('lxc delete ' + name, user_sudo=True)
 
         if out['status'] > 0:
@@ -679,6 +1070,7 @@ class LXDContainer:
         returns when the container 'name' is in RUNNING state.
         raises an exception if errors are detected.
         """
+        delay = 0.25
         while True:
             cmd = 'lxc info {} | grep Status'.format(name)
             out = utils.get_command_output(cmd, user_sudo=True)
@@ -687,4 +1079,23 @@ class LXDContainer:
             outstr = out['output'].strip()
             if outstr == "Status: Running":
                 return
-            time.sleep(4)
+            time.sleep(delay)
+            delay = min(delay * 2, 4)
+
+    @classmethod
+    def init_pid(cls, name):
+        cmd = 'lxc info {} | grep ^Pid:'.format(name)
+        out = utils.get_command_output(cmd, user_sudo=True)
+        if out['status'] > 0:
+            return None
+        pid = out['output'].strip().split(':')[-1].strip()
+        return int(pid) if pid.isdigit() else None
+
+
+def _close_all_sessions():
+    for cdriver in (LXCContainer, LXDContainer):
+        for name in list(cdriver._sessions):
+            cdriver.close_session(name)
+
+
+atexit.register(_close_all_sessions)
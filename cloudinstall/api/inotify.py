@@ -0,0 +1,152 @@
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" File readiness watcher
+
+Wakes callers up as soon as a file they are waiting on is created or
+written, using inotify through libc. Where inotify is unavailable it
+falls back to polling with a growing interval.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import time
+
+log = logging.getLogger("cloudinstall.api.inotify")
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE_SELF)
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        libname = ctypes.util.find_library('c')
+        if libname is None:
+            return None
+        try:
+            lib = ctypes.CDLL(libname, use_errno=True)
+            lib.inotify_init1
+        except (OSError, AttributeError):
+            return None
+        _libc = lib
+    return _libc
+
+
+class FileWatcher:
+
+    """ Waits for changes to a single file
+
+    The nearest existing directory on the way to the file is watched,
+    so the file (and any of its parent directories) may be created
+    after the watcher.
+
+    :param str path: file to watch, or None to only poll
+    :param float min_interval: first fallback polling interval
+    :param float max_interval: upper bound for fallback polling
+    """
+
+    def __init__(self, path, min_interval=0.1, max_interval=2.0):
+        self.path = path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.fd = None
+        self.watched_dir = None
+
+        libc = _get_libc()
+        if path is None or libc is None:
+            return
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            log.debug("inotify_init1 failed: errno {}".format(
+                ctypes.get_errno()))
+            return
+        self.fd = fd
+        if not self._arm():
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def uses_inotify(self):
+        return self.fd is not None
+
+    def _arm(self):
+        """Adds a watch on the closest existing directory of self.path.
+        """
+        d = os.path.dirname(self.path)
+        while d and not os.path.isdir(d):
+            d = os.path.dirname(d)
+        if not d or d == self.watched_dir:
+            return bool(d)
+        wd = _get_libc().inotify_add_watch(self.fd, d.encode(), WATCH_MASK)
+        if wd < 0:
+            log.debug("inotify_add_watch({}) failed: errno {}".format(
+                d, ctypes.get_errno()))
+            return False
+        self.watched_dir = d
+        return True
+
+    def exists(self):
+        """ False only if the file is known not to exist yet """
+        return self.path is None or os.path.exists(self.path)
+
+    def wait(self, timeout):
+        """ blocks until the watched file may have changed
+
+        :param float timeout: maximum seconds to block
+        :returns: True if something changed (or may have, when
+                  polling), False if the timeout expired
+        """
+        if self.fd is None:
+            time.sleep(min(self.interval, timeout))
+            self.interval = min(self.interval * 2, self.max_interval)
+            return True
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        # a new directory on the way to the file may have appeared
+        self._arm()
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
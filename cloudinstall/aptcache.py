@@ -0,0 +1,409 @@
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Caching apt proxy for single installs
+
+A small HTTP proxy that the single installer runs on the host bridge.
+The top-level container and every Juju machine inside it use it as
+their apt proxy, so each .deb is downloaded from the archive once.
+Package files are cached by file name, which is unique per package
+version, and the cache is prefilled from the host's own apt archives.
+Index files are passed through uncached.
+
+The installer replaces itself with the status screen once the
+container is up, so the proxy runs as a separate process started with
+start() and stopped by openstack-uninstall through its pidfile.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlparse, unquote
+from urllib.request import ProxyHandler, Request, build_opener
+
+log = logging.getLogger('cloudinstall.aptcache')
+
+DEFAULT_PORT = 3142
+DEFAULT_CACHE_DIR = '/var/cache/openstack-installer/apt'
+HOST_ARCHIVES = '/var/cache/apt/archives'
+CACHEABLE_SUFFIXES = ('.deb', '.udeb')
+# request headers worth forwarding for uncached files
+FORWARD_HEADERS = ('If-Modified-Since', 'Range', 'If-Range', 'User-Agent')
+CHUNK_SIZE = 64 * 1024
+
+
+class AptCacheStats:
+
+    """ Counters for cache hits and misses, safe to share between
+    request threads
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.passthrough = 0
+        self.bytes_from_cache = 0
+        self.bytes_from_upstream = 0
+
+    def record(self, kind, nbytes):
+        with self.lock:
+            if kind == 'hit':
+                self.hits += 1
+                self.bytes_from_cache += nbytes
+            elif kind == 'miss':
+                self.misses += 1
+                self.bytes_from_upstream += nbytes
+            else:
+                self.passthrough += 1
+                self.bytes_from_upstream += nbytes
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def as_dict(self):
+        with self.lock:
+            return dict(hits=self.hits,
+                        misses=self.misses,
+                        passthrough=self.passthrough,
+                        bytes_from_cache=self.bytes_from_cache,
+                        bytes_from_upstream=self.bytes_from_upstream,
+                        hit_rate=round(self.hit_rate, 3))
+
+    def summary(self):
+        d = self.as_dict()
+        return ("{hits} hits, {misses} misses ({pct:.0f}% hit rate), "
+                "{mb_cache:.1f}MB served from cache, "
+                "{mb_up:.1f}MB fetched".format(
+                    pct=d['hit_rate'] * 100,
+                    mb_cache=d['bytes_from_cache'] / 2**20,
+                    mb_up=d['bytes_from_upstream'] / 2**20, **d))
+
+
+class AptCache:
+
+    """ On-disk package store
+
+    :param str cache_dir: where cached packages are kept
+    :param str upstream_proxy: proxy URL to fetch through, if any
+    """
+
+    def __init__(self, cache_dir, upstream_proxy=None):
+        self.cache_dir = cache_dir
+        self.stats = AptCacheStats()
+        os.makedirs(cache_dir, exist_ok=True)
+        proxies = {}
+        if upstream_proxy:
+            proxies = {'http': upstream_proxy}
+        # an explicit (possibly empty) mapping keeps us from picking up
+        # an http_proxy environment variable that points back at us
+        self.opener = build_opener(ProxyHandler(proxies))
+
+    def path_for(self, url):
+        """ returns the cache path for url, or None if url is not a
+        package file
+        """
+        name = os.path.basename(unquote(urlparse(url).path))
+        if not name.endswith(CACHEABLE_SUFFIXES) or name.startswith('.'):
+            return None
+        return os.path.join(self.cache_dir, name)
+
+    def prefill(self, archive_dir=HOST_ARCHIVES):
+        """ adds the host's downloaded packages to the cache
+
+        :returns: number of packages added
+        """
+        added = 0
+        try:
+            names = os.listdir(archive_dir)
+        except OSError:
+            return 0
+        for name in names:
+            if not name.endswith(CACHEABLE_SUFFIXES):
+                continue
+            dst = os.path.join(self.cache_dir, name)
+            if os.path.exists(dst):
+                continue
+            src = os.path.join(archive_dir, name)
+            try:
+                os.link(src, dst)
+            except OSError:
+                try:
+                    shutil.copyfile(src, dst)
+                except OSError:
+                    continue
+            added += 1
+        log.info("Prefilled apt cache with {} packages from {}".format(
+            added, archive_dir))
+        return added
+
+    def open_upstream(self, url, headers):
+        return self.opener.open(Request(url, headers=headers), timeout=60)
+
+    def write_stats(self):
+        stats_file = os.path.join(self.cache_dir, 'stats.json')
+        with tempfile.NamedTemporaryFile('w', dir=self.cache_dir,
+                                         delete=False) as f:
+            json.dump(self.stats.as_dict(), f)
+        os.rename(f.name, stats_file)
+
+
+class AptCacheHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def cache(self):
+        return self.server.cache
+
+    def do_GET(self):
+        url = self.path
+        if not url.startswith('http://'):
+            # not a proxy request
+            self.send_error(400, "Only proxy requests are supported")
+            return
+
+        path = self.cache.path_for(url)
+        if path is None:
+            self._passthrough(url)
+        elif os.path.exists(path):
+            self._serve_cached(path)
+        else:
+            self._fetch_and_store(url, path)
+
+    def _serve_cached(self, path):
+        size = os.path.getsize(path)
+        self.send_response(200)
+        self.send_header('Content-Type',
+                         'application/vnd.debian.binary-package')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        self.cache.stats.record('hit', size)
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+
+    def _open(self, url, headers):
+        try:
+            return self.cache.open_upstream(url, headers)
+        except HTTPError as e:
+            self.send_response(e.code)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        except (URLError, OSError) as e:
+            log.debug("upstream error for {}: {}".format(url, e))
+            self.send_error(502, "Upstream fetch failed")
+        return None
+
+    def _fetch_and_store(self, url, path):
+        upstream = self._open(url, {})
+        if upstream is None:
+            return
+        with upstream:
+            self.send_response(upstream.status)
+            length = upstream.getheader('Content-Length')
+            if length is None:
+                self.close_connection = True
+            else:
+                self.send_header('Content-Length', length)
+            self.send_header('Content-Type',
+                             upstream.getheader('Content-Type',
+                                                'application/octet-stream'))
+            self.end_headers()
+            self.cache.stats.record('miss', int(length or 0))
+
+            tmp = tempfile.NamedTemporaryFile(dir=self.cache.cache_dir,
+                                              prefix='.partial-',
+                                              delete=False)
+            nbytes = 0
+            # the last chunk is held back until the file is in the
+            # cache, so a client's next request for it is a hit
+            pending = b''
+            try:
+                with tmp:
+                    while True:
+                        chunk = upstream.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        tmp.write(chunk)
+                        self.wfile.write(pending)
+                        pending = chunk
+                        nbytes += len(chunk)
+                if length is not None and nbytes != int(length):
+                    raise IOError("short read from upstream")
+                os.rename(tmp.name, path)
+            except Exception:
+                os.unlink(tmp.name)
+                raise
+            self.wfile.write(pending)
+
+    def _passthrough(self, url):
+        headers = {k: self.headers[k] for k in FORWARD_HEADERS
+                   if self.headers[k] is not None}
+        upstream = self._open(url, headers)
+        if upstream is None:
+            return
+        with upstream:
+            self.send_response(upstream.status)
+            for k, v in upstream.getheaders():
+                if k.lower() not in ('connection', 'transfer-encoding'):
+                    self.send_header(k, v)
+            if upstream.getheader('Content-Length') is None:
+                self.close_connection = True
+            self.end_headers()
+            self.cache.stats.record(
+                'passthrough', int(upstream.getheader('Content-Length', 0)))
+            shutil.copyfileobj(upstream, self.wfile, CHUNK_SIZE)
+
+    def log_message(self, fmt, *args):
+        log.debug("{} - {}".format(self.address_string(), fmt % args))
+
+
+class AptCacheServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, cache):
+        super().__init__(address, AptCacheHandler)
+        self.cache = cache
+
+
+def pidfile_path(config):
+    return os.path.join(config.cfg_path, 'apt-cache.pid')
+
+
+def _running_pid(pidfile):
+    try:
+        with open(pidfile) as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+        return pid
+    except (OSError, ValueError):
+        return None
+
+
+def _wait_listening(host, port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def start(config, host, port=DEFAULT_PORT, upstream_proxy=None):
+    """ starts the cache proxy in the background unless it is
+    already running
+
+    :param config: Config
+    :param str host: address to listen on, normally the bridge's
+    :param str upstream_proxy: existing apt proxy to fetch through
+    :returns: the proxy URL for apt
+    """
+    pidfile = pidfile_path(config)
+    url = 'http://{}:{}'.format(host, port)
+    if _running_pid(pidfile) is not None:
+        log.debug("apt cache already running at {}".format(url))
+        return url
+
+    cache_dir = config.getopt('apt_cache_dir') or DEFAULT_CACHE_DIR
+    cmd = [sys.executable, '-m', 'cloudinstall.aptcache',
+           '--listen', host, '--port', str(port),
+           '--cache-dir', cache_dir,
+           '--pidfile', pidfile,
+           '--log-file', os.path.join(config.cfg_path, 'apt-cache.log')]
+    if upstream_proxy:
+        cmd += ['--upstream', upstream_proxy]
+    log.info("Starting apt cache at {}: {}".format(url, cmd))
+    subprocess.Popen(cmd, start_new_session=True,
+                     stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL)
+    if not _wait_listening(host, port):
+        raise Exception("apt cache did not start listening on "
+                        "{}, see {}".format(url, os.path.join(
+                            config.cfg_path, 'apt-cache.log')))
+    return url
+
+
+def stop(config):
+    pid = _running_pid(pidfile_path(config))
+    if pid is not None:
+        os.kill(pid, signal.SIGTERM)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Caching apt proxy")
+    parser.add_argument('--listen', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--upstream', default=None)
+    parser.add_argument('--pidfile', default=None)
+    parser.add_argument('--log-file', default=None)
+    parser.add_argument('--stats-interval', type=int, default=30)
+    opts = parser.parse_args(argv)
+
+    logging.basicConfig(filename=opts.log_file, level=logging.INFO,
+                        format="%(asctime)s [%(levelname)s] %(message)s")
+
+    cache = AptCache(opts.cache_dir, opts.upstream)
+    cache.prefill()
+    server = AptCacheServer((opts.listen, opts.port), cache)
+
+    if opts.pidfile:
+        with open(opts.pidfile, 'w') as f:
+            f.write(str(os.getpid()))
+
+    def report():
+        last = None
+        while True:
+            time.sleep(opts.stats_interval)
+            current = cache.stats.as_dict()
+            if current != last:
+                log.info("apt cache: " + cache.stats.summary())
+                cache.write_stats()
+                last = current
+
+    threading.Thread(target=report, daemon=True).start()
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+    try:
+        server.serve_forever()
+    finally:
+        log.info("apt cache stopping: " + cache.stats.summary())
+        cache.write_stats()
+        if opts.pidfile and os.path.exists(opts.pidfile):
+            os.unlink(opts.pidfile)
+
+
+if __name__ == '__main__':
+    main()
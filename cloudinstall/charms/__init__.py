@@ -21,29 +21,49 @@ import yaml
 from queue import Queue
 import shutil
 import subprocess
+import threading
+import time
 import requests
 
 from macumba.errors import MacumbaError, ServerError
 from cloudinstall import async
+from cloudinstall import metrics
 from cloudinstall import utils
+from cloudinstall.log import PrettyLog
 from cloudinstall.service import JujuUnitNotFoundException
 from cloudinstall.placement.controller import AssignmentType
+from cloudinstall.profiler import span
 
 log = logging.getLogger('cloudinstall.charms')
 
 CHARM_CONFIG_FILENAME = path.expanduser("~/.cloud-install/charmconf.yaml")
 
+# filename: (mtime, charm config, raw yaml), shared by all installs in
+# the process
+_charm_config_cache = {}
+_charm_config_lock = threading.Lock()
 
-def get_charm_config():
+
+def get_charm_config(filename=CHARM_CONFIG_FILENAME):
     """Returns charm config as python dict and raw yaml, if the file exists.
     Returns {}, None if the file does not exist.
+
+    The file is only parsed again when it changes.
     """
-    charm_config = {}
-    charm_config_raw = None
-    if path.exists(CHARM_CONFIG_FILENAME):
-        with open(CHARM_CONFIG_FILENAME) as f:
-            charm_config_raw = f.read()
-            charm_config = yaml.load(charm_config_raw)
+    try:
+        mtime = os.stat(filename).st_mtime
+    except FileNotFoundError:
+        return {}, None
+    with _charm_config_lock:
+        cached = _charm_config_cache.get(filename)
+    if cached is not None and cached[0] == mtime:
+        return cached[1], cached[2]
+    with open(filename) as f:
+        charm_config_raw = f.read()
+    charm_config = yaml.load(charm_config_raw)
+    with _charm_config_lock:
+        _charm_config_cache[filename] = (mtime, charm_config,
+                                         charm_config_raw)
     return charm_config, charm_config_raw
 
 
@@ -158,6 +178,12 @@ export OS_REGION_NAME=\"RegionOne\"
         fname = "openstack-{u}-rc".format(u=user)
         return path.join(self.config.cfg_path, fname)
 
+    @property
+    def charm_config_filename(self):
+        """ charmconf.yaml of this install """
+        return (self.config.getopt('charm_config_filename') or
+                CHARM_CONFIG_FILENAME)
+
     def is_related(self, charm, relations):
         """ test for existence of charm relation
 
@@ -217,8 +243,9 @@ export OS_REGION_NAME=\"RegionOne\"
 
         _charm_name_rev = self.charm_name
 
-        charm_config, charm_config_raw = get_charm_config()
-        log.debug("charm_config = {} ".format(charm_config))
+        charm_config, charm_config_raw = get_charm_config(
+            self.charm_config_filename)
+        log.debug("charm_config = %s", PrettyLog(charm_config))
         if self.charm_name in charm_config:
             config_yaml = charm_config_raw
 
@@ -331,9 +358,9 @@ export OS_REGION_NAME=\"RegionOne\"
         if not self.subordinate:
             cmd += ' --to ' + mspec
 
-        charm_config, _ = get_charm_config()
+        charm_config, _ = get_charm_config(self.charm_config_filename)
         if self.charm_name in charm_config:
-            cmd += ' --config ' + CHARM_CONFIG_FILENAME
+            cmd += ' --config ' + self.charm_config_filename
 
         try:
             infostr = ("Deploying {} from local: {}".format(self.charm_name,
@@ -454,14 +481,23 @@ class CharmQueue:
         log.debug("Processing relations: {}".format(valid_relations))
         while len(valid_relations) != len(completed_relations):
             for relation_a, relation_b in valid_relations:
+                metrics.relations.set(len(completed_relations),
+                                      state='added')
+                metrics.relations.set(
+                    len(valid_relations) - len(completed_relations),
+                    state='pending')
                 async.sleep_until(0)
                 try:
                     log.debug("Calling juju.add_relation({}, {})".format(
                         relation_a, relation_b))
-                    self.juju.add_relation(relation_a,
-                                           relation_b)
+                    with span("relation {} {}".format(relation_a,
+                                                      relation_b), 'charm'):
+                        self.juju.add_relation(relation_a,
+                                               relation_b)
                     completed_relations.append((relation_a,
                                                 relation_b))
+                    self.ui.progress_event('relation', a=relation_a,
+                                           b=relation_b)
                 except ServerError as e:
                     msg = ('Failure in add_relation({}, {}): {}'.format(
                         relation_a,
@@ -469,7 +505,11 @@ class CharmQueue:
                         e))
                     log.exception(msg)
                     self.ui.status_info_message(msg)
+                    self.ui.progress_event('relation', a=relation_a,
+                                           b=relation_b, error=str(e))
                     raise e
+        metrics.relations.set(len(completed_relations), state='added')
+        metrics.relations.set(0, state='pending')
         self.config.setopt('relations_complete', True)
 
     def _charm_classes(self):
@@ -487,6 +527,7 @@ class CharmQueue:
     def watch_post_proc(self):
         for charm in self._charm_classes():
             self.charm_post_proc_q.put(charm)
+        metrics.post_proc_queue_depth.set(self.charm_post_proc_q.qsize())
 
         async.sleep_until(0)
 
@@ -494,7 +535,12 @@ class CharmQueue:
         while not self.charm_post_proc_q.empty():
             try:
                 charm = self.charm_post_proc_q.get()
-                charm.post_proc()
+                start = time.time()
+                with span("post_proc " + charm.charm_name, 'charm'):
+                    charm.post_proc()
+                self.ui.progress_event('post_proc',
+                                       service=charm.charm_name,
+                                       seconds=round(time.time() - start, 3))
             except CharmPostNoWorkloadException as e:
                 log.debug(e)
                 self.charm_post_proc_q.task_done()
@@ -502,6 +548,8 @@ class CharmQueue:
                 log.debug(e)
                 self.charm_post_proc_q.put(charm)
                 self.charm_post_proc_q.task_done()
+            metrics.post_proc_queue_depth.set(
+                self.charm_post_proc_q.qsize())
             log.debug("Post processing queue size: {}".format(
                 self.charm_post_proc_q.qsize()))
             async.sleep_until(10)
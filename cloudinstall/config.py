@@ -14,9 +14,17 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import atexit
 import datetime
+import glob
 import os
+import shutil
+import tempfile
+import threading
+import weakref
 import yaml
+from collections import defaultdict
+from contextlib import contextmanager
 import cloudinstall.utils as utils
 import logging
 
@@ -43,8 +51,33 @@ class ConfigException(Exception):
     pass
 
 
+# Configs with changes not written yet, flushed at exit
+_unflushed = weakref.WeakSet()
+
+
+def _flush_all():
+    for config in list(_unflushed):
+        config._flush_logged()
+
+
+atexit.register(_flush_all)
+
+
 class Config:
-    def __init__(self, cfg_obj=None, cfg_file=None, save_backups=True):
+    """ Installer configuration, persisted to config.yaml
+
+    setopt() only marks the configuration dirty; changes made within
+    `flush_delay` seconds of each other are written out together, and
+    transaction() defers writing until a batch of changes is done.
+    Call flush() before handing control to another process.
+
+    With a ConfigStore attached (see attach_store) changes are shared
+    live with other installer processes, and subscribe() callbacks
+    run for changes made here or there.
+    """
+
+    def __init__(self, cfg_obj=None, cfg_file=None, save_backups=True,
+                 flush_delay=0.5, max_backups=10):
         if os.getenv("FAKE_API_DATA"):
             self._juju_env = {"bootstrap-config": {'name': "fake",
                                                    'maas-server': "FAKE"}}
@@ -57,22 +90,185 @@ class Config:
             self._config = cfg_obj
         self._cfg_file = cfg_file
         self.save_backups = save_backups
+        self.flush_delay = flush_delay
+        self.max_backups = max_backups
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._flush_timer = None
+        self._transaction_depth = 0
+        self._store = None
+        self._subscribers = defaultdict(list)
 
     def save(self):
         """ Saves configuration """
+        with self._lock:
+            self._cancel_flush_timer()
+            self._dirty = False
+            _unflushed.discard(self)
+            data = yaml.safe_dump(dict(self._config),
+                                  default_flow_style=False)
+            try:
+                if self.save_backups and os.path.exists(self.cfg_file):
+                    self._backup()
+                self._write_atomic(data)
+            except (IOError, OSError, utils.UtilsException) as e:
+                self._dirty = True
+                _unflushed.add(self)
+                raise ConfigException(
+                    "Unable to save configuration: {}".format(e))
+
+    def _write_atomic(self, data):
+        """ replaces config.yaml through a temporary file, keeping its
+        mode (0644 for a new file) and handing it to the install user
+        """
+        cfg_dir = os.path.dirname(self.cfg_file) or '.'
+        with tempfile.NamedTemporaryFile('w', dir=cfg_dir,
+                                         prefix='.config-',
+                                         delete=False) as f:
+            f.write(data)
+        try:
+            mode = 0o644
+            if os.path.exists(self.cfg_file):
+                mode = os.stat(self.cfg_file).st_mode & 0o7777
+            os.chmod(f.name, mode)
+            self._chown(f.name)
+            os.rename(f.name, self.cfg_file)
+        except (OSError, utils.UtilsException):
+            os.unlink(f.name)
+            raise
+
+    def _chown(self, path):
+        if os.geteuid() == 0:
+            utils.chown(path, utils.install_user(), utils.install_group())
+
+    def _backup(self):
+        """ copies the current file into config-backups, keeping the
+        newest `max_backups` of them
+        """
+        datestr = datetime.datetime.now().strftime("%Y-%m-%d-%H:%M:%S")
+        backup_path = os.path.join(self.cfg_path, "config-backups")
+        backupfilename = "{}/config-{}.yaml".format(backup_path, datestr)
+        os.makedirs(backup_path, exist_ok=True)
+        shutil.copy2(self.cfg_file, backupfilename)
+        self._chown(backupfilename)
+
+        backups = sorted(glob.glob(os.path.join(backup_path,
+                                                "config-*.yaml")))
+        for old in backups[:-self.max_backups]:
+            os.remove(old)
+
+    def flush(self):
+        """ Writes out pending changes now """
+        with self._lock:
+            if self._dirty:
+                self.save()
+
+    @contextmanager
+    def transaction(self):
+        """ Groups several setopt calls into a single write """
+        with self._lock:
+            self._transaction_depth += 1
         try:
-            if self.save_backups and os.path.exists(self.cfg_file):
-                datestr = datetime.datetime.now().strftime("%Y-%m-%d-%H:%M:%S")
-                backup_path = os.path.join(self.cfg_path, "config-backups")
-                backupfilename = "{}/config-{}.yaml".format(backup_path,
-                                                            datestr)
-                os.makedirs(backup_path, exist_ok=True)
-                os.rename(self.cfg_file, backupfilename)
-            utils.spew(self.cfg_file,
-                       yaml.safe_dump(dict(self._config),
-                                      default_flow_style=False))
-        except IOError as e:
-            raise ConfigException("Unable to save configuration: {}".format(e))
+            yield self
+        finally:
+            with self._lock:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    self._schedule_flush()
+
+    def _schedule_flush(self):
+        if not self._dirty:
+            return
+        _unflushed.add(self)
+        if self._transaction_depth > 0:
+            return
+        if self.flush_delay <= 0:
+            self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_delay,
+                                                self._timed_flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _timed_flush(self):
+        with self._lock:
+            self._flush_timer = None
+            self._flush_logged()
+
+    def _flush_logged(self):
+        """ flush for timers and exit, where nobody could handle errors
+        """
+        try:
+            self.flush()
+        except ConfigException as e:
+            log.error(str(e))
+
+    def _cancel_flush_timer(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+    def attach_store(self, store, replace=False):
+        """ Shares this configuration through a ConfigStore
+
+        :param store: ConfigStore
+        :param bool replace: make these values the whole store, as a
+                             new install does; otherwise the store's
+                             values win and only keys it lacks are
+                             added to it
+        """
+        with self._lock:
+            if replace:
+                store.update(dict(self._config), replace=True)
+            else:
+                stored = store.get_all()
+                self._config.update(stored)
+                store.update({k: v for k, v in self._config.items()
+                              if k not in stored})
+            self._store = store
+        store.subscribe(None, self._on_store_change)
+        store.start_watching()
+
+    def open_store(self, replace=False):
+        """ Attaches the ConfigStore at store_path, falling back to
+        config.yaml alone if it can't be used
+
+        :returns: True if the store is attached
+        """
+        from cloudinstall.configstore import ConfigStore
+        try:
+            store = ConfigStore(self.store_path)
+            self.attach_store(store, replace=replace)
+        except Exception:
+            log.exception("Unable to open config store {}, continuing "
+                          "without it".format(self.store_path))
+            return False
+        # both root and the install user's status screen write to it
+        for suffix in ('', '-wal', '-shm'):
+            fname = self.store_path + suffix
+            if os.path.exists(fname) and os.geteuid() == 0:
+                utils.chown(fname, utils.install_user(),
+                            utils.install_group())
+        return True
+
+    def _on_store_change(self, key, val):
+        with self._lock:
+            self._config[key] = val
+        self._notify(key, val)
+
+    def subscribe(self, key, callback):
+        """ calls callback(key, value) whenever key changes """
+        with self._lock:
+            self._subscribers[key].append(callback)
+
+    def _notify(self, key, val):
+        with self._lock:
+            callbacks = list(self._subscribers.get(key, []))
+        for cb in callbacks:
+            try:
+                cb(key, val)
+            except Exception:
+                log.exception("config subscriber failed for {}".format(key))
 
     def install_types(self):
         """ Installer types
@@ -114,10 +310,18 @@ class Config:
         """ scripts located in non-default system path """
         return os.path.join(self.share_path, "bin")
 
+    @property
+    def store_path(self):
+        return os.path.join(self.cfg_path, 'config.db')
+
     @property
     def placements_filename(self):
         return os.path.join(self.cfg_path, 'placements.yaml')
 
+    @property
+    def charm_config_filename(self):
+        return os.path.join(self.cfg_path, 'charmconf.yaml')
+
     def is_single(self):
         if self.getopt('install_type') and \
            INSTALL_TYPE_SINGLE[0] in self.getopt('install_type'):
@@ -139,10 +343,15 @@ class Config:
     def setopt(self, key, val):
         """ sets config option """
         try:
-            self._config[key] = val
-            self.save()
+            with self._lock:
+                self._config[key] = val
+                self._dirty = True
+                self._schedule_flush()
+                if self._store is not None:
+                    self._store.set(key, val)
         except Exception as e:
             log.error("Failed to set {} in config: {}".format(key, e))
+        self._notify(key, val)
 
     def getopt(self, key):
         if key in self._config:
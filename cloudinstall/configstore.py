@@ -0,0 +1,203 @@
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Shared configuration store
+
+A small SQLite key/value table that openstack-install and
+openstack-status (running on the host or in the single install
+container, which shares ~/.cloud-install) use as the live copy of the
+configuration. Each write bumps a serial, kept in the meta table so
+it never goes backwards, and readers fetch only the keys written since
+the serial they last saw. A watcher on the database's write-ahead log
+tells subscribers about changes made by other processes.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+from collections import defaultdict
+
+from cloudinstall.api.inotify import FileWatcher
+
+log = logging.getLogger('cloudinstall.configstore')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS config (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    serial INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class ConfigStore:
+
+    """ Change-notifying key/value store shared between processes
+
+    :param str path: database file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30,
+                                     isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        # PRAGMA data_version needs SQLite 3.8.8, older versions (trusty
+        # has 3.8.2) return nothing and changes() polls the serial
+        self._has_data_version = self._conn.execute(
+            "PRAGMA data_version").fetchone() is not None
+        self._data_version = None
+        self._serial = self._max_serial()
+        # serials of our own writes, which are not reported back to us
+        self._written = {}
+        self._subscribers = defaultdict(list)
+        self._watch_thread = None
+        self._watching = False
+
+    def _max_serial(self):
+        """ the last serial written, which survives replacing every key
+        """
+        row = self._conn.execute(
+            "SELECT MAX(COALESCE((SELECT value FROM meta "
+            "WHERE key = 'serial'), 0), "
+            "COALESCE((SELECT MAX(serial) FROM config), 0))").fetchone()
+        return row[0]
+
+    def get_all(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM config").fetchall()
+        return {k: json.loads(v) for k, v in rows}
+
+    def set(self, key, value):
+        self.update({key: value})
+
+    def update(self, values, replace=False):
+        """ writes several keys in one transaction
+
+        :param dict values: keys and values to write
+        :param bool replace: drop all other keys first
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if replace:
+                    self._conn.execute("DELETE FROM config")
+                serial = self._max_serial()
+                written = {}
+                for key, value in values.items():
+                    serial += 1
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO config (key, value, serial) "
+                        "VALUES (?, ?, ?)", (key, json.dumps(value), serial))
+                    written[key] = serial
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) "
+                    "VALUES ('serial', ?)", (serial,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._written.update(written)
+
+    def subscribe(self, key, callback):
+        """ calls callback(key, value) when key is changed by another
+        process; key None subscribes to every key
+        """
+        with self._lock:
+            self._subscribers[key].append(callback)
+
+    def unsubscribe(self, key, callback):
+        with self._lock:
+            self._subscribers[key].remove(callback)
+
+    def changes(self):
+        """ returns {key: value} for keys written by other processes
+        since the last call
+        """
+        with self._lock:
+            # data_version only moves when another connection commits,
+            # so this is cheap when nothing happened
+            if self._has_data_version:
+                version = self._conn.execute(
+                    "PRAGMA data_version").fetchone()[0]
+            else:
+                version = self._max_serial()
+            if version == self._data_version:
+                return {}
+            self._data_version = version
+            rows = self._conn.execute(
+                "SELECT key, value, serial FROM config WHERE serial > ?",
+                (self._serial,)).fetchall()
+            if rows:
+                self._serial = max(r[2] for r in rows)
+            rows = [(k, v) for k, v, serial in rows
+                    if self._written.get(k) != serial]
+        return {k: json.loads(v) for k, v in rows}
+
+    def poll(self):
+        """ dispatches changes from other processes to subscribers
+
+        :returns: the changed keys and values
+        """
+        changed = self.changes()
+        for key, value in changed.items():
+            with self._lock:
+                callbacks = (self._subscribers.get(key, []) +
+                             self._subscribers.get(None, []))
+            for cb in callbacks:
+                try:
+                    cb(key, value)
+                except Exception:
+                    log.exception("config subscriber failed for "
+                                  "{}".format(key))
+        return changed
+
+    def start_watching(self):
+        """ polls in a background thread whenever the database's
+        write-ahead log is written
+        """
+        if self._watch_thread is not None:
+            return
+        self._watching = True
+        self._watch_thread = threading.Thread(target=self._watch,
+                                              daemon=True)
+        self._watch_thread.start()
+
+    def _watch(self):
+        with FileWatcher(self.path + '-wal', max_interval=1) as watcher:
+            while self._watching:
+                watcher.wait(timeout=1)
+                try:
+                    self.poll()
+                except sqlite3.Error:
+                    log.exception("Error reading config store")
+
+    def close(self):
+        self._watching = False
+        if self._watch_thread is not None:
+            self._watch_thread.join(2)
+            self._watch_thread = None
+        with self._lock:
+            self._conn.close()
@@ -26,18 +26,34 @@ log = logging.getLogger('cloudinstall.consoleui')
 
 class ConsoleUI:
 
-    def __init__(self):
+    def __init__(self, progress=None):
+        """
+        :param progress: ProgressStream to send progress events to, see
+            cloudinstall.progress
+        """
         self._missing_attrs = []
+        self.progress = progress
 
     def tasker(self, loop, config):
         """ Return console tasker """
         return TaskerConsole(self, loop, config)
 
+    def progress_event(self, event, **fields):
+        if self.progress is not None:
+            self.progress.emit(event, **fields)
+
     def status_info_message(self, msg):
         log.info(msg)
+        self.progress_event('status', message=msg)
 
     def status_error_message(self, msg):
         log.error(msg)
+        self.progress_event('error', message=msg)
+
+    def show_exception_message(self, ex):
+        log.error("Error in headless install: {}".format(ex), exc_info=ex)
+        self.progress_event('error', message=str(ex),
+                            exception=type(ex).__name__)
 
     def clear_status(self):
         pass
@@ -47,8 +63,9 @@ class ConsoleUI:
 
     def set_pending_deploys(self, names):
         if len(names) > 0:
-            names = ", ".join(names)
-            log.info("Pending charms to deploy: {}".format(names))
+            log.info("Pending charms to deploy: {}".format(
+                ", ".join(names)))
+        self.progress_event('pending_deploys', services=list(names))
 
     def __getattr__(self, attr):
         """
@@ -31,6 +31,7 @@ from cloudinstall.netutils import get_ip_set
 
 from cloudinstall import utils
 from cloudinstall.config import INSTALL_TYPE_MULTI
+from cloudinstall.log import stop_logger
 
 
 log = logging.getLogger('cloudinstall.c.i.multi')
@@ -171,6 +172,9 @@ class MultiInstall:
             if self.config.getopt('edit_placement'):
                 args.append('--edit-placement')
 
+            # exec skips atexit handlers
+            self.config.flush()
+            stop_logger()
             self.drop_privileges()
             os.execvp('openstack-status', args)
         else:
@@ -15,25 +15,32 @@
 
 """ Single Install Controller """
 
+import datetime
 import glob
+import hashlib
 from ipaddress import IPv4Network
 import logging
 import os
 import json
 from tempfile import NamedTemporaryFile
-import time
 import platform
+import re
 import shutil
 from subprocess import call, check_call, check_output, STDOUT
-from cloudinstall import async, utils, netutils
+from cloudinstall import aptcache, async, utils, netutils, __version__
 from cloudinstall.config import INSTALL_TYPE_SINGLE
-from cloudinstall.api.container import (LXCContainer, LXDContainer,
+from cloudinstall.api.container import (IMAGE_CACHE_PREFIX,
+                                        LXCContainer, LXDContainer,
                                         NoContainerIPException,
                                         ContainerRunException)
+from cloudinstall.api.inotify import FileWatcher
 
 
 log = logging.getLogger('cloudinstall.c.i.single')
 
+# kvm cloud images synced longer ago than this are refreshed
+KVM_IMAGE_MAX_AGE = datetime.timedelta(days=30)
+
 
 class SingleInstallException(Exception):
     pass
@@ -66,15 +73,30 @@ class SingleInstall:
 
     def setup_apt_proxy(self):
         "Use http_proxy unless apt_proxy is explicitly set"
-        apt_proxy = self.config.getopt('apt_proxy')
-        http_proxy = self.config.getopt('http_proxy')
-        if not apt_proxy and http_proxy:
-            self.config.setopt('apt_proxy', http_proxy)
-
-        apt_https_proxy = self.config.getopt('apt_https_proxy')
-        https_proxy = self.config.getopt('https_proxy')
-        if not apt_https_proxy and https_proxy:
-            self.config.setopt('apt_https_proxy', https_proxy)
+        with self.config.transaction():
+            apt_proxy = self.config.getopt('apt_proxy')
+            http_proxy = self.config.getopt('http_proxy')
+            if not apt_proxy and http_proxy:
+                self.config.setopt('apt_proxy', http_proxy)
+
+            apt_https_proxy = self.config.getopt('apt_https_proxy')
+            https_proxy = self.config.getopt('https_proxy')
+            if not apt_https_proxy and https_proxy:
+                self.config.setopt('apt_https_proxy', https_proxy)
+
+        if self.config.getopt('apt_cache'):
+            self.setup_apt_cache()
+
+    def setup_apt_cache(self):
+        """ Starts the package cache on the container bridge and points
+        apt at it, chaining to any proxy configured so far
+        """
+        bridge_ip = netutils.get_ip_addr('uoibr0')
+        if bridge_ip is None:
+            raise Exception("Unable to find uoibr0 address for apt cache")
+        url = aptcache.start(self.config, bridge_ip,
+                             upstream_proxy=self.config.getopt('apt_proxy'))
+        self.config.setopt('apt_proxy', url)
 
     def _proxy_pollinate(self):
         """ Proxy pollinate if http/s proxy is set """
@@ -138,6 +160,30 @@ class SingleInstall:
                    single_env_modified,
                    owner=utils.install_user())
 
+    def image_cache_alias(self):
+        """ name of the cached container image for this install
+
+        Keyed by host series, the candidate versions of the packages
+        installed into the container and the rendered userdata, so
+        any change to those builds a fresh image.
+
+        Returns None if image caching is disabled.
+        """
+        if self.config.getopt('no_image_cache'):
+            return None
+        out = utils.get_command_output('apt-cache policy openstack '
+                                       'openstack-single')
+        versions = [line.strip() for line in out['output'].splitlines()
+                    if line.strip().startswith('Candidate:')]
+
+        h = hashlib.sha1()
+        h.update(__version__.encode())
+        h.update(platform.linux_distribution()[2].encode())
+        h.update("\n".join(versions).encode())
+        with open(self.userdata, 'rb') as f:
+            h.update(f.read())
+        return IMAGE_CACHE_PREFIX + h.hexdigest()[:12]
+
     def write_lxc_net_config(self):
         """Finds and configures a new subnet for the host container,
         to avoid overlapping with IPs used for Neutron.
@@ -161,10 +207,15 @@ class SingleInstall:
         log.info("Writing lxc-net config for {}".format(name))
         ctype = self.config.getopt('topcontainer_type')
         if ctype == 'lxc':
-            container_abspath = os.path.join(self.cdriver.container_root,
-                                             name)
-            lxc_net_filename = os.path.join(container_abspath,
-                                            'rootfs/etc/default/lxc-net')
+            # containers cloned from a cached image have an overlay
+            # rootfs that is only mounted inside the container
+            lxc_net_filename = self.cdriver.host_path(
+                name, '/etc/default/lxc-net')
+            if lxc_net_filename is None:
+                container_abspath = os.path.join(
+                    self.cdriver.container_root, name)
+                lxc_net_filename = os.path.join(
+                    container_abspath, 'rootfs/etc/default/lxc-net')
             utils.spew(lxc_net_filename, lxc_net)
         elif ctype == 'lxd':
             with NamedTemporaryFile() as lxcnettmp:
@@ -199,7 +250,15 @@ class SingleInstall:
         """
         self.tasker.start_task("Creating Container",
                                self.read_container_status)
-        self.cdriver.create(self.container_name, self.userdata)
+        image = self.image_cache_alias()
+        if image is not None and self.cdriver.image_exists(image):
+            log.info("Creating container from cached image {}".format(image))
+            self.cdriver.create(self.container_name, self.userdata,
+                                image=image)
+            publish = False
+        else:
+            self.cdriver.create(self.container_name, self.userdata)
+            publish = image is not None
 
         mounts = [(self.config.cfg_path, 'home/ubuntu/.cloud-install', "dir")]
         topcontainer_type = self.config.getopt("topcontainer_type")
@@ -247,10 +306,19 @@ class SingleInstall:
 
         self.tasker.start_task("Initializing Container",
                                self.read_cloud_init_output)
+        # wake up as soon as cloud-init writes its result instead of
+        # polling the container every second
+        result_path = self.cdriver.host_path(self.container_name,
+                                             '/run/cloud-init/result.json')
         tries = 0
-        while not self.cloud_init_finished(tries):
-            time.sleep(1)
-            tries += 1
+        with FileWatcher(result_path, min_interval=0.25,
+                         max_interval=1) as watcher:
+            while True:
+                if watcher.exists():
+                    if self.cloud_init_finished(tries):
+                        break
+                    tries += 1
+                watcher.wait(timeout=1)
 
         # we do this here instead of using cloud-init, for greater
         # control over ordering
@@ -282,13 +350,70 @@ class SingleInstall:
                          output_cb=self.set_progress_output)
         log.debug("done installing deps")
 
+        self.sync_kvm_image()
+
+        if publish:
+            self.set_progress_output("Caching container image for "
+                                     "future installs")
+            try:
+                self.cdriver.publish_image(self.container_name, image)
+                log.info("Cached container image as {}".format(image))
+            except Exception:
+                # a missing cache only costs the next install time
+                log.exception("Unable to cache container image")
+            self.cdriver.prune_images(in_use=image)
+
+    def sync_kvm_image(self):
+        """ Fetches the cloud image Juju's kvm machines are built from
+
+        uvtool creates each machine as a qcow2 overlay backed by this
+        image, so with it in place (and kept in the cached container
+        image) machines come up in seconds and share its disk pages.
+        Juju syncs it on first use otherwise.
+
+        Skipped if the container, typically cloned from a cached image,
+        already has an image for the series newer than
+        KVM_IMAGE_MAX_AGE.
+        """
+        series = self.config.getopt('ubuntu_series')
+        synced = self.kvm_image_date(series)
+        if synced is not None and \
+           datetime.date.today() - synced <= KVM_IMAGE_MAX_AGE:
+            log.debug("{} kvm image from {} is current, not "
+                      "syncing".format(series, synced))
+            return
+        self.set_progress_output("Syncing {} kvm image".format(series))
+        try:
+            self.cdriver.run(self.container_name,
+                             "sudo uvt-simplestreams-libvirt sync "
+                             "release={} arch=amd64".format(series),
+                             output_cb=self.set_progress_output)
+        except Exception:
+            log.exception("Unable to sync kvm image, leaving it to Juju")
+
+    def kvm_image_date(self, series):
+        """ returns the release date of the synced kvm image for series,
+        or None if there is none
+        """
+        try:
+            out = self.cdriver.probe(self.container_name,
+                                     "uvt-simplestreams-libvirt query "
+                                     "release={} arch=amd64".format(series))
+        except ContainerRunException:
+            return None
+        # lines look like: release=xenial arch=amd64 label=release (20160420.3)
+        serials = re.findall(r'\((\d{8})[^)]*\)', out)
+        if not serials:
+            return None
+        return datetime.datetime.strptime(max(serials), '%Y%m%d').date()
+
     def read_container_status(self):
         return self.cdriver.get_status(self.container_name)
 
     def read_cloud_init_output(self):
         try:
-            s = self.cdriver.run(self.container_name, 'tail -n 10 '
-                                 '/var/log/cloud-init-output.log')
+            s = self.cdriver.probe(self.container_name, 'tail -n 10 '
+                                   '/var/log/cloud-init-output.log')
             return s.replace('\r', '')
         except Exception:
             return "Waiting..."
@@ -301,9 +426,9 @@ class SingleInstall:
 
     def read_juju_log(self):
         try:
-            return self.cdriver.run(self.container_name, 'tail -n 10 '
-                                    '/var/log/juju-ubuntu-local'
-                                    '/all-machines.log')
+            return self.cdriver.probe(self.container_name, 'tail -n 10 '
+                                      '/var/log/juju-ubuntu-local'
+                                      '/all-machines.log')
         except Exception:
             return "Waiting..."
 
@@ -321,7 +446,7 @@ class SingleInstall:
         """
         cmd = 'sh -c "sudo cat /run/cloud-init/result.json 2> /dev/null"'
         try:
-            result_json = self.cdriver.run(self.container_name, cmd)
+            result_json = self.cdriver.probe(self.container_name, cmd)
 
         except NoContainerIPException as e:
             log.debug("Container has no IPs according to lxc-info. "
@@ -101,7 +101,6 @@ class InstallController:
             pass
         elif self.config.getopt('current_state') == InstallState.NODE_WAIT:
             self.ui.render_machine_wait_view(self.config)
-            self.loop.redraw_screen()
 
         AlarmMonitor.add_alarm(self.loop.set_alarm_in(1, self.update),
                                "installcontroller-update")
@@ -13,7 +13,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import json
 import logging
+import os
 import time
 
 from os import path, getenv
@@ -22,35 +24,43 @@ from operator import attrgetter
 
 from cloudinstall import async
 from cloudinstall.config import OPENSTACK_RELEASE_LABELS
+from cloudinstall import metrics
 from cloudinstall import utils
 from cloudinstall.alarms import AlarmMonitor
 from cloudinstall.state import ControllerState
-from cloudinstall.juju import JujuState
+from cloudinstall.status import start_sync_status_listener
+from cloudinstall.juju import JujuClient, JujuState
 from cloudinstall.maas import (connect_to_maas, FakeMaasState,
                                MaasMachineStatus)
 from cloudinstall.charms import CharmQueue
 from cloudinstall.log import PrettyLog
 from cloudinstall.placement.controller import (PlacementController,
                                                AssignmentType)
+from cloudinstall.profiler import profiler, span, TracedProxy
 
-from macumba.v1 import JujuClient
 from macumba.jobs import Jobs as JujuJobs
 
 
 log = logging.getLogger('cloudinstall.core')
 
 
-class FakeJujuState:
+class FakeJujuState(JujuState):
 
-    @property
-    def services(self):
-        return []
+    """ Juju status read from FAKE_API_DATA/juju-status.json, or an
+    empty environment if there is no such file
+    """
 
-    def machines(self):
-        return []
+    def __init__(self):
+        super().__init__(juju=None)
 
-    def invalidate_status_cache(self):
-        "does nothing"
+    def status(self):
+        if self._juju_status is None:
+            fn = path.join(getenv("FAKE_API_DATA"), "juju-status.json")
+            self._juju_status = {}
+            if path.exists(fn):
+                with open(fn) as f:
+                    self._juju_status = json.load(f)
+        return self._juju_status
 
 
 class Controller:
@@ -70,9 +80,43 @@ class Controller:
         self.juju_m_idmap = None  # for single, {instance_id: machine id}
         self.deployed_charm_classes = []
         self.placement_controller = None
+        # write_profile only writes the spans of threads of this name,
+        # set by the orchestrator as its deployments share the profiler
+        self.profile_thread = None
+        # unit name: agent state last sent as a progress event
+        self.unit_states = {}
         if not self.config.getopt('current_state'):
             self.config.setopt('current_state',
                                ControllerState.INSTALL_WAIT.value)
+        # phase changes arrive on deploy and config store threads and
+        # are passed to the event loop through this pipe
+        self._phase_pipe = None
+        if not self.config.getopt('headless'):
+            self._phase_pipe = self.loop.watch_pipe(self._phase_ready)
+        for key in ['deploy_complete', 'relations_complete',
+                    'postproc_complete']:
+            self.config.subscribe(key, self.phase_changed)
+
+    def phase_changed(self, key, value):
+        """ Config subscriber for the deployment phase flags """
+        if self._phase_pipe is None:
+            self.ui.update_phase_status(self.config)
+        else:
+            os.write(self._phase_pipe, b'.')
+        self.write_profile()
+
+    def _phase_ready(self, data):
+        self.ui.update_phase_status(self.config)
+
+    def write_profile(self):
+        """ Writes the spans recorded so far, see cloudinstall.profiler
+        """
+        try:
+            profiler.write(path.join(self.config.cfg_path, 'trace.json'),
+                           path.join(self.config.cfg_path, 'trace.folded'),
+                           self.profile_thread)
+        except OSError:
+            log.exception("Unable to write profile")
 
     def update(self, *args, **kwargs):
         """Render UI according to current state and reset timer
@@ -107,7 +151,6 @@ class Controller:
             raise Exception("Internal error, unexpected display "
                             "state '{}'".format(current_state))
 
-        self.loop.redraw_screen()
         AlarmMonitor.add_alarm(self.loop.set_alarm_in(interval, self.update),
                                "core-controller-update")
 
@@ -121,6 +164,8 @@ class Controller:
         deployed_services = sorted(self.juju_state.services,
                                    key=attrgetter('service_name'))
         deployed_service_names = [s.service_name for s in deployed_services]
+        if 'glance-simplestreams-sync' in deployed_service_names:
+            start_sync_status_listener(self.loop, self.config)
 
         charm_classes = sorted(
             [m.__charm_class__ for m in
@@ -148,9 +193,9 @@ class Controller:
         else:
             state_server = self.config.juju_env['state-servers'][0]
         url = path.join('wss://', state_server, 'environment', uuid, 'api')
-        self.juju = JujuClient(
+        self.juju = TracedProxy(JujuClient(
             url=url,
-            password=self.config.juju_api_password)
+            password=self.config.juju_api_password), 'juju')
         self.juju.login()
         self.juju_state = JujuState(self.juju)
         log.debug('Authenticated against Juju: {}'.format(url))
@@ -213,6 +258,17 @@ class Controller:
 
         if self.config.getopt('edit_placement') or \
            not self.placement_controller.can_deploy():
+            if self.config.getopt('headless'):
+                # there's no placement screen to finish the placement on
+                if self.config.getopt('edit_placement'):
+                    msg = "Placement can't be edited in headless mode"
+                else:
+                    msg = ("Unable to deploy, required services are not "
+                           "placed on enough machines")
+                self.ui.status_error_message(msg)
+                self.ui.progress_event('finished', status='error',
+                                       error=msg)
+                self.loop.exit(1)
             self.config.setopt(
                 'current_state', ControllerState.PLACEMENT.value)
         else:
@@ -258,6 +314,7 @@ class Controller:
             if summary != _previous_summary:
                 self.ui.status_info_message("Waiting for machines to "
                                             "start: {}".format(summary))
+                self.ui.progress_event('machines', summary=dict(sd))
                 _previous_summary = summary
 
             async.sleep_until(1)
@@ -342,9 +399,8 @@ class Controller:
             machine_params.append(mp)
 
         if len(machine_params) > 0:
-            import pprint
-            log.debug("calling add_machines with params:"
-                      " {}".format(pprint.pformat(machine_params)))
+            log.debug("calling add_machines with params: %s",
+                      PrettyLog(machine_params))
             rv = self.juju.add_machines(machine_params)
             log.debug("add_machines returned '{}'".format(rv))
 
@@ -435,6 +491,7 @@ class Controller:
         def update_pending_display():
             pending_names = [c.display_name for c in
                              undeployed_charm_classes()]
+            metrics.pending_deploys.set(len(pending_names))
             self.ui.set_pending_deploys(pending_names)
 
         while len(undeployed_charm_classes()) > 0:
@@ -472,8 +529,8 @@ class Controller:
             num_remaining = len(undeployed_charm_classes())
             if num_remaining > 0:
                 log.debug("{} charms pending deploy.".format(num_remaining))
-                log.debug("deployed_charm_classes={}".format(
-                    PrettyLog(self.deployed_charm_classes)))
+                log.debug("deployed_charm_classes=%s",
+                          PrettyLog(list(self.deployed_charm_classes)))
 
                 async.sleep_until(5)
             update_pending_display()
@@ -501,7 +558,13 @@ class Controller:
                     if mspec != '':
                         msg += " to machine {mspec}".format(mspec=mspec)
                     self.ui.status_info_message(msg)
-                    deploy_err = charm.deploy(mspec)
+                    start = time.time()
+                    with span("deploy " + charm.charm_name, 'charm'):
+                        deploy_err = charm.deploy(mspec)
+                    self.ui.progress_event(
+                        'deploy', service=charm.charm_name, machine=mspec,
+                        action='deploy', seconds=round(time.time() - start, 3),
+                        error=bool(deploy_err))
                     if deploy_err:
                         errs.append(machine)
                     else:
@@ -513,7 +576,13 @@ class Controller:
                     if mspec != '':
                         msg += " to machine {mspec}".format(mspec=mspec)
                     self.ui.status_info_message(msg)
+                    start = time.time()
                     deploy_err = charm.add_unit(machine_spec=mspec)
+                    self.ui.progress_event(
+                        'deploy', service=charm.charm_name, machine=mspec,
+                        action='add_unit',
+                        seconds=round(time.time() - start, 3),
+                        error=bool(deploy_err))
                     if deploy_err:
                         errs.append(machine)
                 if not deploy_err:
@@ -569,6 +638,7 @@ class Controller:
 
         not_ready_len = 0
         while not self.juju_state.all_agents_started():
+            self.report_unit_states()
             not_ready = [(a, b) for a, b in self.juju_state.get_agent_states()
                          if b != 'started']
             if len(not_ready) == not_ready_len:
@@ -580,10 +650,28 @@ class Controller:
                 ", ".join(["{}:{}".format(a, b) for a, b in not_ready])))
             async.sleep_until(3)
 
+        self.report_unit_states()
         self.config.setopt('deploy_complete', True)
         self.ui.status_info_message(
             "Processing relations and finalizing services")
 
+    def report_unit_states(self):
+        """ Sends a unit_state progress event for each unit whose agent
+        state changed since the last call
+        """
+        for svc in self.juju_state.services:
+            for u in svc.units:
+                state = u.agent_state
+                previous = self.unit_states.get(u.unit_name)
+                if state == previous:
+                    continue
+                self.unit_states[u.unit_name] = state
+                self.ui.progress_event('unit_state', unit=u.unit_name,
+                                       service=svc.service_name,
+                                       machine=u.machine_id, state=state,
+                                       previous=previous,
+                                       workload=u.workload_state)
+
     def enqueue_deployed_charms(self):
         """Send all deployed charms to CharmQueue for relation setting and
         post-proc.
@@ -613,6 +701,7 @@ class Controller:
                 # time.sleep(10)
             self.ui.status_info_message(
                 "All services deployed, relations set, and started")
+            self.ui.progress_event('finished', status='ok')
             self.loop.exit(0)
 
         session_id = self.config.getopt('session_id')
@@ -654,17 +743,30 @@ class Controller:
     def start(self):
         """ Starts UI loop
         """
-        if self.config.getopt('headless'):
-            self.initialize()
-        else:
-            self.ui.status_info_message("Welcome")
-            rel = self.config.getopt('openstack_release')
-            label = OPENSTACK_RELEASE_LABELS[rel]
-            self.ui.set_openstack_rel(label)
-            self.initialize()
-            self.loop.register_callback('refresh_display', self.update)
-            AlarmMonitor.add_alarm(self.loop.set_alarm_in(0, self.update),
-                                   "controller-start")
-            self.config.setopt("gui_started", True)
-            self.loop.run()
-            self.loop.close()
+        metrics_port = self.config.getopt('metrics_port')
+        if metrics_port:
+            try:
+                metrics.start_http_server(int(metrics_port))
+            except OSError:
+                log.exception("Unable to serve metrics on port {}".format(
+                    metrics_port))
+        try:
+            if self.config.getopt('headless'):
+                self.initialize()
+            else:
+                self.ui.status_info_message("Welcome")
+                rel = self.config.getopt('openstack_release')
+                label = OPENSTACK_RELEASE_LABELS[rel]
+                self.ui.set_openstack_rel(label)
+                self.initialize()
+                self.loop.register_callback('refresh_display', self.update)
+                AlarmMonitor.add_alarm(
+                    self.loop.set_alarm_in(0, self.update),
+                    "controller-start")
+                self.config.setopt("gui_started", True)
+                self.loop.run()
+                self.loop.close()
+        finally:
+            # headless installs end here with sys.exit(), once finished
+            # or on errors, keep the spans since the last phase change
+            self.write_profile()
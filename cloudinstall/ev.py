@@ -15,7 +15,9 @@
 
 import urwid
 import sys
+import time
 from cloudinstall import async
+from cloudinstall import metrics
 from cloudinstall.state import ControllerState
 import asyncio
 from cloudinstall.ui.palette import STYLES
@@ -24,6 +26,58 @@ import logging
 
 log = logging.getLogger('cloudinstall.ev')
 
+# default for the max_fps config option
+MAX_FPS = 10
+
+
+class ThrottledMainLoop(urwid.MainLoop):
+
+    """ MainLoop that only draws the screen when what is on it changed,
+    at most max_fps times a second
+
+    urwid draws on every pass through the event loop. Here the idle
+    handler renders the top widget, which is a lookup in urwid's canvas
+    cache unless a widget on screen was invalidated, and only draws
+    when that gives a new canvas. Input and request_redraw() force the
+    next frame. Frames are at least 1/max_fps s apart, so bursts of
+    updates are coalesced into one frame.
+    """
+
+    def __init__(self, *args, max_fps=MAX_FPS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frame_interval = 1.0 / max_fps if max_fps else 0
+        self.dirty = True
+        self.last_draw = 0
+        self.canvas = None
+
+    def request_redraw(self):
+        self.dirty = True
+
+    def process_input(self, keys):
+        self.dirty = True
+        return super().process_input(keys)
+
+    def entering_idle(self):
+        if not self.screen.started:
+            return
+        if time.monotonic() - self.last_draw < self.frame_interval:
+            return
+        if not self.dirty and self.screen_size and \
+           self.canvas is self._topmost_widget.render(self.screen_size,
+                                                      focus=True):
+            return
+        self.draw_screen()
+
+    def draw_screen(self):
+        self.dirty = False
+        self.last_draw = time.monotonic()
+        if not self.screen_size:
+            self.screen_size = self.screen.get_cols_rows()
+        self.canvas = self._topmost_widget.render(self.screen_size,
+                                                  focus=True)
+        self.screen.draw_screen(self.screen_size, self.canvas)
+        metrics.ui_frame_seconds.observe(time.monotonic() - self.last_draw)
+
 
 class EventLoop:
 
@@ -61,9 +115,11 @@ class EventLoop:
         additional_opts['screen'].set_terminal_properties(colors=256)
         additional_opts['screen'].reset_default_terminal_palette()
         evl = asyncio.get_event_loop()
-        return urwid.MainLoop(
+        return ThrottledMainLoop(
             self.ui, STYLES,
-            event_loop=urwid.AsyncioEventLoop(loop=evl), **additional_opts)
+            event_loop=urwid.AsyncioEventLoop(loop=evl),
+            max_fps=self.config.getopt('max_fps') or MAX_FPS,
+            **additional_opts)
 
     def header_hotkeys(self, key):
         if not self.config.getopt('headless'):
@@ -108,6 +164,20 @@ class EventLoop:
                 self.log.exception("exception failure in redraw_screen")
                 raise e
 
+    def request_redraw(self):
+        """ Marks the screen as changed, it is drawn with the next frame
+        """
+        if not self.config.getopt('headless'):
+            self.loop.request_redraw()
+
+    def watch_pipe(self, cb):
+        """ Returns the write end of a pipe, cb is called with data
+        written to it from within the event loop
+        """
+        if not self.config.getopt('headless'):
+            return self.loop.watch_pipe(cb)
+        return
+
     def set_alarm_in(self, interval, cb):
         if not self.config.getopt('headless'):
             return self.loop.set_alarm_in(interval, cb)
@@ -0,0 +1,520 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Fake Juju and MAAS APIs for running installs offline
+
+FakeCloud holds the state both fake servers share: MAAS nodes, and
+the Juju machines, services, units and relations created through the
+Juju API. Machines and units start after a configurable delay, so
+the installer's wait loops see the usual pending -> started
+transitions.
+
+A Session replays recorded API responses. Requests with recorded
+responses get them back in order, the last one repeating, and
+everything else is answered from the FakeCloud. Session files are
+JSON::
+
+    {"juju": [{"Type": "Client", "Request": "FullStatus",
+               "Response": {...}}],
+     "maas": [{"method": "GET", "path": "/nodes/", "op": "list",
+               "status": 200, "body": [...]}]}
+
+Requests are named "Client.FullStatus" for Juju and
+"GET /nodes/ list" for MAAS, in call counts and latency settings.
+"""
+
+from collections import Counter, defaultdict, deque
+import json
+import logging
+import threading
+import time
+
+log = logging.getLogger('cloudinstall.fakeapi')
+
+MAAS_API_PATH = '/MAAS/api/1.0'
+
+# MaasMachineStatus values
+NEW = 0
+READY = 4
+DEPLOYED = 6
+
+
+def make_nodes(count, status=READY, memory=16384, cpu_count=8,
+               storage=512000, bootstrap=True):
+    """ Returns count identical MAAS node dicts, plus the juju
+    bootstrap node if bootstrap is set
+    """
+    nodes = []
+    if bootstrap:
+        nodes.append(make_node('bootstrap', 'juju-bootstrap.maas',
+                               status=DEPLOYED, memory=memory,
+                               cpu_count=cpu_count, storage=storage))
+    for i in range(count):
+        nodes.append(make_node('node-{:05d}'.format(i),
+                               'node{}.maas'.format(i), status=status,
+                               memory=memory, cpu_count=cpu_count,
+                               storage=storage))
+    return nodes
+
+
+def make_node(system_id, hostname, status=READY, memory=16384,
+              cpu_count=8, storage=512000, arch='amd64/generic',
+              tag_names=None):
+    return {'system_id': system_id,
+            'hostname': hostname,
+            'status': status,
+            'memory': memory,
+            'cpu_count': cpu_count,
+            'storage': storage,
+            'architecture': arch,
+            'tag_names': list(tag_names or []),
+            'power_type': 'virsh',
+            'owner': 'root',
+            'ip_addresses': [],
+            'macaddress_set': [],
+            'resource_uri': '{}/nodes/{}/'.format(MAAS_API_PATH,
+                                                  system_id)}
+
+
+def _hostname(machine_id):
+    return "machine-{}.fake".format(machine_id.replace('/', '-'))
+
+
+class FakeAPIError(Exception):
+
+    """ Returned to the client as a Juju error response """
+
+
+class Session:
+
+    """ Recorded responses, replayed in order per request """
+
+    def __init__(self, juju=None, maas=None):
+        self.responses = defaultdict(deque)
+        for entry in juju or []:
+            key = "{}.{}".format(entry['Type'], entry['Request'])
+            self.responses[('juju', key)].append(entry)
+        for entry in maas or []:
+            key = maas_request_name(entry['method'], entry['path'],
+                                    entry.get('op'))
+            self.responses[('maas', key)].append(entry)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data.get('juju'), data.get('maas'))
+
+    def next(self, api, key):
+        """ Returns the next recorded entry for a request, or None """
+        entries = self.responses.get((api, key))
+        if not entries:
+            return None
+        if len(entries) > 1:
+            return entries.popleft()
+        return entries[0]
+
+
+def maas_request_name(method, path, op=None):
+    """ e.g. "POST /tags/*/ update_nodes", with ids in the path
+    replaced by * to keep the number of names down
+    """
+    parts = path.split('/')
+    for i in range(2, len(parts)):
+        if parts[i]:
+            parts[i] = '*'
+    name = "{} {}".format(method, '/'.join(parts))
+    if op:
+        name += " " + op
+    return name
+
+
+class FakeCloud:
+
+    """ State behind the fake Juju and MAAS servers
+
+    :param list nodes: MAAS node dicts, see make_nodes()
+    :param float machine_start: seconds from adding a juju machine
+        until its agent is started
+    :param float unit_start: seconds from deploying a unit until its
+        agent is started, counted once its machine is started
+    :param latency: seconds added to every request, or a dict of
+        request name to seconds with '*' as the default
+    :param Session session: recorded responses to replay
+    :param dict status: a FullStatus response of machines and services
+        that are already deployed, see load_status()
+    """
+
+    def __init__(self, nodes=None, machine_start=0, unit_start=0,
+                 latency=0, session=None, status=None):
+        self.nodes = list(nodes or [])
+        self.machine_start = machine_start
+        self.unit_start = unit_start
+        if not isinstance(latency, dict):
+            latency = {'*': latency}
+        self.latency = latency
+        self.session = session
+        self.calls = Counter()
+        self.lock = threading.RLock()
+        self.tags = set()
+        for n in self.nodes:
+            self.tags.update(n['tag_names'])
+        # juju state
+        self.machines = {'0': self._new_machine('0', 'bootstrap')}
+        self.next_machine = 1
+        self.services = {}
+        self.relations = set()
+        self.annotations = defaultdict(dict)
+        if status is not None:
+            self.load_status(status)
+
+    def delay(self, name):
+        seconds = self.latency.get(name, self.latency.get('*', 0))
+        if seconds:
+            time.sleep(seconds)
+
+    def _new_machine(self, machine_id, instance_id):
+        return {'Id': machine_id,
+                'InstanceId': instance_id,
+                'created': time.time(),
+                'containers': {},
+                'next_container': defaultdict(int)}
+
+    def _existing_machine(self, machine_id, m):
+        machine = self._new_machine(machine_id, m.get('InstanceId', ''))
+        machine['created'] = 0
+        machine['state'] = m.get('AgentState')
+        if m.get('Hardware'):
+            machine['hardware'] = m['Hardware']
+        return machine
+
+    def load_status(self, status):
+        """ Adds the machines, services and relations of a FullStatus
+        response, with their states as given
+        """
+        for mid, m in status.get('Machines', {}).items():
+            machine = self._existing_machine(mid, m)
+            for cid, c in (m.get('Containers') or {}).items():
+                machine['containers'][cid] = self._existing_machine(cid, c)
+                _, ctype, n = cid.split('/')
+                machine['next_container'][ctype] = max(
+                    machine['next_container'][ctype], int(n) + 1)
+            self.machines[mid] = machine
+            if mid.isdigit():
+                self.next_machine = max(self.next_machine, int(mid) + 1)
+        for name, svc in status.get('Services', {}).items():
+            units = {}
+            for unit_name, u in (svc.get('Units') or {}).items():
+                units[unit_name] = {'machine': u.get('Machine', ''),
+                                    'created': 0,
+                                    'state': u.get('AgentState'),
+                                    'workload': u.get('Workload')}
+            self.services[name] = {
+                'charm': svc.get('Charm', name),
+                'units': units,
+                'next_unit': 1 + max([int(u.split('/')[1])
+                                      for u in units] + [-1]),
+                'config': {}}
+            for iface, others in (svc.get('Relations') or {}).items():
+                for other in others:
+                    self.relations.add(tuple(sorted([
+                        "{}:{}".format(name, iface),
+                        "{}:{}".format(other, iface)])))
+
+    # Juju
+
+    def juju_request(self, msg):
+        """ Answers a Juju RPC message, returning the response message """
+        name = "{}.{}".format(msg.get('Type'), msg.get('Request'))
+        with self.lock:
+            self.calls[name] += 1
+            recorded = self.session and self.session.next('juju', name)
+        self.delay(name)
+        reply = {'RequestId': msg.get('RequestId')}
+        if recorded:
+            for k in ('Response', 'Error', 'ErrorCode'):
+                if k in recorded:
+                    reply[k] = recorded[k]
+            reply.setdefault('Response', {})
+            return reply
+        handler = getattr(self, 'juju_' + str(msg.get('Request')), None)
+        try:
+            with self.lock:
+                if handler is None:
+                    log.debug("fake juju: no handler for {}".format(name))
+                    response = {}
+                else:
+                    response = handler(msg.get('Params') or {})
+        except FakeAPIError as e:
+            reply['Error'] = str(e)
+            reply['ErrorCode'] = ''
+            return reply
+        reply['Response'] = response
+        return reply
+
+    def juju_Login(self, params):
+        return {}
+
+    def _node_for_tags(self, tags):
+        for n in self.nodes:
+            if n['system_id'] in tags or n['hostname'] in tags:
+                return n
+        return None
+
+    def _add_machine(self, params):
+        parent = params.get('ParentId')
+        ctype = params.get('ContainerType')
+        if parent and ctype:
+            if parent not in self.machines:
+                raise FakeAPIError("machine {} not found".format(parent))
+            machine = self.machines[parent]
+            n = machine['next_container'][ctype]
+            machine['next_container'][ctype] += 1
+            cid = "{}/{}/{}".format(parent, ctype, n)
+            machine['containers'][cid] = self._new_machine(
+                cid, 'juju-machine-{}'.format(cid.replace('/', '-')))
+            return cid
+        machine_id = str(self.next_machine)
+        self.next_machine += 1
+        tags = (params.get('Constraints') or {}).get('tags') or []
+        node = self._node_for_tags(tags)
+        if node is not None:
+            node['status'] = DEPLOYED
+            instance_id = node['resource_uri']
+        else:
+            instance_id = 'fake-machine-{}'.format(machine_id)
+        self.machines[machine_id] = self._new_machine(machine_id,
+                                                      instance_id)
+        return machine_id
+
+    def juju_AddMachines(self, params):
+        results = []
+        for mp in params.get('MachineParams', []):
+            try:
+                results.append({'Machine': self._add_machine(mp),
+                                'Error': None})
+            except FakeAPIError as e:
+                results.append({'Machine': '', 'Error': {'Message':
+                                                         str(e)}})
+        return {'Machines': results}
+
+    juju_AddMachinesV2 = juju_AddMachines
+
+    def _place_unit(self, spec):
+        """ Returns the machine id for a unit deployed to spec """
+        if not spec:
+            return self._add_machine({})
+        if ':' in spec:
+            ctype, parent = spec.split(':', 1)
+            return self._add_machine({'ParentId': parent,
+                                      'ContainerType': ctype})
+        if spec not in self.machines:
+            raise FakeAPIError("machine {} not found".format(spec))
+        return spec
+
+    def _add_units(self, service_name, count, spec):
+        service = self.services[service_name]
+        names = []
+        for _ in range(count):
+            name = "{}/{}".format(service_name, service['next_unit'])
+            service['next_unit'] += 1
+            service['units'][name] = {'machine': self._place_unit(spec),
+                                      'created': time.time()}
+            names.append(name)
+        return names
+
+    def juju_ServiceDeploy(self, params):
+        name = params['ServiceName']
+        if name in self.services:
+            raise FakeAPIError("service already exists")
+        self.services[name] = {'charm': params.get('CharmUrl', name),
+                               'units': {},
+                               'next_unit': 0,
+                               'config': {}}
+        self._add_units(name, int(params.get('NumUnits', 1)),
+                        params.get('ToMachineSpec'))
+        return {}
+
+    def juju_AddServiceUnits(self, params):
+        name = params['ServiceName']
+        if name not in self.services:
+            raise FakeAPIError("service {} not found".format(name))
+        return {'Units': self._add_units(name,
+                                         int(params.get('NumUnits', 1)),
+                                         params.get('ToMachineSpec'))}
+
+    def juju_AddRelation(self, params):
+        endpoints = params['Endpoints']
+        services = [e.split(':')[0] for e in endpoints]
+        for s in services:
+            if s not in self.services:
+                raise FakeAPIError("service {} not found".format(s))
+        relation = tuple(sorted(endpoints))
+        if relation in self.relations:
+            raise FakeAPIError("relation already exists")
+        self.relations.add(relation)
+        return {'Endpoints': {s: {'Name': e.split(':')[-1]}
+                              for s, e in zip(services, endpoints)}}
+
+    def juju_ServiceSet(self, params):
+        service = self.services.get(params.get('ServiceName'))
+        if service is not None:
+            service['config'].update(params.get('Options') or {})
+        return {}
+
+    def juju_ServiceGet(self, params):
+        service = self.services.get(params.get('ServiceName'), {})
+        return {'Service': params.get('ServiceName'),
+                'Charm': service.get('charm', ''),
+                'Config': {k: {'value': v} for k, v in
+                           service.get('config', {}).items()}}
+
+    def juju_SetAnnotations(self, params):
+        self.annotations[params['Tag']].update(params.get('Pairs') or {})
+        return {}
+
+    def juju_GetAnnotations(self, params):
+        return {'Annotations': dict(self.annotations[params['Tag']])}
+
+    def _started(self, created, delay):
+        return time.time() - created >= delay
+
+    def _machine_state(self, machine):
+        if machine.get('state') is not None:
+            return machine['state']
+        if self._started(machine['created'], self.machine_start):
+            return 'started'
+        return 'pending'
+
+    def _machine_status(self, machine):
+        state = self._machine_state(machine)
+        return {'Id': machine['Id'],
+                'InstanceId': machine['InstanceId'],
+                'AgentState': state,
+                'AgentStateInfo': '',
+                'Agent': {'Status': state},
+                'DNSName': _hostname(machine['Id']),
+                'Series': 'trusty',
+                'Hardware': machine.get('hardware',
+                                        'arch=amd64 cpu-cores=8 mem=16384M'),
+                'Life': '',
+                'Containers': {cid: self._machine_status(c) for cid, c in
+                               machine['containers'].items()}}
+
+    def _find_machine(self, machine_id):
+        base = self.machines.get(machine_id.split('/')[0])
+        if base is None or base['Id'] == machine_id:
+            return base
+        return base['containers'].get(machine_id)
+
+    def _unit_status(self, unit):
+        if unit.get('state') is not None:
+            return {'AgentState': unit['state'],
+                    'AgentStateInfo': '',
+                    'Machine': unit['machine'],
+                    'PublicAddress': _hostname(unit['machine']),
+                    'UnitAgent': {'Status': unit['state']},
+                    'Workload': unit.get('workload') or {}}
+        machine = self._find_machine(unit['machine'])
+        machine_up = machine is not None and \
+            self._machine_state(machine) == 'started'
+        started = machine_up and self._started(
+            max(unit['created'], machine['created'] + self.machine_start),
+            self.unit_start)
+        return {'AgentState': 'started' if started else 'pending',
+                'AgentStateInfo': '',
+                'Machine': unit['machine'],
+                'PublicAddress': _hostname(unit['machine']),
+                'UnitAgent': {'Status': 'idle' if started else
+                              'allocating'},
+                'Workload': {'Status': 'active' if started else
+                             'maintenance',
+                             'Info': ''}}
+
+    def juju_FullStatus(self, params):
+        relations = defaultdict(lambda: defaultdict(list))
+        for a, b in self.relations:
+            (sa, ia), (sb, ib) = a.split(':', 1), b.split(':', 1)
+            relations[sa][ia].append(sb)
+            if a != b:
+                relations[sb][ib].append(sa)
+        services = {}
+        for name, service in self.services.items():
+            services[name] = {
+                'Charm': service['charm'],
+                'Exposed': False,
+                'Life': '',
+                'Networks': {},
+                'Relations': dict(relations[name]),
+                'SubordinateTo': [],
+                'Units': {u: self._unit_status(unit) for u, unit in
+                          service['units'].items()}}
+        return {'EnvironmentName': 'fake',
+                'Machines': {mid: self._machine_status(m) for mid, m in
+                             self.machines.items()},
+                'Services': services,
+                'Networks': {},
+                'Relations': []}
+
+    # MAAS
+
+    def maas_request(self, method, path, params):
+        """ Answers a MAAS API request, path being relative to the API
+        root, returning (HTTP status, JSON-able body)
+        """
+        op = params.get('op')
+        name = maas_request_name(method, path, op)
+        with self.lock:
+            self.calls[name] += 1
+            recorded = self.session and self.session.next('maas', name)
+        self.delay(name)
+        if recorded:
+            return recorded.get('status', 200), recorded.get('body')
+        parts = [p for p in path.split('/') if p]
+        with self.lock:
+            if parts == ['nodes'] and method == 'GET':
+                return 200, self.nodes
+            if parts == ['nodes'] and op == 'accept_all':
+                accepted = []
+                for n in self.nodes:
+                    if n['status'] == NEW:
+                        n['status'] = READY
+                        accepted.append(n)
+                return 200, accepted
+            if len(parts) == 2 and parts[0] == 'nodes' and method == 'GET':
+                node = next((n for n in self.nodes
+                             if n['system_id'] == parts[1]), None)
+                if node is None:
+                    return 404, None
+                return 200, node
+            if parts == ['tags'] and method == 'GET':
+                return 200, [{'name': t} for t in sorted(self.tags)]
+            if parts == ['tags'] and op == 'new':
+                self.tags.add(params['name'])
+                return 200, {'name': params['name']}
+            if len(parts) == 2 and parts[0] == 'tags' and \
+               op == 'update_nodes':
+                tag = parts[1]
+                if tag not in self.tags:
+                    return 404, None
+                add = params.get('add') or []
+                if isinstance(add, str):
+                    add = [add]
+                for n in self.nodes:
+                    if n['system_id'] in add and tag not in n['tag_names']:
+                        n['tag_names'].append(tag)
+                return 200, {'added': len(add), 'removed': 0}
+        log.debug("fake maas: no handler for {}".format(name))
+        return 404, None
@@ -0,0 +1,184 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Fake Juju API websocket server
+
+Speaks enough of RFC 6455 for macumba: a plain ws:// handshake and
+unfragmented or fragmented text frames. Each message is answered by
+FakeCloud.juju_request() on its own thread, so slow requests don't
+hold up others on the same connection, as with a real state server.
+"""
+
+from base64 import b64encode
+from hashlib import sha1
+import json
+import logging
+import socketserver
+import struct
+import threading
+
+log = logging.getLogger('cloudinstall.fakeapi.juju')
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OP_CONT = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+def accept_key(key):
+    return b64encode(sha1((key + WS_GUID).encode()).digest()).decode()
+
+
+def encode_frame(payload, opcode=OP_TEXT, mask=None):
+    """ Returns a single final frame, masked if a 4 byte mask is given
+    (clients must mask, servers must not)
+    """
+    header = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    n = len(payload)
+    if n < 126:
+        header.append(mask_bit | n)
+    elif n < 1 << 16:
+        header.append(mask_bit | 126)
+        header += struct.pack('!H', n)
+    else:
+        header.append(mask_bit | 127)
+        header += struct.pack('!Q', n)
+    if mask:
+        header += mask
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return bytes(header) + payload
+
+
+def read_frame(rfile):
+    """ Returns (fin, opcode, payload), or None at end of stream """
+    head = rfile.read(2)
+    if len(head) < 2:
+        return None
+    fin = bool(head[0] & 0x80)
+    opcode = head[0] & 0x0F
+    masked = head[1] & 0x80
+    n = head[1] & 0x7F
+    if n == 126:
+        n = struct.unpack('!H', rfile.read(2))[0]
+    elif n == 127:
+        n = struct.unpack('!Q', rfile.read(8))[0]
+    mask = rfile.read(4) if masked else None
+    payload = rfile.read(n)
+    if len(payload) < n:
+        return None
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return fin, opcode, payload
+
+
+class JujuWSHandler(socketserver.StreamRequestHandler):
+
+    def handshake(self):
+        request = self.rfile.readline()
+        if not request:
+            return False
+        headers = {}
+        while True:
+            line = self.rfile.readline().decode('latin-1').strip()
+            if not line:
+                break
+            k, _, v = line.partition(':')
+            headers[k.strip().lower()] = v.strip()
+        key = headers.get('sec-websocket-key')
+        if key is None:
+            self.wfile.write(b"HTTP/1.1 400 Bad Request\r\n\r\n")
+            return False
+        response = ["HTTP/1.1 101 Switching Protocols",
+                    "Upgrade: websocket",
+                    "Connection: Upgrade",
+                    "Sec-WebSocket-Accept: " + accept_key(key)]
+        protocols = headers.get('sec-websocket-protocol')
+        if protocols:
+            response.append("Sec-WebSocket-Protocol: " +
+                            protocols.split(',')[0].strip())
+        self.wfile.write(("\r\n".join(response) + "\r\n\r\n").encode())
+        return True
+
+    def send(self, payload, opcode=OP_TEXT):
+        with self.send_lock:
+            self.wfile.write(encode_frame(payload, opcode))
+            self.wfile.flush()
+
+    def answer(self, data):
+        try:
+            msg = json.loads(data.decode('utf-8'))
+        except ValueError:
+            log.debug("fake juju: bad message {!r}".format(data[:200]))
+            return
+        reply = self.server.cloud.juju_request(msg)
+        try:
+            self.send(json.dumps(reply).encode('utf-8'))
+        except OSError:
+            log.debug("fake juju: client went away")
+
+    def handle(self):
+        self.send_lock = threading.Lock()
+        if not self.handshake():
+            return
+        message = b''
+        while True:
+            frame = read_frame(self.rfile)
+            if frame is None:
+                return
+            fin, opcode, payload = frame
+            if opcode == OP_CLOSE:
+                self.send(payload[:2], OP_CLOSE)
+                return
+            if opcode == OP_PING:
+                self.send(payload, OP_PONG)
+                continue
+            if opcode in (OP_TEXT, OP_BINARY, OP_CONT):
+                message += payload
+                if fin:
+                    threading.Thread(target=self.answer, args=(message,),
+                                     daemon=True).start()
+                    message = b''
+
+
+class FakeJujuServer(socketserver.ThreadingTCPServer):
+
+    """ Serves a FakeCloud as a Juju API endpoint at url """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, cloud, addr='127.0.0.1', port=0):
+        super().__init__((addr, port), JujuWSHandler)
+        self.cloud = cloud
+        self.thread = None
+
+    @property
+    def url(self):
+        return "ws://{}:{}/".format(*self.server_address[:2])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
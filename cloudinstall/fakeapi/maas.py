@@ -0,0 +1,98 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Fake MAAS API HTTP server
+
+Answers the 1.0 API under /MAAS/api/1.0 from a FakeCloud. OAuth
+parameters are accepted and ignored.
+"""
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import logging
+from socketserver import ThreadingMixIn
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+from cloudinstall.fakeapi import MAAS_API_PATH
+
+log = logging.getLogger('cloudinstall.fakeapi.maas')
+
+
+def _params(qs):
+    params = {}
+    for k, v in parse_qs(qs, keep_blank_values=True).items():
+        params[k] = v[0] if len(v) == 1 else v
+    return params
+
+
+class MaasHandler(BaseHTTPRequestHandler):
+
+    def respond(self, method):
+        url = urlsplit(self.path)
+        params = _params(url.query)
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            params.update(_params(self.rfile.read(length).decode()))
+        if not url.path.startswith(MAAS_API_PATH):
+            self.send_error(404)
+            return
+        path = url.path[len(MAAS_API_PATH):]
+        status, body = self.server.cloud.maas_request(method, path, params)
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_POST(self):
+        self.respond('POST')
+
+    def do_DELETE(self):
+        self.respond('DELETE')
+
+    def log_message(self, fmt, *args):
+        log.debug("fake maas: " + fmt % args)
+
+
+class FakeMaasServer(ThreadingMixIn, HTTPServer):
+
+    """ Serves a FakeCloud as a MAAS API at api_host """
+
+    daemon_threads = True
+
+    def __init__(self, cloud, addr='127.0.0.1', port=0):
+        super().__init__((addr, port), MaasHandler)
+        self.cloud = cloud
+        self.thread = None
+
+    @property
+    def api_host(self):
+        """ host:port, as taken by connect_to_maas() in maascreds """
+        return "{}:{}".format(*self.server_address[:2])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,240 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Synthetic clouds for testing at scale
+
+synth_nodes() makes MAAS node lists and synth_status() Juju
+FullStatus documents, with mixed hardware, architectures, tags and
+states. Both are deterministic for a given seed.
+
+Use them with FakeCloud(nodes, status=...) for the fake API servers,
+or write_fake_api_data() for FakeMaasState and FakeJujuState, which
+read FAKE_API_DATA/maas-machines.json and juju-status.json.
+"""
+
+import json
+import os
+import random
+
+from cloudinstall.fakeapi import make_node, DEPLOYED, NEW, READY
+
+# MaasMachineStatus values not used by the fake servers
+COMMISSIONING = 1
+FAILED_COMMISSIONING = 2
+BROKEN = 8
+
+# (weight, memory MB, cores, storage MB)
+HARDWARE = [(5, 8192, 4, 128000),
+            (30, 16384, 8, 256000),
+            (30, 32768, 12, 512000),
+            (20, 65536, 24, 1024000),
+            (10, 131072, 32, 2048000),
+            (5, 262144, 48, 4096000)]
+ARCHES = [(90, 'amd64/generic'),
+          (7, 'arm64/generic'),
+          (3, 'ppc64el/generic')]
+NODE_STATUSES = [(80, READY),
+                 (10, DEPLOYED),
+                 (4, NEW),
+                 (3, COMMISSIONING),
+                 (2, BROKEN),
+                 (1, FAILED_COMMISSIONING)]
+# each tag is given to a node with this probability
+TAGS = [(0.3, 'ssd'), (0.1, 'gpu'), (0.2, 'compute'), (0.2, 'storage')]
+ZONES = 4
+
+AGENT_STATES = [(90, 'started'), (6, 'pending'), (2, 'error'),
+                (2, 'down')]
+WORKLOADS = {'started': 'active', 'pending': 'maintenance',
+             'error': 'error', 'down': 'unknown'}
+# services first deployed by the installer, then filler services
+SERVICE_NAMES = ['mysql', 'rabbitmq-server', 'keystone', 'glance',
+                 'nova-cloud-controller', 'nova-compute', 'neutron-api',
+                 'neutron-gateway', 'openstack-dashboard', 'cinder',
+                 'ceph', 'ceph-osd', 'swift-proxy', 'swift-storage',
+                 'heat', 'ceilometer', 'mongodb', 'ntp']
+
+
+def _choice(rng, weighted):
+    total = sum(w for w, *_ in weighted)
+    r = rng.uniform(0, total)
+    for entry in weighted:
+        r -= entry[0]
+        if r <= 0:
+            break
+    return entry[1:] if len(entry) > 2 else entry[1]
+
+
+def synth_nodes(count, seed=0, bootstrap=True):
+    """ Returns count MAAS node dicts, plus the juju bootstrap node if
+    bootstrap is set
+    """
+    rng = random.Random(seed)
+    nodes = []
+    if bootstrap:
+        nodes.append(make_node('bootstrap', 'juju-bootstrap.maas',
+                               status=DEPLOYED))
+    for i in range(count):
+        memory, cores, storage = _choice(rng, HARDWARE)
+        zone = 'zone{}'.format(rng.randrange(ZONES))
+        node = make_node('node-{:05d}'.format(i),
+                         '{}-node{}.maas'.format(zone, i),
+                         status=_choice(rng, NODE_STATUSES),
+                         memory=memory, cpu_count=cores, storage=storage,
+                         arch=_choice(rng, ARCHES),
+                         tag_names=[t for p, t in TAGS
+                                    if rng.random() < p])
+        node['zone'] = {'name': zone}
+        nodes.append(node)
+    return nodes
+
+
+def _service_names(count):
+    names = SERVICE_NAMES[:count]
+    names += ['service-{}'.format(i) for i in range(count - len(names))]
+    return names
+
+
+def synth_status(machines, containers=2, services=None, units=None,
+                 relations=2, seed=0):
+    """ Returns a Juju FullStatus response
+
+    :param int machines: machines besides the bootstrap node
+    :param int containers: average lxc containers per machine
+    :param int services: number of services, default machines / 4
+    :param int units: number of units, default one per machine and
+        container
+    :param int relations: average relations per service
+    """
+    rng = random.Random(seed)
+    status = {'EnvironmentName': 'synthetic',
+              'Machines': {},
+              'Services': {},
+              'Networks': {},
+              'Relations': []}
+    hosts = []
+    for i in range(machines + 1):
+        mid = str(i)
+        state = 'started' if i == 0 else _choice(rng, AGENT_STATES)
+        memory, cores, _ = _choice(rng, HARDWARE)
+        m = _machine(mid, state, '/MAAS/api/1.0/nodes/node-{:05d}/'.format(
+            i - 1) if i else 'bootstrap')
+        m['Hardware'] = "arch=amd64 cpu-cores={} mem={}M".format(cores,
+                                                                 memory)
+        if i:
+            hosts.append(mid)
+            for c in range(rng.randint(0, 2 * containers)):
+                cid = "{}/lxc/{}".format(mid, c)
+                cstate = state if state != 'started' else \
+                    _choice(rng, AGENT_STATES)
+                m['Containers'][cid] = _machine(
+                    cid, cstate, 'juju-machine-{}-lxc-{}'.format(mid, c))
+                hosts.append(cid)
+        status['Machines'][mid] = m
+
+    if services is None:
+        services = max(1, machines // 4)
+    if units is None:
+        units = len(hosts)
+    names = _service_names(services)
+    unit_counts = dict.fromkeys(names, 0)
+    for i in range(units):
+        # every service gets a unit before any gets two
+        name = names[i] if i < len(names) else rng.choice(names)
+        unit_counts[name] += 1
+
+    related = {name: {} for name in names}
+    for _ in range(relations * len(names) // 2):
+        a, b = rng.sample(names, 2) if len(names) > 1 else names * 2
+        iface = rng.choice(['shared-db', 'amqp', 'identity-service',
+                            'image-service', 'cluster'])
+        related[a].setdefault(iface, [])
+        if b not in related[a][iface]:
+            related[a][iface].append(b)
+            related[b].setdefault(iface, []).append(a)
+
+    for name in names:
+        svc_units = {}
+        for n in range(unit_counts[name]):
+            host = rng.choice(hosts) if hosts else '0'
+            state = _unit_state(status, host, rng)
+            svc_units["{}/{}".format(name, n)] = {
+                'AgentState': state,
+                'AgentStateInfo': '',
+                'Machine': host,
+                'PublicAddress': "{}.synthetic".format(
+                    host.replace('/', '-')),
+                'UnitAgent': {'Status': 'idle' if state == 'started'
+                              else state},
+                'Workload': {'Status': WORKLOADS[state],
+                             'Info': '' if state == 'started' else
+                             'synthetic {}'.format(state)}}
+        status['Services'][name] = {
+            'Charm': 'cs:trusty/{}-{}'.format(name, rng.randint(1, 40)),
+            'Exposed': False,
+            'Life': '',
+            'Networks': {},
+            'Relations': related[name],
+            'SubordinateTo': [],
+            'Units': svc_units}
+    return status
+
+
+def _machine(machine_id, state, instance_id):
+    return {'Id': machine_id,
+            'InstanceId': instance_id,
+            'AgentState': state,
+            'AgentStateInfo': '' if state == 'started' else
+            'synthetic {}'.format(state),
+            'Agent': {'Status': state},
+            'DNSName': "{}.synthetic".format(machine_id.replace('/', '-')),
+            'Series': 'trusty',
+            'Life': '',
+            'Containers': {}}
+
+
+def _unit_state(status, host, rng):
+    base = status['Machines'][host.split('/')[0]]
+    machine = base['Containers'].get(host, base)
+    if machine['AgentState'] != 'started':
+        return 'pending'
+    return _choice(rng, AGENT_STATES)
+
+
+def write_fake_api_data(path, nodes=None, status=None):
+    """ Writes the files FakeMaasState and FakeJujuState read from
+    FAKE_API_DATA
+    """
+    os.makedirs(path, exist_ok=True)
+    if nodes is not None:
+        with open(os.path.join(path, 'maas-machines.json'), 'w') as f:
+            json.dump(nodes, f)
+    if status is not None:
+        with open(os.path.join(path, 'juju-status.json'), 'w') as f:
+            json.dump(status, f)
+
+
+def synth_cloud(nodes, machines, seed=0, **status_args):
+    """ Returns (nodes, status) of a deployed environment: the MAAS
+    nodes behind the first `machines` juju machines are deployed
+    """
+    node_list = synth_nodes(nodes, seed=seed)
+    status = synth_status(machines, seed=seed, **status_args)
+    by_uri = {n['resource_uri']: n for n in node_list}
+    for m in status['Machines'].values():
+        node = by_uri.get(m['InstanceId'])
+        if node is not None:
+            node['status'] = DEPLOYED
+    return node_list, status
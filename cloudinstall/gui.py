@@ -202,7 +202,6 @@ class PegasusGUI(WidgetWrap):
 
     def refresh_services_view(self, nodes, config):
         self.services_view.refresh_nodes(nodes)
-        self.update_phase_status(config)
 
     def update_phase_status(self, config):
         dc = config.getopt('deploy_complete')
@@ -261,6 +260,10 @@ class PegasusGUI(WidgetWrap):
         self.add_services_dialog.update()
         self.frame.body = Filler(self.add_services_dialog)
 
+    def progress_event(self, event, **fields):
+        """ Progress events are only written by headless installs """
+        pass
+
     def show_exception_message(self, ex):
         if isinstance(ex, async.ThreadCancelledException):
             log.debug("Thread cancelled intentionally.")
@@ -18,15 +18,73 @@
 
 from collections import Counter
 import logging
+import threading
 import time
 
 from cloudinstall.machine import Machine
 from cloudinstall.service import Service
 
+from macumba import api, v1
 from macumba.errors import RequestTimeout
 
 log = logging.getLogger('cloudinstall.juju')
 
+# charm: (time, result) of charm store lookups, shared by all clients
+# in the process
+CS_CACHE_SECONDS = 600
+_cs_cache = {}
+_cs_lock = threading.Lock()
+
+
+def query_cs(charm):
+    """ macumba's query_cs, with results cached for CS_CACHE_SECONDS
+
+    :param str charm: charm name, optionally prefixed by 'series/'
+    """
+    with _cs_lock:
+        cached = _cs_cache.get(charm)
+    if cached is not None and time.time() - cached[0] < CS_CACHE_SECONDS:
+        return dict(cached[1])
+    result = api.query_cs(charm)
+    with _cs_lock:
+        _cs_cache[charm] = (time.time(), result)
+    return dict(result)
+
+
+class JujuClient(v1.JujuClient):
+
+    """ macumba's JujuClient, looking charms up through the cached
+    query_cs
+    """
+
+    def deploy(self, charm, service_name, num_units=1, config_yaml="",
+               constraints=None, machine_spec=""):
+        """ Deploy a charm to an instance, as macumba's deploy does
+
+        :param str charm: Name of charm
+        :param str service_name: name of service
+        :param int num_units: number of units
+        :param str config_yaml: charm configuration options
+        :param dict constraints: deploy constraints
+        :param str machine_spec: Type of machine to deploy to
+        :returns: Deployed charm status
+        """
+        params = {'ServiceName': service_name}
+
+        charm_info = query_cs(charm)
+        params['CharmUrl'] = charm_info['Id']
+        params['NumUnits'] = num_units
+        params['ConfigYAML'] = config_yaml
+
+        if constraints:
+            params['Constraints'] = self._prepare_constraints(
+                constraints)
+        if machine_spec:
+            params['ToMachineSpec'] = machine_spec
+        return self.call(dict(Type="Client",
+                              Request="ServiceDeploy",
+                              Params=dict(params)))
+
 
 class JujuState:
 
@@ -122,10 +180,11 @@ class JujuState:
         :returns: machine
         :rtype: :class:`~cloudinstall.machine.Machine`
         """
-        for m in self.machines():
-            if m.machine_id == machine_id:
-                return m
-        return Machine('-', {})
+        machine = self.status().get('Machines', {}).get(machine_id)
+        # like machines(), never returns the bootstrap node
+        if machine is None or '0' == machine_id:
+            return Machine('-', {})
+        return Machine(machine_id, machine)
 
     def machines(self):
         """ Machines property
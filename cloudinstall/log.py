@@ -17,14 +17,36 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """ Logging interface
+
+Records are handed to a queue and written by a background thread, so
+threads that log never wait on the log file. Messages are formatted on
+that thread too: pass values as arguments rather than calling
+format() or pprint in the caller, and wrap large structures in
+PrettyLog, e.g.::
+
+    log.debug("charm_config = %s", PrettyLog(charm_config))
+
+Arguments are rendered after the call returns, so don't pass anything
+the caller goes on to modify.
 """
 
 from __future__ import unicode_literals
+import atexit
+import json
 import logging
 import os
 import pprint
+import queue
+
+from logging.handlers import (TimedRotatingFileHandler, QueueHandler,
+                              QueueListener)
+
+# attributes every LogRecord has, anything else was passed in extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {
+    'message', 'asctime'}
 
-from logging.handlers import TimedRotatingFileHandler
+_listener = None
+_queuelog = None
 
 
 class PrettyLog():
@@ -36,6 +58,55 @@ class PrettyLog():
         return pprint.pformat(self.obj)
 
 
+class JSONFormatter(logging.Formatter):
+
+    """ Formats records as one JSON object per line, with any extra=
+    fields as additional keys
+    """
+
+    def format(self, record):
+        entry = {'time': self.formatTime(record),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'file': record.filename,
+                 'line': record.lineno,
+                 'thread': record.threadName,
+                 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        for k, v in vars(record).items():
+            if k not in _RECORD_ATTRS:
+                entry[k] = v
+        return json.dumps(entry, default=str)
+
+
+class LazyQueueHandler(QueueHandler):
+
+    """ Queues records as they are, leaving the message to be formatted
+    by the handlers on the listener thread
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def stop_logger():
+    """ Writes out queued records and stops the logging thread. Later
+    records are written directly by the caller.
+    """
+    global _listener, _queuelog
+    if _listener is None:
+        return
+    logger = logging.getLogger('')
+    logger.removeHandler(_queuelog)
+    _listener.stop()
+    for h in _listener.handlers:
+        for f in _queuelog.filters:
+            h.addFilter(f)
+        logger.addHandler(h)
+    _listener = _queuelog = None
+
+
 def setup_logger(name=__name__, headless=False):
     """setup logging
 
@@ -64,6 +135,9 @@ def setup_logger(name=__name__, headless=False):
         # Disable log filtering
         $ UCI_NOFILTER=1 openstack-status
 
+        # Write commands.log as JSON lines
+        $ UCI_LOGFORMAT=json openstack-status
+
     :params str name: logger name
     :returns: a log object
 
@@ -81,10 +155,13 @@ def setup_logger(name=__name__, headless=False):
     env = os.environ.get('UCI_LOGLEVEL', 'DEBUG')
 
     commandslog.setLevel(env)
-    commandslog.setFormatter(logging.Formatter(
-        "[%(levelname)-4s: %(asctime)s, "
-        "%(filename)s:%(lineno)d] %(message)s",
-        datefmt='%m-%d %H:%M:%S'))
+    if os.environ.get('UCI_LOGFORMAT', 'text') == 'json':
+        commandslog.setFormatter(JSONFormatter())
+    else:
+        commandslog.setFormatter(logging.Formatter(
+            "[%(levelname)-4s: %(asctime)s, "
+            "%(filename)s:%(lineno)d] %(message)s",
+            datefmt='%m-%d %H:%M:%S'))
 
     if headless:
         consolelog = logging.StreamHandler()
@@ -96,14 +173,26 @@ def setup_logger(name=__name__, headless=False):
     logger = logging.getLogger('')
     logger.setLevel(env)
 
+    handlers = [commandslog]
+    if headless:
+        handlers.append(consolelog)
+
+    global _listener, _queuelog
+    if _listener is None:
+        atexit.register(stop_logger)
+    else:
+        # replaces an earlier setup
+        logger.removeHandler(_queuelog)
+        _listener.stop()
+    log_queue = queue.Queue()
+    _queuelog = LazyQueueHandler(log_queue)
     no_filter = os.environ.get('UCI_NOFILTER', None)
     if no_filter is None:
-        f = logging.Filter(name='cloudinstall')
-        commandslog.addFilter(f)
-        if headless:
-            consolelog.addFilter(f)
-    logger.addHandler(commandslog)
-    if headless:
-        logger.addHandler(consolelog)
+        # filter before queueing, library records never leave the caller
+        _queuelog.addFilter(logging.Filter(name='cloudinstall'))
+    _listener = QueueListener(log_queue, *handlers,
+                              respect_handler_level=True)
+    _listener.start()
+    logger.addHandler(_queuelog)
 
     return logger
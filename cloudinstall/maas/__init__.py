@@ -16,20 +16,148 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from cloudinstall.log import PrettyLog
 from cloudinstall.machine import Machine
+from cloudinstall.profiler import span, TracedProxy
 from cloudinstall.utils import human_to_mb
 from maasclient.auth import MaasAuth
 from maasclient import MaasClient
+from array import array
 from collections import Counter
+import copy
 from enum import Enum
 import json
 import logging
 import os
+import requests
+import threading
 import time
 
 
 log = logging.getLogger('cloudinstall.maas')
 
+_session = None
+_session_lock = threading.Lock()
+
+
+# machine hardware keys for each constraint key
+CONSTRAINT_KEYS = {'mem': 'memory',
+                   'arch': 'architecture',
+                   'storage': 'storage',
+                   'root-disk': 'storage',
+                   'cpu_cores': 'cpu_count'}
+
+# size keys stored in MachineTable columns
+TABLE_KEYS = ['memory', 'storage', 'cpu_count']
+
+
+class Constraints:
+
+    """Juju style constraints parsed for repeated matching.
+
+    Sizes are converted to megabytes once, so checking a machine is a
+    handful of comparisons. Use compile_constraints() to share
+    instances between callers.
+
+    :param dict constraints: e.g. {'mem': '4G', 'arch': 'amd64'}
+    """
+
+    def __init__(self, constraints=None):
+        self.constraints = dict(constraints or {})
+        self.arch = None
+        # [(constraint key, machine key, value)], in the given order
+        self.checks = []
+        for k, v in self.constraints.items():
+            if k == 'arch':
+                self.arch = v
+            elif str(v).isdecimal():
+                v = int(v)
+            else:
+                v = human_to_mb(v)
+            self.checks.append((k, CONSTRAINT_KEYS[k], v))
+        self.minimums = [(mkey, v) for k, mkey, v in self.checks
+                         if k != 'arch']
+
+    def __len__(self):
+        return len(self.constraints)
+
+    def check(self, machine):
+        """:returns: (bool, [list-of-failed constraint keys])"""
+        hw = machine.machine
+        failed = []
+        for k, mkey, v in self.checks:
+            mval = hw[mkey]
+            if mval == '*':
+                # '*' always satisfies.
+                continue
+            if k == 'arch':
+                if mval != v:
+                    failed.append(k)
+            elif mval < v:
+                failed.append(k)
+        return (len(failed) == 0, failed)
+
+    def matching(self, table):
+        """Returns the machines in a MachineTable that satisfy these
+        constraints, in table order."""
+        idx = range(len(table))
+        if self.arch is not None:
+            arches = table.arches
+            idx = [i for i in idx if arches[i] == '*' or
+                   arches[i] == self.arch]
+        for mkey, minimum in self.minimums:
+            col = table.columns[mkey]
+            idx = [i for i in idx if col[i] >= minimum]
+        return [table.machines[i] for i in idx]
+
+
+_compiled_constraints = {}
+
+
+def compile_constraints(constraints):
+    """Returns a shared Constraints for a constraints dict (or an
+    already compiled Constraints)."""
+    if isinstance(constraints, Constraints):
+        return constraints
+    try:
+        key = tuple(sorted((constraints or {}).items()))
+        hash(key)
+    except TypeError:
+        return Constraints(constraints)
+    compiled = _compiled_constraints.get(key)
+    if compiled is None:
+        compiled = Constraints(constraints)
+        _compiled_constraints[key] = compiled
+    return compiled
+
+
+class MachineTable:
+
+    """Machine hardware stored as columns, for checking many machines
+    against Constraints.matching() at once.
+
+    '*' values are stored as infinity so that they satisfy anything.
+    """
+
+    def __init__(self, machines):
+        self.machines = list(machines)
+        self.arches = [m.machine.get('architecture') for m in self.machines]
+        self.columns = {}
+        for mkey in TABLE_KEYS:
+            col = array('d')
+            for m in self.machines:
+                v = m.machine.get(mkey, 0)
+                if v == '*':
+                    v = float('inf')
+                try:
+                    col.append(float(v))
+                except (TypeError, ValueError):
+                    col.append(0)
+            self.columns[mkey] = col
+
+    def __len__(self):
+        return len(self.machines)
+
 
 def satisfies(machine, constraints):
     """Evaluates whether a MAAS machine's hardware matches constraints.
@@ -37,6 +165,8 @@ def satisfies(machine, constraints):
     If constraints is None or an empty dict, then any machine will be
     evaluated as satisfying the constraints.
 
+    constraints may also be a Constraints from compile_constraints().
+
     .. note::
 
         That if a machine has '*' as a value, that value satisfies
@@ -48,37 +178,10 @@ def satisfies(machine, constraints):
     :returns: (bool, [list-of-failed constraint keys])
 
     """
-    kmap = dict(mem='memory',
-                arch='architecture',
-                storage='storage',
-                cpu_cores='cpu_count')
-    kmap['root-disk'] = 'storage'
-
-    cons_checks = []
-
     if constraints is None:
         return (True, [])
 
-    for k, v in constraints.items():
-        if k == 'arch':
-            mval = machine.machine[kmap[k]]
-            if mval != '*' and mval != v:
-                cons_checks.append(k)
-        else:
-            mval = machine.machine[kmap[k]]
-
-            if mval == '*':
-                # '*' always satisfies.
-                continue
-
-            if not str(v).isdecimal():
-                v = human_to_mb(v)
-
-            if mval < v:
-                cons_checks.append(k)
-
-    rval = (len(cons_checks) == 0), cons_checks
-    return rval
+    return compile_constraints(constraints).check(machine)
 
 
 class MaasMachineStatus(Enum):
@@ -294,6 +397,7 @@ class MaasState:
     def __init__(self, maas_client):
         self.maas_client = maas_client
         self._maas_client_nodes = None
+        self._machines_by_instance_id = None
         self.start_time = time.time()
 
     def nodes(self, constraints=None):
@@ -303,6 +407,7 @@ class MaasState:
         if not self._maas_client_nodes or elapsed_time > 20:
             self._maas_client_nodes = self.maas_client.nodes
             self._filtered_nodes = self._maas_client_nodes
+            self._machines_by_instance_id = None
             if constraints:
                 cd = dict(x.split('=') for x in constraints.split(' '))
                 arch = cd.get('arch', None)
@@ -336,10 +441,14 @@ class MaasState:
         :returns: machine
         :rtype: cloudinstall.maas.MaasMachine
         """
-        for m in self.machines():
-            if m.instance_id == instance_id:
-                return m
-        return None
+        self.nodes()
+        if self._machines_by_instance_id is None:
+            # indexed once per load of the nodes, the status screen
+            # looks up the machine of every unit
+            self._machines_by_instance_id = {}
+            for m in self.machines():
+                self._machines_by_instance_id.setdefault(m.instance_id, m)
+        return self._machines_by_instance_id.get(instance_id)
 
     def machines(self, state=None, constraints=None):
         """Maas Machines
@@ -367,9 +476,49 @@ class MaasState:
     def machines_summary(self):
         """ Returns summary of known machines and their states.
         """
-        log.debug("in summary, self.nodes is {}".format(self.nodes()))
-        return Counter([MaasMachineStatus(m['status'])
-                        for m in self.nodes()])
+        nodes = self.nodes()
+        if log.isEnabledFor(logging.DEBUG):
+            # records are formatted on the logging thread, snapshot the
+            # nodes so later changes don't show up in the log
+            log.debug("in summary, self.nodes is %s",
+                      PrettyLog(copy.deepcopy(nodes)))
+        return Counter([MaasMachineStatus(m['status']) for m in nodes])
+
+
+def http_session():
+    """ Returns the requests session shared by all MAAS clients, so
+    connections to MAAS servers are kept alive and reused
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+        return _session
+
+
+class TracedMaasClient(MaasClient):
+
+    """ MaasClient sending its requests through the shared
+    http_session() and recording each as a span, including those made
+    by properties like nodes, which TracedProxy can't time
+    """
+
+    def get(self, url, params=None):
+        with span("maas GET", 'maas', url=url):
+            return http_session().get(url=self.auth.api_url + url,
+                                      auth=self._oauth(),
+                                      params=params)
+
+    def post(self, url, params=None):
+        with span("maas POST", 'maas', url=url):
+            return http_session().post(url=self.auth.api_url + url,
+                                       auth=self._oauth(),
+                                       data=params)
+
+    def delete(self, url, params=None):
+        with span("maas DELETE", 'maas', url=url):
+            return http_session().delete(url=self.auth.api_url + url,
+                                         auth=self._oauth())
 
 
 def connect_to_maas(creds=None):
@@ -382,27 +531,27 @@ def connect_to_maas(creds=None):
     else:
         auth = MaasAuth()
         auth.get_api_key('root')
-    maas = MaasClient(auth)
+    maas = TracedProxy(TracedMaasClient(auth), 'maas')
     maas_state = MaasState(maas)
     return maas, maas_state
 
 
-class FakeMaasState:
+class FakeMaasClient:
 
-    def machines(self, state=None):
-        fakepath = os.getenv("FAKE_API_DATA")
-        fn = os.path.join(fakepath, "maas-machines.json")
+    """ Reads nodes from FAKE_API_DATA/maas-machines.json """
+
+    @property
+    def nodes(self):
+        fn = os.path.join(os.getenv("FAKE_API_DATA"), "maas-machines.json")
         with open(fn) as f:
             try:
-                nodes = json.load(f)
-            except:
+                return json.load(f)
+            except ValueError:
                 log.exception("Error loading JSON")
                 return []
-        return [MaasMachine(-1, m) for m in nodes
-                if m['hostname'] != 'juju-bootstrap.maas']
 
-    def invalidate_nodes_cache(self):
-        "no op"
 
-    def machines_summary(self):
-        return "no summary for fake state"
+class FakeMaasState(MaasState):
+
+    def __init__(self):
+        super().__init__(FakeMaasClient())
@@ -162,3 +162,44 @@ class Machine:
                                             mem=self.mem,
                                             storage=self.storage,
                                             cpus=self.cpu_cores))
+
+
+class HardwareInfoCache:
+
+    """ Hardware info by (juju machine id, instance id)
+
+    A machine's hardware doesn't change once it has an instance, so
+    lookups only miss for new machines, or when juju re-provisions a
+    machine id onto a different instance, which also drops the old
+    entry.
+    """
+
+    # instance ids juju reports before a machine is provisioned
+    unprovisioned = (None, '', 'pending')
+
+    def __init__(self):
+        self._info = {}
+        self._instances = {}
+
+    def __len__(self):
+        return len(self._info)
+
+    def get(self, machine_id, instance_id):
+        return self._info.get((machine_id, instance_id))
+
+    def set(self, machine_id, instance_id, info):
+        """ Stores info, unless the machine isn't provisioned yet
+        """
+        if instance_id in self.unprovisioned:
+            return
+        old = self._instances.get(machine_id)
+        if old is not None and old != instance_id:
+            log.debug("Machine {} re-provisioned as {}, dropping hardware "
+                      "info of {}".format(machine_id, instance_id, old))
+            self._info.pop((machine_id, old), None)
+        self._instances[machine_id] = instance_id
+        self._info[(machine_id, instance_id)] = info
+
+    def clear(self):
+        self._info = {}
+        self._instances = {}
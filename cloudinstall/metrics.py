@@ -0,0 +1,216 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Installer metrics in the Prometheus text format
+
+Metrics are always collected, serving them is optional: set the
+metrics_port config option (--metrics-port) to start an HTTP server
+on localhost that answers GET /metrics.
+
+Juju and MAAS request latencies come from the spans recorded by
+cloudinstall.profiler.
+"""
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import logging
+import threading
+
+from cloudinstall.profiler import profiler
+
+log = logging.getLogger('cloudinstall.metrics')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(
+        k, str(v).replace('\\', r'\\').replace('"', r'\"'))
+        for k, v in pairs) + "}"
+
+
+class Metric:
+
+    """ Base for metrics with optional labels """
+
+    kind = None
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError("{} takes labels {}, got {}".format(
+                self.name, self.labelnames, sorted(labels)))
+        return tuple(labels[n] for n in self.labelnames)
+
+    def samples(self):
+        """ Returns (suffix, label values, extra labels, value) """
+        with self._lock:
+            return [("", k, (), v) for k, v in sorted(self._values.items())]
+
+    def exposition(self):
+        lines = ["# HELP {} {}".format(self.name, self.doc),
+                 "# TYPE {} {}".format(self.name, self.kind)]
+        for suffix, key, extra, value in self.samples():
+            lines.append("{}{}{} {}".format(
+                self.name, suffix,
+                _format_labels(self.labelnames, key, extra),
+                repr(float(value))))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = [(k, list(c), t)
+                      for k, (c, t) in sorted(self._values.items())]
+        samples = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),),
+                                    counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                samples.append(("_bucket", key, (('le', le),), cumulative))
+            samples.append(("_sum", key, (), total))
+            samples.append(("_count", key, (), cumulative))
+        return samples
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def exposition(self):
+        return "\n".join(m.exposition() for m in self.metrics) + "\n"
+
+
+registry = Registry()
+
+juju_request_seconds = registry.register(Histogram(
+    'installer_juju_request_seconds',
+    "Latency of Juju API client calls", ['request']))
+maas_request_seconds = registry.register(Histogram(
+    'installer_maas_request_seconds',
+    "Latency of MAAS API client calls", ['request']))
+subprocess_seconds = registry.register(Histogram(
+    'installer_subprocess_seconds',
+    "Run time of shell commands", []))
+pending_deploys = registry.register(Gauge(
+    'installer_pending_deploys',
+    "Placed services not deployed yet"))
+post_proc_queue_depth = registry.register(Gauge(
+    'installer_post_proc_queue_depth',
+    "Charms waiting for post processing"))
+relations = registry.register(Gauge(
+    'installer_relations',
+    "Relations to add, by state", ['state']))
+ui_frame_seconds = registry.register(Histogram(
+    'installer_ui_frame_seconds',
+    "Time to render and draw a frame of the UI", [],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+             1.0)))
+
+_span_histograms = {'juju': juju_request_seconds,
+                    'maas': maas_request_seconds}
+
+
+def _observe_span(s):
+    duration = s.end - s.start
+    if s.cat in _span_histograms:
+        # span names are "<cat> <method>"
+        request = s.name.split(" ", 1)[-1]
+        _span_histograms[s.cat].observe(duration, request=request)
+    elif s.cat == 'subprocess':
+        subprocess_seconds.observe(duration)
+
+
+profiler.listeners.append(_observe_span)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.exposition().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        log.debug("metrics: " + fmt % args)
+
+
+def start_http_server(port, addr='127.0.0.1'):
+    """ Serves /metrics from a daemon thread, returns the server """
+    server = HTTPServer((addr, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    log.info("Serving metrics on http://{}:{}/metrics".format(
+        addr, server.server_port))
+    return server
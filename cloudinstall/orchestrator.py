@@ -0,0 +1,203 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Runs headless deployments of several environments from one process
+
+    $ openstack-status --orchestrate ~/zone1/config.yaml ~/zone2/config.yaml
+
+Each environment is a config directory as made by openstack-install
+(config.yaml, juju/, placements.yaml, charmconf.yaml) and gets its own
+Config, Controller, JujuState and MaasState. The environments share:
+
+- a pool of max_parallel threads running the deployments, named after
+  the environments so their log lines can be told apart
+- the shutdown event of cloudinstall.async, so shutdown() cancels the
+  waits of every deployment
+- the MAAS HTTP session (cloudinstall.maas.http_session), the charm
+  store lookups (cloudinstall.juju.query_cs) and the parsed charm
+  configs
+- the progress stream, tagged with the environment name, and the
+  metrics server
+- the profiler, each environment's trace only gets the spans of the
+  thread deploying it
+
+Only multi installs can be orchestrated: single installs run their
+deployment inside the install's container.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+import time
+
+import yaml
+
+from cloudinstall import async
+from cloudinstall import utils
+from cloudinstall.config import Config
+from cloudinstall.consoleui import ConsoleUI
+from cloudinstall.core import Controller
+
+log = logging.getLogger('cloudinstall.orchestrator')
+
+
+class OrchestratorException(Exception):
+
+    """ An environment can't be orchestrated """
+
+
+class EnvironmentExit(Exception):
+
+    """ Raised by EnvironmentLoop.exit() to end one deployment """
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+class EnvironmentLoop:
+
+    """ Stands in for the EventLoop of a headless deployment, exit()
+    ends the deployment's thread rather than the process
+    """
+
+    def __init__(self):
+        self.error_code = 0
+
+    def exit(self, err=0):
+        self.error_code = err
+        raise EnvironmentExit(err)
+
+    def close(self):
+        pass
+
+    def redraw_screen(self):
+        pass
+
+    def request_redraw(self):
+        pass
+
+
+class Environment:
+
+    """ One deployment run by the Orchestrator """
+
+    def __init__(self, name, config, progress=None):
+        """
+        :param str name: environment name, unique in the orchestrator
+        :param config: :class:Config of the environment
+        :param progress: shared ProgressStream, or None
+        """
+        if config.is_single():
+            raise OrchestratorException(
+                "{}: single installs can't be orchestrated".format(name))
+        self.name = name
+        self.config = config
+        if progress is not None:
+            progress = progress.for_install(name)
+        self.ui = ConsoleUI(progress=progress)
+        self.loop = EnvironmentLoop()
+        self.controller = Controller(ui=self.ui, config=config,
+                                     loop=self.loop)
+        # run() names its thread after the environment
+        self.controller.profile_thread = name
+        self.exit_code = None
+        self.seconds = None
+
+    @classmethod
+    def from_config_file(cls, cfg_file, progress=None):
+        """ Loads an environment from its config.yaml, the environment
+        is named after the config directory
+        """
+        cfg_file = os.path.abspath(cfg_file)
+        if not os.path.isfile(cfg_file):
+            raise OrchestratorException(
+                "No configuration found in {}".format(cfg_file))
+        cfg = yaml.load(utils.slurp(cfg_file)) or {}
+        cfg['headless'] = True
+        config = Config(cfg, cfg_file=cfg_file)
+        if os.path.exists(config.store_path):
+            config.open_store()
+        name = os.path.basename(config.cfg_path)
+        return cls(name, config, progress=progress)
+
+    def run(self):
+        """ Deploys the environment, returns the exit code """
+        threading.current_thread().name = self.name
+        log.info("Starting deployment of {}".format(self.name))
+        start = time.time()
+        try:
+            if os.path.isfile(self.config.pidfile):
+                raise OrchestratorException(
+                    "Another instance of openstack-status is running for "
+                    "{}, remove {} if there is none".format(
+                        self.name, self.config.pidfile))
+            utils.spew(self.config.pidfile, str(os.getpid()),
+                       utils.install_user())
+            try:
+                self.controller.initialize()
+                self.exit_code = self.loop.error_code
+            finally:
+                os.remove(self.config.pidfile)
+        except EnvironmentExit as e:
+            self.exit_code = e.code
+        except Exception as e:
+            if isinstance(e, OrchestratorException):
+                log.error(str(e))
+            else:
+                log.exception("Deployment of {} failed".format(self.name))
+            self.ui.progress_event('finished', status='error', error=str(e))
+            self.exit_code = 1
+        finally:
+            self.seconds = time.time() - start
+            self.config.save()
+            self.controller.write_profile()
+        log.info("Deployment of {} finished with {} in {:.0f}s".format(
+            self.name, self.exit_code, self.seconds))
+        return self.exit_code
+
+
+class Orchestrator:
+
+    """ Runs the deployments of several environments on a shared pool
+    of threads
+    """
+
+    def __init__(self, environments, max_parallel=None):
+        """
+        :param list environments: :class:Environment
+        :param int max_parallel: most deployments run at once, defaults
+            to all of them
+        """
+        names = [env.name for env in environments]
+        duplicates = sorted(set(n for n in names if names.count(n) > 1))
+        if duplicates:
+            raise OrchestratorException("Environment names must be unique, "
+                                        "got {} more than once".format(
+                                            ", ".join(duplicates)))
+        self.environments = environments
+        self.max_parallel = max_parallel or max(1, len(environments))
+
+    def run(self):
+        """ Runs every deployment, returns {name: exit code} """
+        with ThreadPoolExecutor(self.max_parallel) as pool:
+            for env in self.environments:
+                pool.submit(env.run)
+        return {env.name: env.exit_code for env in self.environments}
+
+    def shutdown(self):
+        """ Cancels the deployments at their next wait """
+        async.ShutdownEvent.set()
@@ -15,12 +15,15 @@
 
 from collections import defaultdict, Counter
 import copy
+from collections.abc import MutableMapping
 from enum import Enum
 import logging
 import yaml
 from multiprocessing import cpu_count
 
+from cloudinstall.log import PrettyLog
 from cloudinstall.maas import (satisfies, MaasMachineStatus)
+from cloudinstall.placement.solver import PlacementSolver
 from cloudinstall.utils import load_charms
 from cloudinstall.state import CharmState
 
@@ -106,6 +109,133 @@ class PlacementError(Exception):
     "Generic exception class for placement related errors"
 
 
+class AssignmentIndex:
+
+    """Reverse index over an assignments-style dict.
+
+    Maps each charm class to {atype: [instance ids]} and keeps a count
+    of units per charm, so that lookups by charm don't have to scan
+    every machine's assignments.
+
+    An index with a base reads through to it, and copies a charm's
+    entry from the base the first time that charm is changed.
+    """
+
+    def __init__(self, a_dict=None, base=None):
+        self.rebuild(a_dict or {})
+        self.base = base
+
+    def rebuild(self, a_dict):
+        self.base = None
+        self.by_charm = defaultdict(lambda: defaultdict(list))
+        self.counts = Counter()
+        self._owned = set()
+        for iid, ad in a_dict.items():
+            for atype, cl in ad.items():
+                for cc in cl:
+                    self.add(iid, cc, atype)
+
+    def _own(self, charm_class):
+        if self.base is None or charm_class in self._owned:
+            return
+        self._owned.add(charm_class)
+        for atype, iids in self.base.get(charm_class).items():
+            self.by_charm[charm_class][atype] = list(iids)
+        n = self.base.count(charm_class)
+        if n > 0:
+            self.counts[charm_class] = n
+
+    def add(self, iid, charm_class, atype):
+        self._own(charm_class)
+        self.by_charm[charm_class][atype].append(iid)
+        self.counts[charm_class] += 1
+
+    def remove(self, iid, charm_class, atype):
+        self._own(charm_class)
+        ad = self.by_charm[charm_class]
+        ad[atype].remove(iid)
+        if len(ad[atype]) == 0:
+            del ad[atype]
+        if len(ad) == 0:
+            del self.by_charm[charm_class]
+        self.counts[charm_class] -= 1
+        if self.counts[charm_class] <= 0:
+            del self.counts[charm_class]
+
+    def get(self, charm_class):
+        """returns {atype: [instance ids]} for charm_class"""
+        if self.base is not None and charm_class not in self._owned:
+            return self.base.get(charm_class)
+        return self.by_charm.get(charm_class, {})
+
+    def count(self, charm_class):
+        if self.base is not None and charm_class not in self._owned:
+            return self.base.count(charm_class)
+        return self.counts[charm_class]
+
+    def charm_classes(self):
+        if self.base is None:
+            return set(self.counts)
+        return (self.base.charm_classes() - self._owned) | set(self.counts)
+
+
+class AssignmentOverlay(MutableMapping):
+
+    """Copy-on-write view of an assignments-style dict.
+
+    Behaves like defaultdict(lambda: defaultdict(list)). A machine's
+    entry is copied from the base the first time it is looked up, and
+    changes are kept here until applied with
+    PlacementController.update_from_controller().
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.local = {}
+        self.deleted = set()
+
+    def __getitem__(self, iid):
+        if iid not in self.local:
+            ad = defaultdict(list)
+            if iid not in self.deleted and iid in self.base:
+                for atype, cl in self.base[iid].items():
+                    ad[atype] = list(cl)
+            self.local[iid] = ad
+            self.deleted.discard(iid)
+        return self.local[iid]
+
+    def __setitem__(self, iid, ad):
+        self.local[iid] = ad
+        self.deleted.discard(iid)
+
+    def __delitem__(self, iid):
+        if iid not in self:
+            raise KeyError(iid)
+        self.local.pop(iid, None)
+        self.deleted.add(iid)
+
+    def __contains__(self, iid):
+        return iid in self.local or (iid not in self.deleted and
+                                     iid in self.base)
+
+    def __iter__(self):
+        for iid in self.local:
+            yield iid
+        for iid in self.base:
+            if iid not in self.local and iid not in self.deleted:
+                yield iid
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def changes(self):
+        """Returns {iid: assignments} for each machine looked up or
+        changed here, with None for removed machines."""
+        changes = dict.fromkeys(self.deleted)
+        changes.update(self.local)
+        return changes
+
+
 class PlacementController:
 
     """Keeps state of current machines and their assigned services.
@@ -114,6 +244,10 @@ class PlacementController:
     one for "Juju Default" that are both the equivalent of not
     specifying a machine to deploy to when invoking Juju.
 
+    Reverse indexes of assignments and deployments by charm are kept
+    up to date by every method that changes them. Code that modifies
+    self.assignments or self.deployments directly must call
+    reset_assigned_deployed() afterwards.
     """
 
     def __init__(self, maas_state=None, config=None):
@@ -128,6 +262,14 @@ class PlacementController:
         self.assignments = defaultdict(lambda: defaultdict(list))
         self.deployments = defaultdict(lambda: defaultdict(list))
         self.autosave_filename = None
+        self._machines_by_id = {}
+        self._charm_classes = None
+        self._charm_plugin_dir = None
+        self.assignment_index = AssignmentIndex()
+        self.deployment_index = AssignmentIndex()
+        # see machine_revision()
+        self._generation = 0
+        self._machine_revisions = Counter()
         self.reset_assigned_deployed()
 
     def get_temp_copy(self):
@@ -135,25 +277,64 @@ class PlacementController:
         assignments temporarily, e.g. for supporting cancellable
         assignments in a dialog box.
 
+        The copy reads through to this controller and only records
+        what it changes, so making one doesn't depend on the number of
+        assignments.
+
         Pairs with update_from_controller() to 'commit' those temporary
         assignments to the 'main' controller.
         """
         newpc = PlacementController(maas_state=self.maas_state,
                                     config=self.config)
-        newpc.assignments = copy.copy(self.assignments)
-        newpc.deployments = copy.copy(self.deployments)
+        newpc.assignments = AssignmentOverlay(self.assignments)
+        newpc.deployments = AssignmentOverlay(self.deployments)
+        newpc.assignment_index = AssignmentIndex(base=self.assignment_index)
+        newpc.deployment_index = AssignmentIndex(base=self.deployment_index)
         newpc._machines = self._machines
-        newpc.reset_assigned_deployed()
+        newpc._machines_by_id = self._machines_by_id
+        newpc._charm_classes = self._charm_classes
+        newpc._charm_plugin_dir = self._charm_plugin_dir
         return newpc
 
     def update_from_controller(self, other):
         """Updates internal structures based on other's.
         For integrating temporarily tracked updates."""
 
+        if isinstance(other.assignments, AssignmentOverlay) and \
+           other.assignments.base is self.assignments and \
+           isinstance(other.deployments, AssignmentOverlay) and \
+           other.deployments.base is self.deployments:
+            self._apply_changes(self.assignments, self.assignment_index,
+                                other.assignments.changes())
+            self._apply_changes(self.deployments, self.deployment_index,
+                                other.deployments.changes())
+            self.do_autosave()
+            return
+
         self.assignments = other.assignments
         self.deployments = other.deployments
         self.reset_assigned_deployed()
 
+    def _apply_changes(self, a_dict, index, changes):
+        "Helper for update_from_controller"
+        for iid, new_ad in changes.items():
+            old_ad = a_dict[iid] if iid in a_dict else {}
+            if new_ad == old_ad:
+                continue
+            self._touch(iid)
+            for atype, cl in old_ad.items():
+                for cc in cl:
+                    index.remove(iid, cc, atype)
+            if new_ad is None:
+                if iid in a_dict:
+                    del a_dict[iid]
+                continue
+            self._touch(iid)
+            a_dict[iid] = new_ad
+            for atype, cl in new_ad.items():
+                for cc in cl:
+                    index.add(iid, cc, atype)
+
     def set_assignments_from_deployments(self):
         """Reset deployment state of all services. Useful after reading a file
         from a previous install.
@@ -252,7 +433,6 @@ class PlacementController:
         self.reset_assigned_deployed()
 
     def update_and_save(self):
-        self.reset_assigned_deployed()
         self.do_autosave()
 
     def is_placeholder(self, mid):
@@ -271,11 +451,26 @@ class PlacementController:
         else:
             ms = self._machines
 
+        placeholders = [self.sub_placeholder, self.def_placeholder]
+        self._machines_by_id = {m.instance_id: m for m in ms + placeholders}
+
         if include_placeholders:
-            return ms + [self.sub_placeholder, self.def_placeholder]
+            return ms + placeholders
         else:
             return ms
 
+    def machine_for_id(self, instance_id):
+        """Returns the machine with the given instance id, or None.
+
+        Uses the machines seen by the last call to machines(), and
+        only asks again if the id isn't among them.
+        """
+        m = self._machines_by_id.get(instance_id)
+        if m is None:
+            self.machines()
+            m = self._machines_by_id.get(instance_id)
+        return m
+
     def machines_pending(self, include_placeholders=False):
         """Returns a list of machines that have charms assigned to them which
         are not yet deployed.
@@ -294,11 +489,15 @@ class PlacementController:
         return ms
 
     def charm_classes(self):
-        cl = [m.__charm_class__ for m in
-              load_charms(self.config.getopt('charm_plugin_dir'))
-              if not m.__charm_class__.disabled]
+        plugin_dir = self.config.getopt('charm_plugin_dir')
+        if self._charm_classes is None or \
+           plugin_dir != self._charm_plugin_dir:
+            self._charm_classes = [m.__charm_class__ for m in
+                                   load_charms(plugin_dir)
+                                   if not m.__charm_class__.disabled]
+            self._charm_plugin_dir = plugin_dir
 
-        return cl
+        return list(self._charm_classes)
 
     def assigned_charm_classes(self):
         """Returns a deduplicated list of all charms that have a placement
@@ -314,35 +513,38 @@ class PlacementController:
 
     def assign(self, machine, charm_class, atype):
         if not charm_class.allow_multi_units:
-            for m, d in self.assignments.items():
-                for at, l in d.items():
-                    if charm_class in l:
-                        l.remove(charm_class)
+            ad = self.assignment_index.get(charm_class)
+            for at, iids in list(ad.items()):
+                for iid in list(iids):
+                    self.assignments[iid][at].remove(charm_class)
+                    self.assignment_index.remove(iid, charm_class, at)
+                    self._touch(iid)
 
         self.assignments[machine.instance_id][atype].append(charm_class)
+        self._touch(machine.instance_id)
+        self.assignment_index.add(machine.instance_id, charm_class, atype)
         self.update_and_save()
 
     def mark_deployed(self, machine, charm_class, atype):
-        self.deployments[machine.instance_id][atype].append(charm_class)
-        self.assignments[machine.instance_id][atype].remove(charm_class)
+        iid = machine.instance_id
+        self.assignments[iid][atype].remove(charm_class)
+        self.assignment_index.remove(iid, charm_class, atype)
+        self.deployments[iid][atype].append(charm_class)
+        self.deployment_index.add(iid, charm_class, atype)
+        self._touch(iid)
         self.update_and_save()
 
-    def _get_machines_by_atype(self, a_dict, charm_class):
+    def _get_machines_by_atype(self, index, charm_class):
         "Helper for get_assignments and get_deployments"
-        all_machines = self.machines()
-
         machines_by_atype = defaultdict(list)
-        for m_id, d in a_dict.items():
-            m = next((m for m in all_machines
-                      if m.instance_id == m_id), None)
-            if not m:
-                log.debug("can't find machine for m_id '{}'".format(m_id))
-                continue
-
-            for atype, assignment_list in d.items():
-                for c in assignment_list:
-                    if c == charm_class:
-                        machines_by_atype[atype].append(m)
+        for atype, iids in index.get(charm_class).items():
+            for m_id in iids:
+                m = self.machine_for_id(m_id)
+                if not m:
+                    log.debug("can't find machine for "
+                              "m_id '{}'".format(m_id))
+                    continue
+                machines_by_atype[atype].append(m)
 
         return machines_by_atype
 
@@ -351,7 +553,7 @@ class PlacementController:
 
         returns a dict like {assignment_type : [machines]}
         """
-        return self._get_machines_by_atype(self.assignments,
+        return self._get_machines_by_atype(self.assignment_index,
                                            charm_class)
 
     def get_deployments(self, charm_class):
@@ -359,11 +561,13 @@ class PlacementController:
 
         returns a dict like {assignment_type : [machines]}
         """
-        return self._get_machines_by_atype(self.deployments,
+        return self._get_machines_by_atype(self.deployment_index,
                                            charm_class)
 
     def clear_all_assignments(self):
         self.assignments = defaultdict(lambda: defaultdict(list))
+        self.assignment_index.rebuild(self.assignments)
+        self._generation += 1
         self.update_and_save()
 
     def clear_assignments(self, m):
@@ -373,7 +577,11 @@ class PlacementController:
         if m.instance_id not in self.assignments:
             return
 
+        for atype, cl in self.assignments[m.instance_id].items():
+            for cc in cl:
+                self.assignment_index.remove(m.instance_id, cc, atype)
         del self.assignments[m.instance_id]
+        self._touch(m.instance_id)
         self.update_and_save()
 
     def remove_one_assignment(self, m, cc):
@@ -381,6 +589,8 @@ class PlacementController:
         for atype, assignment_list in ad.items():
             if cc in assignment_list:
                 assignment_list.remove(cc)
+                self.assignment_index.remove(m.instance_id, cc, atype)
+                self._touch(m.instance_id)
                 break
         self.update_and_save()
 
@@ -413,33 +623,39 @@ class PlacementController:
 
     def set_all_assignments(self, assignments):
         self.assignments = assignments
+        self.assignment_index.rebuild(self.assignments)
+        self._generation += 1
         self.update_and_save()
 
     def reset_assigned_deployed(self):
-        self.assigned_services = set()
-        self.deployed_services = set()
-        for cc in self.charm_classes():
-            ad = self.get_assignments(cc)
-            is_assigned = False
-            for atype, al in ad.items():
-                if len(al) > 0:
-                    is_assigned = True
-            if is_assigned:
-                self.assigned_services.add(cc)
+        """Rebuilds the charm indexes from the assignments and
+        deployments dicts."""
+        self.assignment_index.rebuild(self.assignments)
+        self.deployment_index.rebuild(self.deployments)
+        self._generation += 1
 
-            dd = self.get_deployments(cc)
-            is_deployed = False
-            for atype, dl in dd.items():
-                if len(dl) > 0:
-                    is_deployed = True
-            if is_deployed:
-                self.deployed_services.add(cc)
+    def _touch(self, instance_id):
+        self._machine_revisions[instance_id] += 1
+
+    def machine_revision(self, instance_id):
+        """Returns a value that changes whenever the assignments or
+        deployments of the given machine change, so views can tell
+        which machines need redrawing."""
+        return (self._generation, self._machine_revisions[instance_id])
+
+    @property
+    def assigned_services(self):
+        return self.assignment_index.charm_classes()
+
+    @property
+    def deployed_services(self):
+        return self.deployment_index.charm_classes()
 
     def is_assigned(self, charm):
-        return charm in self.assigned_services
+        return self.assignment_index.count(charm) > 0
 
     def is_deployed(self, charm):
-        return charm in self.deployed_services
+        return self.deployment_index.count(charm) > 0
 
     def get_charm_state(self, charm):
         """Returns tuple of charm state:
@@ -529,12 +745,12 @@ class PlacementController:
     def assignment_machine_count_for_charm(self, cc):
         """Returns the total number of assignments of any type for a given
         charm."""
-        return sum([len(al) for al in self.get_assignments(cc).values()])
+        return self.assignment_index.count(cc)
 
     def deployment_machine_count_for_charm(self, cc):
         """Returns the total number of deployments of any type for a given
         charm."""
-        return sum([len(al) for al in self.get_deployments(cc).values()])
+        return self.deployment_index.count(cc)
 
     def autoassign_unassigned_services(self):
         """Attempt to find machines for all required unassigned services using
@@ -552,8 +768,12 @@ class PlacementController:
         unassigned_defaults = self.gen_defaults(unassigned_services,
                                                 empty_machines)
 
-        for mid, charm_classes in unassigned_defaults.items():
-            self.assignments[mid] = charm_classes
+        for mid, ad in unassigned_defaults.items():
+            for atype, charm_classes in ad.items():
+                for cc in charm_classes:
+                    self.assignments[mid][atype].append(cc)
+                    self.assignment_index.add(mid, cc, atype)
+            self._touch(mid)
 
         self.update_and_save()
 
@@ -593,21 +813,25 @@ class PlacementController:
                 MaasMachineStatus.READY,
                 constraints=self.config.getopt('constraints'))
 
-        def satisfying_machine(constraints):
-            for machine in maas_machines:
-                if satisfies(machine, constraints)[0]:
-                    maas_machines.remove(machine)
-                    return machine
-
-            return None
+        solver = PlacementSolver(maas_machines,
+                                 lambda m, cons: satisfies(m, cons)[0])
 
         isolated_charms, controller_charms = [], []
         subordinate_charms = []
+        selected = []
 
         for charm_class in charm_classes:
             state, _, _ = self.get_charm_state(charm_class)
             if state != CharmState.REQUIRED:
                 continue
+            conflicting = [c.charm_name for c in selected
+                           if c.charm_name in charm_class.conflicts or
+                           charm_class.charm_name in c.conflicts]
+            if conflicting:
+                log.debug("Not placing {}, it conflicts with {}".format(
+                    charm_class.charm_name, conflicting))
+                continue
+            selected.append(charm_class)
             if charm_class.isolate:
                 assert(not charm_class.subordinate)
                 isolated_charms.append(charm_class)
@@ -617,14 +841,17 @@ class PlacementController:
             else:
                 controller_charms.append(charm_class)
 
-        for charm_class in isolated_charms:
-            for n in range(charm_class.required_num_units()):
-                m = satisfying_machine(charm_class.constraints)
-                if m:
-                    l = assignments[m.instance_id][AssignmentType.BareMetal]
-                    l.append(charm_class)
+        placed, short = solver.place_isolated(isolated_charms)
+        for charm_class, m in placed:
+            l = assignments[m.instance_id][AssignmentType.BareMetal]
+            l.append(charm_class)
+        if short:
+            log.debug("Not enough machines for {}".format(
+                [cc.charm_name for cc in short]))
 
-        controller_machine = satisfying_machine({})
+        controller_machine = None
+        if controller_charms:
+            controller_machine = solver.place_shared(controller_charms)
         if controller_machine:
             for charm_class in controller_charms:
                 ad = assignments[controller_machine.instance_id]
@@ -636,8 +863,9 @@ class PlacementController:
             l = ad[AssignmentType.DEFAULT]
             l.append(charm_class)
 
-        import pprint
-        log.debug(pprint.pformat(assignments))
+        if log.isEnabledFor(logging.DEBUG):
+            # formatted on the logging thread, while callers change it
+            log.debug("%s", PrettyLog(copy.deepcopy(assignments)))
         return assignments
 
     def gen_single(self):
@@ -688,6 +916,7 @@ class PlacementController:
                 ad = assignments[controller.instance_id]
                 ad[AssignmentType.LXC].append(charm_class)
 
-        import pprint
-        log.debug("gen_single() = '{}'".format(pprint.pformat(assignments)))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("gen_single() = '%s'",
+                      PrettyLog(copy.deepcopy(assignments)))
         return assignments
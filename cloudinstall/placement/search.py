@@ -0,0 +1,250 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Search index for the placement filter box
+
+Queries are whitespace separated terms that must all match:
+
+- ``word`` matches any document containing word as a substring
+- ``field:value`` matches documents with a value of field starting
+  with value, e.g. ``tag:ssd`` or ``hostname:node1``, as well as
+  documents containing the whole term as a substring
+- ``field>N``, ``field>=N``, ``field<N``, ``field<=N`` and
+  ``field=N`` compare numeric fields; sizes may use units, e.g.
+  ``mem>16G``
+"""
+
+from bisect import bisect_left, insort
+from collections import defaultdict
+from enum import Enum
+import logging
+import re
+
+from cloudinstall.utils import human_to_mb
+
+log = logging.getLogger('cloudinstall.placement.search')
+
+# fields whose values are sizes in megabytes
+SIZE_FIELDS = ['mem', 'storage']
+NUMERIC_FIELDS = SIZE_FIELDS + ['cores']
+
+TERM_RE = re.compile(r'^(?P<field>[a-z_-]+)(?P<op>:|>=|<=|>|<|=)'
+                     r'(?P<value>.+)$')
+
+
+def trigrams(s):
+    return set(s[i:i + 3] for i in range(len(s) - 2))
+
+
+def to_number(value):
+    """Parses a numeric value, with an optional M/G/T/P unit.
+    Returns None if value isn't a number."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if value == '*':
+        return float('inf')
+    try:
+        return float(human_to_mb(str(value).upper()))
+    except (KeyError, ValueError):
+        return None
+
+
+def parse_query(query):
+    """Returns a list of (field, op, value, word) terms. field and op
+    are None for plain words."""
+    terms = []
+    for word in query.lower().split():
+        m = TERM_RE.match(word)
+        if m is None:
+            terms.append((None, None, word, word))
+            continue
+        field, op, value = m.group('field', 'op', 'value')
+        if op == ':':
+            terms.append((field, op, value, word))
+        elif field in NUMERIC_FIELDS and to_number(value) is not None:
+            terms.append((field, op, to_number(value), word))
+        else:
+            terms.append((None, None, word, word))
+    return terms
+
+
+def _values(value):
+    if isinstance(value, (list, tuple, set)):
+        vals = value
+    else:
+        vals = [value]
+    for v in vals:
+        if isinstance(v, Enum):
+            v = str(v)
+        if isinstance(v, (str, int, float)) and v != '':
+            yield v
+
+
+def machine_fields(machine, charm_classes=()):
+    """Returns the searchable fields of a machine, with charm_classes
+    being the charms assigned or deployed to it."""
+    hw = machine.machine if isinstance(machine.machine, dict) else {}
+    tags = list(hw.get('tag_names') or [])
+    if hw.get('tag'):
+        tags.append(hw['tag'])
+    return {'hostname': machine.hostname,
+            'arch': hw.get('architecture'),
+            'tag': tags,
+            'mem': hw.get('memory'),
+            'storage': hw.get('storage'),
+            'cores': hw.get('cpu_count'),
+            'status': machine.status,
+            'service': [cc.charm_name for cc in charm_classes]}
+
+
+class SearchIndex:
+
+    """Token and trigram index over documents of fields.
+
+    Each document has a key, a dict of field values (a value may be a
+    list) and optional free text. Documents are replaced one at a time
+    with update(), which does nothing if the document hasn't changed.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        # token -> keys of documents containing it
+        self.tokens = defaultdict(set)
+        # trigram -> tokens containing it
+        self.trigrams = defaultdict(set)
+        # field -> sorted list of tokens, and (field, token) -> keys
+        self.field_vocab = defaultdict(list)
+        self.field_tokens = defaultdict(set)
+        # field -> {key: number}
+        self.numbers = defaultdict(dict)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, key):
+        return key in self.docs
+
+    def _doc_tokens(self, fields, text):
+        tokens = set(text.lower().split())
+        field_tokens = set()
+        numbers = {}
+        for field, value in fields.items():
+            for v in _values(value):
+                token = str(v).lower()
+                tokens.add(token)
+                field_tokens.add((field, token))
+                if field in NUMERIC_FIELDS:
+                    n = to_number(v)
+                    if n is not None:
+                        numbers[field] = n
+        return tokens, field_tokens, numbers
+
+    def update(self, key, fields, text=""):
+        doc = (fields, text)
+        if self.docs.get(key) == doc:
+            return
+        self.remove(key)
+        tokens, field_tokens, numbers = self._doc_tokens(fields, text)
+        for token in tokens:
+            if token not in self.tokens:
+                for tri in trigrams(token):
+                    self.trigrams[tri].add(token)
+            self.tokens[token].add(key)
+        for field, token in field_tokens:
+            if (field, token) not in self.field_tokens:
+                insort(self.field_vocab[field], token)
+            self.field_tokens[(field, token)].add(key)
+        for field, n in numbers.items():
+            self.numbers[field][key] = n
+        self.docs[key] = doc
+
+    def remove(self, key):
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        tokens, field_tokens, numbers = self._doc_tokens(*doc)
+        for token in tokens:
+            keys = self.tokens[token]
+            keys.discard(key)
+            if not keys:
+                del self.tokens[token]
+                for tri in trigrams(token):
+                    self.trigrams[tri].discard(token)
+                    if not self.trigrams[tri]:
+                        del self.trigrams[tri]
+        for field, token in field_tokens:
+            keys = self.field_tokens[(field, token)]
+            keys.discard(key)
+            if not keys:
+                del self.field_tokens[(field, token)]
+                vocab = self.field_vocab[field]
+                del vocab[bisect_left(vocab, token)]
+        for field in numbers:
+            self.numbers[field].pop(key, None)
+
+    def retain(self, keys):
+        """Removes documents whose key isn't in keys."""
+        for key in [k for k in self.docs if k not in keys]:
+            self.remove(key)
+
+    def _substring(self, word):
+        if len(word) >= 3:
+            tris = trigrams(word)
+            candidates = set.intersection(*[self.trigrams.get(t, set())
+                                            for t in tris])
+        else:
+            candidates = self.tokens.keys()
+        keys = set()
+        for token in candidates:
+            if word in token:
+                keys |= self.tokens[token]
+        return keys
+
+    def _prefix(self, field, value):
+        vocab = self.field_vocab.get(field, [])
+        keys = set()
+        i = bisect_left(vocab, value)
+        while i < len(vocab) and vocab[i].startswith(value):
+            keys |= self.field_tokens[(field, vocab[i])]
+            i += 1
+        return keys
+
+    def _compare(self, field, op, number):
+        ops = {'>': float.__gt__, '>=': float.__ge__,
+               '<': float.__lt__, '<=': float.__le__,
+               '=': float.__eq__}
+        cmp = ops[op]
+        return set(k for k, n in self.numbers.get(field, {}).items()
+                   if cmp(n, number))
+
+    def search(self, query):
+        """Returns the set of keys matching every term of query, or
+        None if the query is empty."""
+        terms = parse_query(query)
+        if not terms:
+            return None
+        result = None
+        for field, op, value, word in terms:
+            if field is None:
+                keys = self._substring(word)
+            elif op == ':':
+                # free text like 'cores:4' from filter labels matches too
+                keys = self._prefix(field, value) | self._substring(word)
+            else:
+                keys = self._compare(field, op, value)
+            result = keys if result is None else result & keys
+            if not result:
+                break
+        return result
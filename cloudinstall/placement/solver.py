@@ -0,0 +1,165 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Best-fit machine selection for automatic placement """
+
+from bisect import bisect_left
+import logging
+
+from cloudinstall.utils import human_to_mb
+
+log = logging.getLogger('cloudinstall.placement.solver')
+
+# machine hardware keys, in the order capacities are compared
+CAPACITY_KEYS = ['memory', 'storage', 'cpu_count']
+
+# constraint keys for each capacity key
+CONSTRAINT_KEYS = {'mem': 'memory',
+                   'root-disk': 'storage',
+                   'storage': 'storage',
+                   'cpu_cores': 'cpu_count'}
+
+
+def _to_number(value):
+    """Parses a machine or constraint value, '*' means unlimited."""
+    if value == '*':
+        return float('inf')
+    if isinstance(value, str) and value and not value.isdecimal():
+        try:
+            return human_to_mb(value)
+        except (KeyError, ValueError):
+            return 0
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def demand(constraints):
+    """Returns constraints as a tuple ordered like CAPACITY_KEYS."""
+    d = dict.fromkeys(CAPACITY_KEYS, 0)
+    for k, v in (constraints or {}).items():
+        if k in CONSTRAINT_KEYS:
+            d[CONSTRAINT_KEYS[k]] = _to_number(v)
+    return tuple(d[k] for k in CAPACITY_KEYS)
+
+
+def capacity(machine):
+    """Returns a machine's hardware as a tuple ordered like
+    CAPACITY_KEYS."""
+    hw = machine.machine
+    return tuple(_to_number(hw.get(k, 0)) for k in CAPACITY_KEYS)
+
+
+def combined_constraints(charm_classes):
+    """Constraints for a machine hosting all of charm_classes in
+    containers: memory and disk add up, cpu cores don't.
+
+    Sizes are in megabytes.
+    """
+    combined = {}
+    for cc in charm_classes:
+        for k, v in (cc.constraints or {}).items():
+            if k == 'arch' or v == '*':
+                combined[k] = v
+                continue
+            n = int(_to_number(v))
+            if k == 'cpu_cores':
+                combined[k] = max(combined.get(k, 0), n)
+            else:
+                combined[k] = combined.get(k, 0) + n
+    return combined
+
+
+class PlacementSolver:
+
+    """Chooses machines for charms from a fixed pool.
+
+    Machines are kept sorted by capacity so that each request gets the
+    smallest machine that fits it, leaving larger machines for charms
+    that need them.
+
+    fits(machine, constraints) decides whether a machine can be used;
+    capacities only order the search.
+    """
+
+    def __init__(self, machines, fits):
+        self.fits = fits
+        # stable sort keeps the given order among equal machines
+        pool = sorted(enumerate(machines),
+                      key=lambda im: (capacity(im[1]), im[0]))
+        self._machines = [m for _, m in pool]
+        self._capacities = [capacity(m) for m in self._machines]
+
+    def __len__(self):
+        return len(self._machines)
+
+    def take(self, constraints, largest=False):
+        """Removes and returns the best fitting machine for constraints,
+        or None if no machine fits.
+
+        With largest=True, returns the largest fitting machine instead.
+        """
+        n = len(self._machines)
+        if largest:
+            order = range(n - 1, -1, -1)
+        else:
+            lo = bisect_left(self._capacities, demand(constraints))
+            # machines below lo are unlikely to fit, so try them last
+            order = list(range(lo, n)) + list(range(lo))
+        for i in order:
+            m = self._machines[i]
+            if self.fits(m, constraints):
+                del self._machines[i]
+                del self._capacities[i]
+                return m
+        return None
+
+    def place_isolated(self, charm_classes):
+        """Chooses one machine per required unit of each charm class,
+        placing the most demanding charms first.
+
+        Returns a list of (charm_class, machine) pairs and a list of
+        charm classes that did not get all their units.
+        """
+        placed, short = [], []
+        ordered = sorted(charm_classes,
+                         key=lambda cc: demand(cc.constraints),
+                         reverse=True)
+        for cc in ordered:
+            for n in range(cc.required_num_units()):
+                m = self.take(cc.constraints)
+                if m is None:
+                    short.append(cc)
+                    break
+                placed.append((cc, m))
+        return placed, short
+
+    def place_shared(self, charm_classes):
+        """Chooses a machine to host all of charm_classes in
+        containers, falling back to the largest machine when none
+        fits their combined constraints.
+        """
+        constraints = combined_constraints(charm_classes)
+        m = self.take(constraints)
+        if m is None:
+            arch_only = {k: v for k, v in constraints.items()
+                         if k == 'arch'}
+            m = self.take(arch_only, largest=True)
+            if m is not None:
+                log.debug("No machine fits all of {}, using "
+                          "{}".format([cc.charm_name for cc in charm_classes],
+                                      m))
+        return m
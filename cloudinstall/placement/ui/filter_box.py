@@ -45,5 +45,6 @@ class FilterBox(WidgetWrap):
             t = ''
         else:
             t = ('label',
-                 "  Filter on hostname or hardware info like 'cores:4'")
+                 "  Filter on hostname or hardware info like 'cores:4' "
+                 "or 'tag:ssd mem>16G'")
         self.info_text.set_text(t)
@@ -0,0 +1,110 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+
+from urwid import AttrMap, Divider, Padding
+
+log = logging.getLogger('cloudinstall.placement')
+
+
+def item_divider():
+    return AttrMap(Padding(Divider('\u23bc'), left=2, right=2), 'label')
+
+
+class KeyedWidgetList:
+
+    """Rows of a Pile, one widget per key, each followed by a divider.
+
+    The rows come after whatever the pile already contains when this
+    is created. reconcile() compares the wanted keys with the current
+    rows and only inserts, removes or moves the rows that differ, so
+    an update where nothing changed doesn't touch the pile.
+    """
+
+    def __init__(self, pile):
+        self.pile = pile
+        self.header_len = len(pile.contents)
+        self.keys = []
+        self.widgets = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.widgets
+
+    def get(self, key):
+        return self.widgets.get(key)
+
+    def ordered(self):
+        return [self.widgets[k] for k in self.keys]
+
+    def _pos(self, i):
+        return self.header_len + 2 * i
+
+    def insert(self, i, key, widget):
+        options = self.pile.options()
+        pos = self._pos(i)
+        self.pile.contents[pos:pos] = [(widget, options),
+                                       (item_divider(), options)]
+        self.keys.insert(i, key)
+        self.widgets[key] = widget
+
+    def append(self, key, widget):
+        self.insert(len(self.keys), key, widget)
+
+    def remove(self, key):
+        if key not in self.widgets:
+            return
+        i = self.keys.index(key)
+        pos = self._pos(i)
+        del self.pile.contents[pos:pos + 2]
+        del self.keys[i]
+        del self.widgets[key]
+
+    def reconcile(self, wanted, create):
+        """Makes the rows match wanted, an ordered list of (key, item).
+
+        create(item) is called for keys without a row.
+
+        :returns: set of keys whose widgets were created
+        """
+        wanted_keys = set(k for k, _ in wanted)
+        # back to front, so earlier positions stay valid
+        for i in range(len(self.keys) - 1, -1, -1):
+            key = self.keys[i]
+            if key not in wanted_keys:
+                pos = self._pos(i)
+                del self.pile.contents[pos:pos + 2]
+                del self.keys[i]
+                del self.widgets[key]
+
+        created = set()
+        for i, (key, item) in enumerate(wanted):
+            if i < len(self.keys) and self.keys[i] == key:
+                continue
+            widget = self.widgets.get(key)
+            if widget is None:
+                widget = create(item)
+                created.add(key)
+            else:
+                # the order changed, move the row
+                old = self.keys.index(key)
+                pos = self._pos(old)
+                del self.pile.contents[pos:pos + 2]
+                del self.keys[old]
+            self.insert(i, key, widget)
+        return created
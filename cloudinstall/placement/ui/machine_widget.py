@@ -91,9 +91,8 @@ class MachineWidget(WidgetWrap):
         Assumes that machine exists - machines going away is handled
         in machineslist.update().
         """
-        self.machine = next((m for m in self.controller.machines()
-                             if m.instance_id == self.machine.instance_id),
-                            None)
+        self.machine = self.controller.machine_for_id(
+            self.machine.instance_id)
 
     def update(self):
         self.update_machine()
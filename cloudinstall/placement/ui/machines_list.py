@@ -14,11 +14,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-from urwid import (AttrMap, Divider, Padding, Pile, Text, WidgetWrap)
+from urwid import (Divider, Pile, Text, WidgetWrap)
 
-from cloudinstall.maas import satisfies
+from cloudinstall.maas import MachineTable, compile_constraints
 
+from cloudinstall.placement.search import SearchIndex, machine_fields
 from cloudinstall.placement.ui.filter_box import FilterBox
+from cloudinstall.placement.ui.keyed_list import KeyedWidgetList
 from cloudinstall.placement.ui.machine_widget import MachineWidget
 
 log = logging.getLogger('cloudinstall.placement')
@@ -52,7 +54,11 @@ class MachinesList(WidgetWrap):
                  show_assignments=True):
         self.controller = controller
         self.actions = actions
-        self.machine_widgets = []
+        self.search_index = SearchIndex()
+        # instance_id -> (machine data, revision) when last indexed
+        self.index_keys = {}
+        # instance_id -> (machine data, revision) when last updated
+        self.widget_keys = {}
         if constraints is None:
             self.constraints = {}
         else:
@@ -83,27 +89,38 @@ class MachinesList(WidgetWrap):
 
         self.machine_pile = Pile([title_widgets,
                                   Divider(),
-                                  self.filter_edit_box] +
-                                 self.machine_widgets)
+                                  self.filter_edit_box])
+        self.machine_rows = KeyedWidgetList(self.machine_pile)
         return self.machine_pile
 
+    @property
+    def machine_widgets(self):
+        return self.machine_rows.ordered()
+
     def handle_filter_change(self, edit_button, userdata):
         self.filter_string = userdata
         self.update()
 
     def find_machine_widget(self, m):
-        return next((mw for mw in self.machine_widgets if
-                     mw.machine.instance_id == m.instance_id), None)
-
-    def update(self):
-        machines = self.controller.machines()
-        for mw in self.machine_widgets:
-            machine = next((m for m in machines if
-                            mw.machine.instance_id == m.instance_id), None)
-            if machine is None:
-                self.remove_machine(mw.machine)
-
-        n_satisfying_machines = len(machines)
+        return self.machine_rows.get(m.instance_id)
+
+    def machine_key(self, m):
+        """Identifies the state of a machine that its row shows. The
+        machine data is compared by identity, since MAAS data is
+        replaced rather than modified when it is refreshed."""
+        return (m.machine, self.controller.machine_revision(m.instance_id))
+
+    @staticmethod
+    def same_key(a, b):
+        return a is not None and a[0] is b[0] and a[1] == b[1]
+
+    def index_machine(self, m):
+        """Updates the search index entry for a machine if it or its
+        assignments changed since it was last indexed."""
+        key = self.machine_key(m)
+        if self.same_key(self.index_keys.get(m.instance_id), key):
+            return
+        self.index_keys[m.instance_id] = key
 
         def get_placement_filter_label(d):
             s = ""
@@ -113,59 +130,61 @@ class MachinesList(WidgetWrap):
                                for cc in al])
             return s
 
-        for m in machines:
-            if not satisfies(m, self.constraints)[0]:
-                self.remove_machine(m)
-                n_satisfying_machines -= 1
-                continue
+        ad = self.controller.assignments_for_machine(m)
+        assignment_names = get_placement_filter_label(ad)
+        dd = self.controller.deployments_for_machine(m)
+        deployment_names = get_placement_filter_label(dd)
+        label = "{} {} {}".format(m.filter_label(),
+                                  assignment_names,
+                                  deployment_names)
+        charm_classes = [cc for d in (ad, dd) for al in d.values()
+                         for cc in al]
+        self.search_index.update(m.instance_id,
+                                 machine_fields(m, charm_classes),
+                                 label)
 
-            assignment_names = ""
-            ad = self.controller.assignments_for_machine(m)
-            assignment_names = get_placement_filter_label(ad)
-            dd = self.controller.deployments_for_machine(m)
-            deployment_names = get_placement_filter_label(dd)
-            filter_label = "{} {} {}".format(m.filter_label(),
-                                             assignment_names,
-                                             deployment_names)
-
-            if self.filter_string != "" and \
-               self.filter_string not in filter_label:
-                self.remove_machine(m)
-                continue
+    def update(self):
+        machines = self.controller.machines()
 
-            mw = self.find_machine_widget(m)
+        constraints = compile_constraints(self.constraints)
+        satisfying = constraints.matching(MachineTable(machines))
+        n_satisfying_machines = len(satisfying)
 
-            if mw is None:
-                mw = self.add_machine_widget(m)
-            mw.update()
+        for m in machines:
+            self.index_machine(m)
+        if len(self.search_index) > len(machines):
+            ids = set(m.instance_id for m in machines)
+            self.search_index.retain(ids)
+            self.index_keys = {k: v for k, v in self.index_keys.items()
+                               if k in ids}
+            self.widget_keys = {k: v for k, v in self.widget_keys.items()
+                                if k in ids}
+
+        matches = self.search_index.search(self.filter_string)
+        shown = [(m.instance_id, m) for m in satisfying
+                 if matches is None or m.instance_id in matches]
+
+        created = self.machine_rows.reconcile(shown,
+                                              self.make_machine_widget)
+        for iid, m in shown:
+            key = self.machine_key(m)
+            if iid not in created and \
+               self.same_key(self.widget_keys.get(iid), key):
+                continue
+            self.widget_keys[iid] = key
+            self.machine_rows.get(iid).update()
 
-        self.filter_edit_box.set_info(len(self.machine_widgets),
+        self.filter_edit_box.set_info(len(self.machine_rows),
                                       n_satisfying_machines)
 
+    def make_machine_widget(self, machine):
+        return MachineWidget(machine, self.controller, self.actions,
+                             self.show_hardware, self.show_assignments)
+
     def add_machine_widget(self, machine):
-        mw = MachineWidget(machine, self.controller, self.actions,
-                           self.show_hardware, self.show_assignments)
-        self.machine_widgets.append(mw)
-        options = self.machine_pile.options()
-        self.machine_pile.contents.append((mw, options))
-
-        self.machine_pile.contents.append((AttrMap(Padding(Divider('\u23bc'),
-                                                           left=2, right=2),
-                                                   'label'), options))
+        mw = self.make_machine_widget(machine)
+        self.machine_rows.append(machine.instance_id, mw)
         return mw
 
     def remove_machine(self, machine):
-        mw = self.find_machine_widget(machine)
-        if mw is None:
-            return
-
-        self.machine_widgets.remove(mw)
-        mw_idx = 0
-        for w, opts in self.machine_pile.contents:
-            if w == mw:
-                break
-            mw_idx += 1
-
-        c = self.machine_pile.contents[:mw_idx] + \
-            self.machine_pile.contents[mw_idx + 2:]
-        self.machine_pile.contents = c
+        self.machine_rows.remove(machine.instance_id)
@@ -15,11 +15,11 @@
 
 import logging
 
-from urwid import (AttrMap, Divider, Padding, Pile, Text,
-                   WidgetWrap)
+from urwid import (Divider, Pile, Text, WidgetWrap)
 
 from cloudinstall.maas import satisfies
 from cloudinstall.state import CharmState
+from cloudinstall.placement.ui.keyed_list import KeyedWidgetList
 from cloudinstall.placement.ui.service_widget import ServiceWidget
 
 log = logging.getLogger('cloudinstall.placement.ui')
@@ -67,7 +67,6 @@ class ServicesList(WidgetWrap):
         self.controller = controller
         self.actions = actions
         self.subordinate_actions = subordinate_actions
-        self.service_widgets = []
         self.machine = machine
         self.ignore_assigned = ignore_assigned
         self.ignore_deployed = ignore_deployed
@@ -90,13 +89,16 @@ class ServicesList(WidgetWrap):
 
     def build_widgets(self):
         self.service_pile = Pile([Text(self.title),
-                                  Divider(' ')] +
-                                 self.service_widgets)
+                                  Divider(' ')])
+        self.service_rows = KeyedWidgetList(self.service_pile)
         return self.service_pile
 
+    @property
+    def service_widgets(self):
+        return self.service_rows.ordered()
+
     def find_service_widget(self, cc):
-        return next((sw for sw in self.service_widgets if
-                     sw.charm_class.charm_name == cc.charm_name), None)
+        return self.service_rows.get(cc.charm_name)
 
     def update(self):
 
@@ -104,6 +106,7 @@ class ServicesList(WidgetWrap):
             if self.trace:
                 log.debug("{}: {} {}".format(self.title, cc, s))
 
+        shown = []
         for cc in self.controller.charm_classes():
             if self.machine:
                 if not satisfies(self.machine, cc.constraints)[0] \
@@ -167,40 +170,28 @@ class ServicesList(WidgetWrap):
                           " and is not assigned or deployed.")
                     continue
 
-            sw = self.find_service_widget(cc)
-            if sw is None:
-                sw = self.add_service_widget(cc)
+            shown.append((cc.charm_name, cc))
+
+        created = self.service_rows.reconcile(shown,
+                                              self.make_service_widget)
+        for name, cc in shown:
+            if name in created:
                 trace(cc, "added widget")
-            sw.update()
+            self.service_rows.get(name).update()
 
-    def add_service_widget(self, charm_class):
+    def make_service_widget(self, charm_class):
         if charm_class.subordinate:
             actions = self.subordinate_actions
         else:
             actions = self.actions
-        sw = ServiceWidget(charm_class, self.controller, actions,
-                           self.show_constraints,
-                           show_placements=self.show_placements)
-        self.service_widgets.append(sw)
-        options = self.service_pile.options()
-        self.service_pile.contents.append((sw, options))
-        self.service_pile.contents.append((AttrMap(Padding(Divider('\u23bc'),
-                                                           left=2, right=2),
-                                                   'label'), options))
+        return ServiceWidget(charm_class, self.controller, actions,
+                             self.show_constraints,
+                             show_placements=self.show_placements)
+
+    def add_service_widget(self, charm_class):
+        sw = self.make_service_widget(charm_class)
+        self.service_rows.append(charm_class.charm_name, sw)
         return sw
 
     def remove_service_widget(self, charm_class):
-        sw = self.find_service_widget(charm_class)
-
-        if sw is None:
-            return
-        self.service_widgets.remove(sw)
-        sw_idx = 0
-        for w, opts in self.service_pile.contents:
-            if w == sw:
-                break
-            sw_idx += 1
-
-        c = self.service_pile.contents[:sw_idx] + \
-            self.service_pile.contents[sw_idx + 2:]
-        self.service_pile.contents = c
+        self.service_rows.remove(charm_class.charm_name)
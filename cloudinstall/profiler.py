@@ -0,0 +1,235 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Timing spans for profiling installs
+
+Install phases, Juju and MAAS API calls, subprocesses and charm steps
+are recorded as nested spans, per thread. They can be written as a
+Chrome trace (load it in chrome://tracing or Perfetto) or as folded
+stacks for flamegraph.pl. Trace files are appended to as spans come
+in, using the JSON array form of the trace format.
+
+    with span("juju status", "juju"):
+        ...
+"""
+
+from collections import deque, namedtuple, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from itertools import islice
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger('cloudinstall.profiler')
+
+# oldest spans are dropped after this many, openstack-status polls juju
+# for as long as it runs
+MAX_SPANS = 100000
+# thread id used for the install phases recorded by the taskers
+PHASES_TID = 0
+
+# thread is the name of the thread when the span was recorded, the
+# orchestrator names its threads after the environment they deploy
+Span = namedtuple('Span', ['name', 'cat', 'start', 'end', 'tid', 'path',
+                           'args', 'thread'])
+
+
+class Profiler:
+
+    """ Records spans from any thread """
+
+    def __init__(self, max_spans=MAX_SPANS):
+        self.spans = deque(maxlen=max_spans)
+        self.thread_names = {PHASES_TID: "install phases"}
+        # called with each recorded Span
+        self.listeners = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # spans recorded so far, including those dropped from spans
+        self._added = 0
+        # trace file path: [spans written, thread ids named]
+        self._traces = {}
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def span(self, name, cat="", **args):
+        """ Records the time spent in the with block as a span nested
+        in the enclosing spans of the same thread
+        """
+        stack = self._stack()
+        stack.append(name)
+        path = tuple(stack)
+        start = time.time()
+        try:
+            yield
+        finally:
+            end = time.time()
+            stack.pop()
+            self.add(name, cat, start, end, path=path, args=args)
+
+    def add(self, name, cat, start, end, tid=None, path=None, args=None):
+        """ Records a span that was timed elsewhere """
+        if tid is None:
+            thread = threading.current_thread()
+            tid = thread.ident
+            thread_name = thread.name
+            self.thread_names.setdefault(tid, thread_name)
+        else:
+            thread_name = self.thread_names.get(tid)
+        s = Span(name, cat, start, end, tid, path or (name,), args or {},
+                 thread_name)
+        with self._lock:
+            self.spans.append(s)
+            self._added += 1
+        for listener in self.listeners:
+            listener(s)
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+
+    def chrome_trace(self):
+        """ Returns the spans in Chrome's trace event format """
+        with self._lock:
+            spans = list(self.spans)
+        events = self._trace_events(self.thread_names, spans)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def _trace_events(self, thread_names, spans):
+        pid = os.getpid()
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                   'tid': tid, 'args': {'name': name}}
+                  for tid, name in thread_names.items()]
+        for s in spans:
+            events.append({'name': s.name,
+                           'cat': s.cat,
+                           'ph': 'X',
+                           'ts': int(s.start * 1e6),
+                           'dur': int((s.end - s.start) * 1e6),
+                           'pid': pid,
+                           'tid': s.tid,
+                           'args': s.args})
+        return events
+
+    def append_trace(self, trace_path, thread=None):
+        """ Appends the spans recorded since the last call for
+        trace_path as Chrome trace events. Processes of one install
+        append to the same file, whichever creates it starts the array;
+        trace viewers accept it without its closing bracket.
+
+        :param str thread: only write the spans recorded by threads of
+            this name
+        """
+        with self._lock:
+            trace = self._traces.setdefault(trace_path, [0, set()])
+            written, named = trace
+            count = min(self._added - written, len(self.spans))
+            spans = list(islice(reversed(self.spans), count))[::-1]
+            trace[0] = self._added
+            if thread is None:
+                thread_names = {tid: name
+                                for tid, name in self.thread_names.items()
+                                if tid not in named}
+            else:
+                spans = [s for s in spans if s.thread == thread]
+                thread_names = {s.tid: thread for s in spans
+                                if s.tid not in named}
+            named.update(thread_names)
+        with open(trace_path, 'a') as f:
+            if f.tell() == 0:
+                f.write('[\n')
+            for event in self._trace_events(thread_names, spans):
+                f.write(json.dumps(event) + ',\n')
+
+    def folded(self, thread=None):
+        """ Returns self time in microseconds per stack, one
+        'outer;inner count' line each, the input flamegraph.pl takes
+
+        :param str thread: only count the spans recorded by threads of
+            this name
+        """
+        with self._lock:
+            spans = list(self.spans)
+        if thread is not None:
+            spans = [s for s in spans if s.thread == thread]
+        self_time = defaultdict(float)
+        for s in spans:
+            duration = s.end - s.start
+            self_time[s.path] += duration
+            if len(s.path) > 1:
+                self_time[s.path[:-1]] -= duration
+        lines = []
+        for path, t in sorted(self_time.items()):
+            us = int(t * 1e6)
+            if us > 0:
+                lines.append("{} {}".format(
+                    ";".join(p.replace(";", ",") for p in path), us))
+        return "\n".join(lines) + "\n"
+
+    def write(self, trace_path, folded_path=None, thread=None):
+        """ Appends new spans to trace_path, see append_trace, and
+        rewrites folded_path
+        """
+        self.append_trace(trace_path, thread)
+        if folded_path:
+            with open(folded_path, 'w') as f:
+                f.write(self.folded(thread))
+
+
+profiler = Profiler()
+span = profiler.span
+
+
+def traced(cat, name=None):
+    """ Decorator recording each call of a function as a span """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with profiler.span(span_name, cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TracedProxy:
+
+    """ Wraps an API client, recording each method call as a span
+    named after the method
+    """
+
+    def __init__(self, obj, cat):
+        self._obj = obj
+        self._cat = cat
+
+    def __getattr__(self, attr):
+        value = getattr(self._obj, attr)
+        if not callable(value):
+            return value
+
+        @wraps(value)
+        def wrapper(*args, **kwargs):
+            with profiler.span("{} {}".format(self._cat, attr), self._cat):
+                return value(*args, **kwargs)
+        return wrapper
@@ -0,0 +1,181 @@
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Machine readable progress for headless installs
+
+Set the progress config option (--progress) and ConsoleUI writes one
+JSON object per line for each event of the install:
+
+    {"elapsed": 12.5, "event": "deploy", "install": "...",
+     "machine": "lxc:1", "seconds": 0.4, "service": "mysql",
+     "time": 1458000012.5}
+
+Every event has time, elapsed (seconds since the stream was opened),
+event and, if known, install (the session id). The events are:
+
+- status, error: the messages shown on the status bar (message)
+- phase_start, phase_end: install phases (phase; seconds at the end)
+- machines: changes to the juju machine summary (summary)
+- pending_deploys: services placed but not deployed yet (services)
+- deploy: a deploy or add-unit was issued (service, machine, action,
+  seconds, error)
+- unit_state: a unit's agent state changed (unit, service, machine,
+  state, previous, workload)
+- relation: a relation was added (a, b; error if it failed)
+- post_proc: a charm's post processing finished (service, seconds)
+- finished: the install finished (status is ok or error; error)
+
+The target is a file descriptor number (fd:3 or 3), a unix socket
+(unix:/path), a TCP address (tcp:host:port) or a file, which is
+appended to. If the reader goes away the stream is closed and the
+install carries on.
+
+openstack-install hands the deployment over to openstack-status,
+which opens the target again from the config with from_config(). A
+file descriptor is kept open across the exec of a multi install. A
+single install runs openstack-status in its container over ssh, so
+only unix: and tcp: targets the container can reach get the events
+from the deployment on.
+
+Installs run by one orchestrator share a stream through
+for_install(), which tags their events with the environment name.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+log = logging.getLogger('cloudinstall.progress')
+
+
+def open_target(target):
+    """ Returns a binary file object writing to target """
+    target = str(target)
+    if target.isdigit() or target.startswith('fd:'):
+        fd = int(target.split(':', 1)[-1])
+        # openstack-status writes to it after the exec
+        os.set_inheritable(fd, True)
+        return os.fdopen(fd, 'wb', closefd=False)
+    if target.startswith('unix:'):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(target[len('unix:'):])
+        return _SocketFile(sock)
+    if target.startswith('tcp:'):
+        host, _, port = target[len('tcp:'):].rpartition(':')
+        return _SocketFile(socket.create_connection((host, int(port))))
+    return open(target, 'ab')
+
+
+class _SocketFile:
+
+    """ write/flush/close over a connected socket """
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.sock.close()
+
+
+class _Output:
+
+    """ A target shared by the streams of several installs """
+
+    def __init__(self, out):
+        self.out = out
+        self.lock = threading.Lock()
+
+
+class ProgressStream:
+
+    """ Writes progress events as newline delimited JSON, from any
+    thread
+    """
+
+    def __init__(self, target, install_id=None):
+        """
+        :param target: see open_target(), or a binary file object
+        :param str install_id: added to every event as install
+        """
+        if isinstance(target, _Output):
+            self._output = target
+        elif hasattr(target, 'write'):
+            self._output = _Output(target)
+        else:
+            self._output = _Output(open_target(target))
+        self.install_id = install_id
+        self.start_time = time.time()
+
+    def for_install(self, install_id):
+        """ Returns a stream writing to the same target, with events
+        tagged install_id
+        """
+        return ProgressStream(self._output, install_id)
+
+    @property
+    def closed(self):
+        return self._output.out is None
+
+    def emit(self, event, **fields):
+        now = time.time()
+        record = {'time': round(now, 3),
+                  'elapsed': round(now - self.start_time, 3),
+                  'event': event}
+        if self.install_id is not None:
+            record['install'] = self.install_id
+        record.update(fields)
+        line = json.dumps(record, sort_keys=True, default=str) + "\n"
+        output = self._output
+        with output.lock:
+            if output.out is None:
+                return
+            try:
+                output.out.write(line.encode('utf-8'))
+                output.out.flush()
+            except OSError:
+                log.exception("Progress stream failed, no more progress "
+                              "events will be written")
+                self._close()
+
+    def _close(self):
+        out, self._output.out = self._output.out, None
+        try:
+            out.close()
+        except OSError:
+            pass
+
+    def close(self):
+        with self._output.lock:
+            if self._output.out is not None:
+                self._close()
+
+
+def from_config(config):
+    """ Returns the ProgressStream of the progress config option, with
+    events tagged with the install's session id, or None if it's unset
+    """
+    target = config.getopt('progress')
+    if not target:
+        return None
+    return ProgressStream(target, install_id=config.getopt('session_id'))
@@ -16,42 +16,258 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import atexit
+""" Status messages that charms publish on rabbitmq exchanges, such as
+glance-simplestreams-sync's image sync progress
+
+StatusListener consumes them in a background thread of the installer.
+The UI reads the latest ones with get_status() and get_sync_status(),
+or subscribes to changes with subscribe_sync_status().
+"""
+
+from functools import partial
+import json
 import logging
 import os
+import socket
 import subprocess
-from cloudinstall.config import Config
+import threading
+import time
+import weakref
+
+import yaml
+
+log = logging.getLogger('cloudinstall.status')
+
+SYNC_STATUS_EXCHANGE = "glance-simplestreams-sync-status"
+# exchanges consumed unless the status_exchanges config option is set
+STATUS_EXCHANGES = [SYNC_STATUS_EXCHANGE]
+ERROR_MESSAGE = "Sync status error, see\n{}".format(
+    os.path.expanduser("~/.cloud-install/commands.log"))
 
-cfg = Config()
-SYNC_STATUS_LISTENER_PATH = os.path.join(cfg.bin_path, "status-listener")
-STATUS_FILE_NAME = os.path.expanduser("~/.cloud-install/sync-status")
+# bursts of messages within this many seconds only report the last one
+COALESCE_INTERVAL = 0.5
+MIN_BACKOFF = 1
+MAX_BACKOFF = 60
+# credentials are read again after this many failures in a row
+REREAD_INFO_FAILURES = 5
 
-status_subprocess = None
+listener = None
 not_found_message = ""
+# latest status by exchange, and the pipe data after the last complete
+# line, as seen from the event loop
+statuses = {}
+_partial = b""
+_subscribers = []
 
-log = logging.getLogger('cloudinstall.status')
 
+def read_rabbit_url(juju_home):
+    """ Returns the broker URL from the identity file that
+    glance-simplestreams-sync writes for its rabbitmq relation
+    """
+    env = dict(os.environ, JUJU_HOME=juju_home)
+    out = subprocess.check_output(
+        ['juju', 'run', '--unit', 'glance-simplestreams-sync/0',
+         'cat /etc/glance-simplestreams-sync/identity.yaml'],
+        env=env, stderr=subprocess.PIPE)
+    id_conf = yaml.safe_load(out)
+    hosts = id_conf.get('rabbit_hosts', None)
+    if hosts:
+        host = hosts[0]
+    else:
+        host = id_conf['rabbit_host']
+    return "amqp://{}:{}@{}/{}".format(id_conf['rabbit_userid'],
+                                       id_conf['rabbit_password'],
+                                       host,
+                                       id_conf['rabbit_virtual_host'])
 
-def get_sync_status():
-    global status_subprocess
-    global not_found_message
 
-    if status_subprocess is None:
-        status_listener_path = os.environ.get("SYNC_STATUS_LISTENER_PATH",
-                                              SYNC_STATUS_LISTENER_PATH)
-        log.debug('starting status listener {}'.format(status_listener_path))
+class StatusListener:
+
+    """ Consumes status messages from rabbitmq exchanges
+
+    The broker URL comes from get_url(), and is kept across reconnects
+    until REREAD_INFO_FAILURES attempts in a row have failed. Failed
+    connections are retried with exponential backoff, so the listener
+    keeps running for as long as the installer does.
+
+    on_status(exchange, status) is called from the listener thread,
+    with only the last of a burst of messages for an exchange.
+    """
+
+    def __init__(self, get_url, exchanges=None, on_status=None,
+                 error_message=ERROR_MESSAGE):
+        self.get_url = get_url
+        self.exchanges = exchanges or STATUS_EXCHANGES
+        self.on_status = on_status
+        self.error_message = error_message
+        self.statuses = {}
+        self.failures = 0
+        self._url = None
+        self._pending = {}
+        self._last_flush = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def latest(self, exchange=SYNC_STATUS_EXCHANGE):
+        """ Returns the last status from exchange, or None """
+        with self._lock:
+            return self.statuses.get(exchange)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(2)
+            self._thread = None
+
+    def backoff(self):
+        return min(MIN_BACKOFF * 2 ** max(self.failures - 1, 0),
+                   MAX_BACKOFF)
+
+    def run(self):
         try:
-            status_subprocess = subprocess.Popen([status_listener_path])
-            atexit.register(status_subprocess.kill)
-            not_found_message = "Waiting for initial status."
-        except OSError:
-            log.exception("Error starting status listener")
-            status_subprocess = None
-            return ""
-
-    if os.path.exists(STATUS_FILE_NAME):
-        with open(STATUS_FILE_NAME) as sf:
-            status = sf.read()
-        return status
-    else:
-        return not_found_message
+            import kombu
+        except ImportError:
+            log.exception("kombu is needed to listen for status messages")
+            return
+
+        while not self._stop.is_set():
+            try:
+                if self._url is None:
+                    self._url = self.get_url()
+                self._consume(kombu)
+            except Exception:
+                self.failures += 1
+                if self.failures % REREAD_INFO_FAILURES == 0:
+                    self._url = None
+                log.exception("Error listening for status messages, "
+                              "retrying in {}s".format(self.backoff()))
+                self._stop.wait(self.backoff())
+
+    def _consume(self, kombu):
+        with kombu.Connection(self._url, connect_timeout=10) as conn:
+            channel = conn.channel()
+            queues = []
+            for name in self.exchanges:
+                queue = kombu.Queue(name, exchange=kombu.Exchange(name))
+                queue(channel).declare()
+                queues.append(queue)
+            with conn.Consumer(queues, callbacks=[self._on_message]):
+                log.debug("Listening for status on {}".format(
+                    ", ".join(self.exchanges)))
+                self.failures = 0
+                while not self._stop.is_set():
+                    try:
+                        conn.drain_events(timeout=COALESCE_INTERVAL)
+                    except socket.timeout:
+                        pass
+                    self.flush()
+
+    def _on_message(self, body, message):
+        exchange = message.delivery_info.get('exchange',
+                                             SYNC_STATUS_EXCHANGE)
+        if body['status'] == 'Error':
+            log.error("Received error message on {}: {}".format(
+                exchange, body['message']))
+            status = self.error_message
+        else:
+            log.debug("Received message on {}: {}".format(
+                exchange, body['message']))
+            status = body['message']
+        with self._lock:
+            self._pending[exchange] = status
+        message.ack()
+        if time.time() - self._last_flush >= COALESCE_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """ Records pending statuses and reports them to on_status """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self.statuses.update(pending)
+        self._last_flush = time.time()
+        if self.on_status is None:
+            return
+        for exchange, status in pending.items():
+            self.on_status(exchange, status)
+
+
+def start_sync_status_listener(loop, config):
+    """ Starts listening for status messages in a background thread,
+    which pushes them down a pipe watched by loop. Does nothing if it
+    is already running.
+
+    :param loop: :class:`~cloudinstall.ev.EventLoop`
+    :param config: :class:`~cloudinstall.config.Config`
+    """
+    global listener
+    global not_found_message
+
+    if listener is not None:
+        return
+    fd = loop.watch_pipe(_read_status)
+    if fd is None:
+        log.debug("no event loop, not listening for status")
+        return
+
+    def push(exchange, status):
+        line = json.dumps([exchange, status]) + "\n"
+        os.write(fd, line.encode())
+
+    listener = StatusListener(partial(read_rabbit_url, config.juju_path()),
+                              config.getopt('status_exchanges'),
+                              on_status=push)
+    listener.start()
+    not_found_message = "Waiting for initial status."
+
+
+def _read_status(data):
+    """ Called by the event loop with data from the listener, one JSON
+    encoded [exchange, status] pair per line
+    """
+    global _partial
+
+    if not data:
+        log.debug("status pipe closed")
+        return False
+    lines = (_partial + data).split(b"\n")
+    _partial = lines.pop()
+    changed = {}
+    for line in lines:
+        if line:
+            exchange, status = json.loads(line.decode())
+            changed[exchange] = status
+    for exchange, status in changed.items():
+        if statuses.get(exchange) == status:
+            continue
+        statuses[exchange] = status
+        for ref in list(_subscribers):
+            callback = ref()
+            if callback is None:
+                _subscribers.remove(ref)
+            else:
+                callback(exchange, status)
+
+
+def subscribe_sync_status(callback):
+    """ Calls callback with the exchange and text of each new status.
+    Only a weak reference to callback is kept, so subscribing doesn't
+    keep views alive.
+
+    :param callback: bound method
+    """
+    _subscribers.append(weakref.WeakMethod(callback))
+
+
+def get_status(exchange):
+    return statuses.get(exchange, not_found_message)
+
+
+def get_sync_status():
+    return get_status(SYNC_STATUS_EXCHANGE)
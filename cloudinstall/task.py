@@ -22,10 +22,33 @@ from cloudinstall import utils
 from cloudinstall import async
 from cloudinstall.alarms import AlarmMonitor
 from cloudinstall.config import Config
+from cloudinstall.profiler import profiler, PHASES_TID
 
 log = logging.getLogger('cloudinstall.task')
 
 
+def write_timings(config, tasks):
+    """ Writes task timings to timings.yaml, and appends the spans the
+    profiler recorded since the last call to trace.json (Chrome trace)
+
+    :param list tasks: (name, start, end) tuples
+    """
+    readable_tasks = []
+    for n, s, e in tasks:
+        if e is not None and s is not None:
+            timing = e - s
+        else:
+            timing = None
+        readable_tasks.append((n, s, e, timing))
+
+    owner = utils.install_user()
+    utils.spew(os.path.join(config.cfg_path, 'timings.yaml'),
+               yaml.dump(readable_tasks), owner)
+    trace_path = os.path.join(config.cfg_path, 'trace.json')
+    profiler.append_trace(trace_path)
+    utils.chown(trace_path, owner)
+
+
 class Tasker:
 
     """ Provides progress updates and task tracking.
@@ -94,17 +117,7 @@ class Tasker:
         self.write_timings()
 
     def write_timings(self):
-        readable_tasks = []
-        for n, s, e in self.tasks:
-            if e is not None and s is not None:
-                timing = e - s
-            else:
-                timing = None
-            readable_tasks.append((n, s, e, timing))
-
-        utils.spew(os.path.join(self.config.cfg_path, 'timings.yaml'),
-                   yaml.dump(readable_tasks),
-                   utils.install_user())
+        write_timings(self.config, self.tasks)
 
     def stop_current_task(self):
         if self.current_task_index >= len(self.tasks):
@@ -115,7 +128,9 @@ class Tasker:
                                                  self.tasks_started_debug))
             return
         n, s, _ = self.tasks[self.current_task_index]
-        self.tasks[self.current_task_index] = (n, s, time.time())
+        e = time.time()
+        self.tasks[self.current_task_index] = (n, s, e)
+        profiler.add(n, 'phase', s, e, tid=PHASES_TID)
         self.current_task_index += 1
         self.stopped = True
         self.write_timings()
@@ -159,23 +174,40 @@ class Tasker:
 
 class TaskerConsole:
 
-    """ Console tasker """
+    """ Console tasker, logs and times tasks for headless installs """
 
     def __init__(self, display_controller, loop, config):
         self.loop = loop
         self.config = config
         self.display_controller = display_controller
         self.tasks = []
+        self.timings = []  # (name, starttime, endtime=None)
 
     def start_task(self, taskname, task_info_func=None):
         log.info(taskname)
+        self.stop_current_task()
+        self.timings.append((taskname, time.time(), None))
+        self.display_controller.progress_event('phase_start',
+                                               phase=taskname)
+        self.write_timings()
 
     def stop_current_task(self):
-        pass
+        if not self.timings or self.timings[-1][2] is not None:
+            return
+        n, s, _ = self.timings[-1]
+        e = time.time()
+        self.timings[-1] = (n, s, e)
+        profiler.add(n, 'phase', s, e, tid=PHASES_TID)
+        self.display_controller.progress_event('phase_end', phase=n,
+                                               seconds=round(e - s, 3))
+        self.write_timings()
 
     def register_tasks(self, tasks):
         self.tasks.extend(tasks)
 
+    def write_timings(self):
+        write_timings(self.config, self.timings)
+
 
 class FakeInstall:
 
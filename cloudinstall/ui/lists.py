@@ -13,7 +13,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from urwid import ListBox, SimpleListWalker, WidgetWrap
+from urwid import ListBox, ListWalker, SimpleListWalker, WidgetWrap
 
 
 class SimpleList(WidgetWrap):
@@ -29,3 +29,102 @@ class SimpleList(WidgetWrap):
 
     def selectable(self):
         return self.is_selectable
+
+
+class VirtualListWalker(ListWalker):
+
+    """List walker over a row model that only keeps widgets for the
+    rows near the focus.
+
+    Rows are (key, data) pairs. create(key, data) builds the widget for
+    a row when the ListBox first asks for it, and update(widget, data),
+    if given, refreshes a live widget when its row changes; without it
+    the widget is rebuilt. Widgets more than margin rows away from the
+    focus are dropped when the focus moves, so the number of live
+    widgets doesn't grow with the number of rows.
+    """
+
+    def __init__(self, create, update=None, margin=100):
+        self.create = create
+        self.update = update
+        self.margin = margin
+        self.keys = []
+        self.rows = {}
+        self.index = {}
+        self.widgets = {}
+        self.focus = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def __getitem__(self, position):
+        if not isinstance(position, int) or \
+           position < 0 or position >= len(self.keys):
+            raise IndexError(position)
+        key = self.keys[position]
+        widget = self.widgets.get(key)
+        if widget is None:
+            widget = self.create(key, self.rows[key])
+            self.widgets[key] = widget
+        return widget
+
+    def next_position(self, position):
+        if position + 1 >= len(self.keys):
+            raise IndexError(position)
+        return position + 1
+
+    def prev_position(self, position):
+        if position <= 0:
+            raise IndexError(position)
+        return position - 1
+
+    def positions(self, reverse=False):
+        if reverse:
+            return range(len(self.keys) - 1, -1, -1)
+        return range(len(self.keys))
+
+    def set_focus(self, position):
+        if not 0 <= position < max(len(self.keys), 1):
+            raise IndexError(position)
+        self.focus = position
+        self._trim()
+        self._modified()
+
+    def _trim(self):
+        for key in [k for k in self.widgets
+                    if abs(self.index[k] - self.focus) > self.margin]:
+            del self.widgets[key]
+
+    def set_row(self, key, data):
+        """Adds a row at the end, or replaces the data of an existing
+        row. Returns True if anything changed."""
+        if key not in self.rows:
+            self.index[key] = len(self.keys)
+            self.keys.append(key)
+            self.rows[key] = data
+            self._modified()
+            return True
+        if self.rows[key] == data:
+            return False
+        self.rows[key] = data
+        widget = self.widgets.get(key)
+        if widget is not None:
+            if self.update is None:
+                del self.widgets[key]
+            else:
+                self.update(widget, data)
+        self._modified()
+        return True
+
+    def remove(self, key):
+        if key not in self.rows:
+            return
+        del self.keys[self.index[key]]
+        del self.rows[key]
+        self.widgets.pop(key, None)
+        self.index = dict((k, i) for i, k in enumerate(self.keys))
+        self.focus = max(0, min(self.focus, len(self.keys) - 1))
+        self._modified()
@@ -14,20 +14,61 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from __future__ import unicode_literals
+from collections import namedtuple
 from operator import attrgetter
 import logging
-import random
-from urwid import (Text, WidgetWrap)
-from cloudinstall.status import get_sync_status
+from urwid import (Columns, Frame, ListBox, Pile, Text, WidgetWrap)
+from cloudinstall.status import (get_sync_status, subscribe_sync_status,
+                                 SYNC_STATUS_EXCHANGE)
 from cloudinstall import utils
+from cloudinstall.machine import HardwareInfoCache
+from cloudinstall.ui.lists import VirtualListWalker
 from cloudinstall.ui.widgets import UnitInfoWidget
-from ubuntui.widgets.table import Table
 from ubuntui.utils import Color
 
 
 log = logging.getLogger('cloudinstall.ui.views.services')
 
 
+class UnitRow(namedtuple('UnitRow',
+                         ['charm_class', 'unit', 'hwinfo', 'state'])):
+
+    """ One row of the services view, state is what update_ui_state
+    shows.
+
+    Rows compare equal when they display the same thing, juju status
+    builds new Unit objects on every refresh.
+    """
+
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return self[2:] == other[2:]
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self[2:])
+
+
+HARDWARE_INFO_KEYS = ['container', 'machine', 'arch', 'cpu_cores', 'mem',
+                      'storage']
+
+
+class UnitRowWidget(WidgetWrap):
+
+    """ Unit info columns with the workload status line below them
+    """
+
+    def __init__(self, unit_w, columns):
+        self.unit_w = unit_w
+        super().__init__(Pile([
+            Columns(columns),
+            Columns([('fixed', 5, Text("")),
+                     Color.frame_subheader(unit_w.workload_info)])]))
+
+
 class ServicesView(WidgetWrap):
 
     view_columns = [
@@ -43,15 +84,20 @@ class ServicesView(WidgetWrap):
         ('storage', "Storage", 12)
     ]
 
+    # shared by all views, the hardware of a machine outlives them
+    hwinfo_cache = HardwareInfoCache()
+
     def __init__(self, nodes, juju_state, maas_state, config):
-        self.deployed = {}
         self.nodes = [] if nodes is None else nodes
         self.juju_state = juju_state
         self.maas_state = maas_state
         self.config = config
         self.unit_w = None
         self.log_cache = None
-        self.table = Table()
+        # Widgets are only built for the units near the focus, the
+        # rest of the units are kept as UnitRow tuples.
+        self.walker = VirtualListWalker(self._build_unit_row,
+                                        self._update_unit_row)
 
         headings = []
         for key, label, width in self.view_columns:
@@ -61,46 +107,50 @@ class ServicesView(WidgetWrap):
             else:
                 headings.append(
                     ('fixed', width, Color.column_header(Text(label))))
-        self.table.addHeadings(headings)
-        super().__init__(self.table.render())
+        super().__init__(Frame(ListBox(self.walker),
+                               header=Columns(headings)))
 
         self.refresh_nodes(self.nodes)
+        subscribe_sync_status(self._sync_status_changed)
 
     def refresh_nodes(self, nodes):
-        """ Adds services to the view if they don't already exist
+        """ Adds services to the view if they don't already exist and
+        updates the state of the ones that do
         """
         for node in nodes:
-            services_list = []
             charm_class, service = node
-            if len(service.units) > 0:
-                for u in sorted(service.units, key=attrgetter('unit_name')):
-                    # Refresh any state changes
-                    try:
-                        unit_w = self.deployed[u.unit_name]
-                    except:
-                        hwinfo = self._get_hardware_info(u)
-                        self.deployed[u.unit_name] = UnitInfoWidget(
-                            u,
-                            charm_class,
-                            hwinfo)
-                        unit_w = self.deployed[u.unit_name]
-                        for k, label, width in self.view_columns:
-                            if width == 0:
-                                services_list.append(getattr(unit_w, k))
-                            else:
-                                services_list.append(('fixed', width,
-                                                      getattr(unit_w, k)))
-
-                        self.table.addColumns(u.unit_name, services_list)
-                        self.table.addColumns(
-                            u.unit_name,
-                            [
-                                ('fixed', 5, Text("")),
-                                Color.frame_subheader(unit_w.workload_info)
-                            ],
-                            force=True)
-                    self.update_ui_state(charm_class, u,
-                                         unit_w)
+            for u in sorted(service.units, key=attrgetter('unit_name')):
+                self.walker.set_row(
+                    u.unit_name,
+                    UnitRow(charm_class, u, self._get_hardware_info(u),
+                            self.unit_state(charm_class, u)))
+
+    def _sync_status_changed(self, exchange, status):
+        if exchange != SYNC_STATUS_EXCHANGE:
+            return
+        for unit_name, row in list(self.walker.rows.items()):
+            if 'glance-simplestreams-sync' in unit_name:
+                self.walker.set_row(unit_name, row._replace(
+                    state=self.unit_state(row.charm_class, row.unit)))
+
+    def _build_unit_row(self, unit_name, row):
+        unit_w = UnitInfoWidget(row.unit, row.charm_class, row.hwinfo)
+        columns = []
+        for k, label, width in self.view_columns:
+            if width == 0:
+                columns.append(getattr(unit_w, k))
+            else:
+                columns.append(('fixed', width, getattr(unit_w, k)))
+        self.update_ui_state(unit_w, row.state)
+        return UnitRowWidget(unit_w, columns)
+
+    def _update_unit_row(self, widget, row):
+        unit_w = widget.unit_w
+        if unit_w.hwinfo != row.hwinfo and isinstance(row.hwinfo, dict):
+            unit_w.hwinfo = row.hwinfo
+            for k in HARDWARE_INFO_KEYS:
+                getattr(unit_w, k).set_text(row.hwinfo[k])
+        self.update_ui_state(unit_w, row.state)
 
     def status_icon_state(self, charm_class, unit):
         # unit.agent_state may be "pending" despite errors elsewhere,
@@ -111,10 +161,7 @@ class ServicesView(WidgetWrap):
         if error_info:
             status = ("error_icon", "\N{TETRAGRAM FOR FAILURE}")
         elif unit.agent_state == "pending":
-            pending_status = [("pending_icon", "\N{CIRCLED BULLET}"),
-                              ("pending_icon", "\N{CIRCLED WHITE BULLET}"),
-                              ("pending_icon", "\N{FISHEYE}")]
-            status = random.choice(pending_status)
+            status = ("pending_icon", "\N{CIRCLED BULLET}")
         elif unit.agent_state == "installed":
             status = ("pending_icon", "\N{HOURGLASS}")
         elif unit.agent_state == "started":
@@ -129,40 +176,61 @@ class ServicesView(WidgetWrap):
             status = ("error_icon", "?")
         return status
 
-    def update_ui_state(self, charm_class, unit, unit_w):
-        """ Updates individual machine information
+    def unit_state(self, charm_class, unit):
+        """ Returns the (icon, agent state, address, workload info) shown
+        for a unit
         """
-        unit_w.public_address.set_text(unit.public_address)
-        unit_w.agent_state.set_text(unit.agent_state)
-        unit_w.icon.set_text(self.status_icon_state(charm_class, unit))
         # Special additional status text for these services
         if 'glance-simplestreams-sync' in unit.unit_name:
-            status_oneline = get_sync_status().replace("\n", " - ")
-            unit_w.workload_info.set_text(status_oneline)
+            workload_info = get_sync_status().replace("\n", " - ")
 
         elif unit.is_horizon and unit.agent_state == "started":
-            unit_w.workload_info.set_text(
-                "Login: https://{}/horizon "
-                "l:{} p:{}".format(
-                    unit.public_address,
-                    'ubuntu',
-                    self.config.getopt('openstack_password')))
+            workload_info = ("Login: https://{}/horizon "
+                             "l:{} p:{}".format(
+                                 unit.public_address,
+                                 'ubuntu',
+                                 self.config.getopt('openstack_password')))
 
         elif unit.is_jujugui and unit.agent_state == "started":
-            unit_w.workload_info.set_text(
-                "Login: https://{}/".format(
-                    unit.public_address))
+            workload_info = "Login: https://{}/".format(
+                unit.public_address)
         else:
-            unit_w.workload_info.set_text(
-                " {} - {}".format(unit.extended_agent_state,
-                                  unit.workload_info))
+            workload_info = " {} - {}".format(unit.extended_agent_state,
+                                              unit.workload_info)
+        return (self.status_icon_state(charm_class, unit),
+                unit.agent_state, unit.public_address, workload_info)
+
+    def update_ui_state(self, unit_w, state):
+        """ Updates individual machine information
+        """
+        icon, agent_state, public_address, workload_info = state
+        unit_w.public_address.set_text(public_address)
+        unit_w.agent_state.set_text(agent_state)
+        unit_w.icon.set_text(icon)
+        unit_w.workload_info.set_text(workload_info)
 
     def _get_hardware_info(self, unit):
-        """Get hardware info from juju or maas
+        """Get hardware info from juju or maas, cached by juju machine id
+        and instance id
 
-        Returns list of text and formatting tuples
+        Returns dict of hardware info by column
         """
         juju_machine = self.juju_state.machine(unit.machine_id)
+        instance_id = juju_machine.instance_id
+        if instance_id is None:
+            # containers show the hardware of their host
+            instance_id = self.juju_state.base_machine(
+                unit.machine_id).instance_id
+
+        hw_info = self.hwinfo_cache.get(unit.machine_id, instance_id)
+        if hw_info is None:
+            hw_info = self._lookup_hardware_info(unit, juju_machine)
+            # don't keep info from before juju or maas know the hardware
+            if isinstance(hw_info, dict) and hw_info['arch'] != "N/A":
+                self.hwinfo_cache.set(unit.machine_id, instance_id, hw_info)
+        return hw_info
+
+    def _lookup_hardware_info(self, unit, juju_machine):
         maas_machine = None
         if self.maas_state:
             maas_machine = self.maas_state.machine(juju_machine.instance_id)
@@ -42,6 +42,8 @@ import yaml
 import requests
 from urllib.parse import urlparse
 
+from cloudinstall.profiler import span
+
 log = logging.getLogger('cloudinstall.utils')
 
 # String with number of minutes, or None.
@@ -242,7 +244,7 @@ def render_charm_config(config):
             template_args[pk] = pv
 
     charm_conf_modified = charm_conf.render(**template_args)
-    dest_yaml_path = os.path.join(config.cfg_path, 'charmconf.yaml')
+    dest_yaml_path = config.charm_config_filename
     spew(dest_yaml_path, charm_conf_modified)
 
     # Check for custom charm options
@@ -337,16 +339,17 @@ def get_command_output(command, timeout=None, user_sudo=False):
     if user_sudo:
         command = "sudo -E -H -u {0} {1}".format(install_user(), command)
 
-    try:
-        p = Popen(command, shell=True,
-                  stdout=PIPE, stderr=PIPE,
-                  bufsize=-1, env=cmd_env, close_fds=True)
-    except OSError as e:
-        if e.errno == errno.ENOENT:
-            return dict(ret=127, output="", err="")
-        else:
-            raise e
-    stdout, stderr = p.communicate()
+    with span(command[:80], 'subprocess'):
+        try:
+            p = Popen(command, shell=True,
+                      stdout=PIPE, stderr=PIPE,
+                      bufsize=-1, env=cmd_env, close_fds=True)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return dict(ret=127, output="", err="")
+            else:
+                raise e
+        stdout, stderr = p.communicate()
     if p.returncode == 126 or p.returncode == 127:
         stdout = bytes()
     if not stderr:
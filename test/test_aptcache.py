@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#
+# tests aptcache.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.request import ProxyHandler, build_opener
+
+from cloudinstall.aptcache import AptCache, AptCacheServer
+
+log = logging.getLogger('cloudinstall.test_aptcache')
+
+FILES = {'/ubuntu/pool/main/f/foo/foo_1.0_amd64.deb': b'debcontents',
+         '/ubuntu/dists/trusty/Release': b'release'}
+
+
+class FakeArchiveHandler(BaseHTTPRequestHandler):
+
+    requests = []
+
+    def do_GET(self):
+        FakeArchiveHandler.requests.append(self.path)
+        body = FILES.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(server):
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    return server
+
+
+class AptCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        FakeArchiveHandler.requests = []
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+        self.archive = serve(HTTPServer(('127.0.0.1', 0),
+                                        FakeArchiveHandler))
+        self.addCleanup(self.archive.server_close)
+        self.addCleanup(self.archive.shutdown)
+
+        self.cache = AptCache(self.cache_dir)
+        self.proxy = serve(AptCacheServer(('127.0.0.1', 0), self.cache))
+        self.addCleanup(self.proxy.server_close)
+        self.addCleanup(self.proxy.shutdown)
+
+        proxy_url = 'http://127.0.0.1:{}'.format(self.proxy.server_port)
+        self.opener = build_opener(ProxyHandler({'http': proxy_url}))
+
+    def get(self, path):
+        url = 'http://127.0.0.1:{}{}'.format(self.archive.server_port, path)
+        with self.opener.open(url) as r:
+            return r.read()
+
+    def test_package_fetched_once(self):
+        path = '/ubuntu/pool/main/f/foo/foo_1.0_amd64.deb'
+        self.assertEqual(self.get(path), b'debcontents')
+        self.assertEqual(self.get(path), b'debcontents')
+        self.assertEqual(FakeArchiveHandler.requests, [path])
+        self.assertEqual(self.cache.stats.hits, 1)
+        self.assertEqual(self.cache.stats.misses, 1)
+        self.assertEqual(self.cache.stats.hit_rate, 0.5)
+
+    def test_index_not_cached(self):
+        path = '/ubuntu/dists/trusty/Release'
+        self.get(path)
+        self.get(path)
+        self.assertEqual(FakeArchiveHandler.requests, [path, path])
+        self.assertEqual(self.cache.stats.passthrough, 2)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_prefill_from_host_archives(self):
+        archives = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archives)
+        with open(os.path.join(archives, 'foo_1.0_amd64.deb'), 'wb') as f:
+            f.write(b'debcontents')
+        open(os.path.join(archives, 'lock'), 'w').close()
+
+        self.assertEqual(self.cache.prefill(archives), 1)
+        self.get('/ubuntu/pool/main/f/foo/foo_1.0_amd64.deb')
+        self.assertEqual(FakeArchiveHandler.requests, [])
+        self.assertEqual(self.cache.stats.hits, 1)
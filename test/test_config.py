@@ -17,11 +17,17 @@
 
 import logging
 import unittest
+from unittest.mock import patch
 import yaml
+import os
 import os.path as path
 import argparse
-from tempfile import NamedTemporaryFile
+import gc
+import shutil
+import stat
+from tempfile import NamedTemporaryFile, mkdtemp
 
+from cloudinstall import config as config_module
 from cloudinstall.config import Config
 import cloudinstall.utils as utils
 
@@ -178,6 +184,96 @@ class TestGoodConfig(unittest.TestCase):
         self.assertEqual(True, 'headless' not in cfg)
 
 
+class TestConfigFlush(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.cfg_file = path.join(self.tmpdir, 'config.yaml')
+        self.conf = Config({}, self.cfg_file, flush_delay=60,
+                           max_backups=3)
+
+    def read_file(self):
+        with open(self.cfg_file) as f:
+            return yaml.load(f)
+
+    def test_setopt_is_deferred(self):
+        """ setopt does not write until flushed """
+        self.conf.setopt('current_state', 1)
+        self.conf.setopt('current_state', 2)
+        self.assertFalse(path.exists(self.cfg_file))
+        self.assertEqual(2, self.conf.getopt('current_state'))
+        self.conf.flush()
+        self.assertEqual({'current_state': 2}, self.read_file())
+
+    def test_flush_delay_writes(self):
+        """ pending changes are written after flush_delay """
+        self.conf.flush_delay = 0.05
+        self.conf.setopt('deploy_complete', True)
+        self.conf._flush_timer.join(5)
+        self.assertEqual({'deploy_complete': True}, self.read_file())
+
+    def test_transaction_writes_once(self):
+        """ a transaction is written as one save on exit """
+        self.conf.flush_delay = 0
+        with patch.object(self.conf, 'save', wraps=self.conf.save) as save:
+            with self.conf.transaction():
+                self.conf.setopt('a', 1)
+                self.conf.setopt('b', 2)
+                self.assertEqual(0, save.call_count)
+            self.assertEqual(1, save.call_count)
+        self.assertEqual({'a': 1, 'b': 2}, self.read_file())
+
+    def test_backups_are_bounded(self):
+        """ only max_backups backups are kept """
+        backup_path = path.join(self.tmpdir, 'config-backups')
+        os.makedirs(backup_path)
+        for day in range(1, 6):
+            open(path.join(backup_path, 'config-2015-01-0{}-00:00:00'
+                           '.yaml'.format(day)), 'w').close()
+        self.conf.setopt('i', 1)
+        self.conf.save()
+        self.conf.setopt('i', 2)
+        self.conf.save()
+
+        backups = sorted(os.listdir(backup_path))
+        self.assertEqual(3, len(backups))
+        self.assertEqual('config-2015-01-04-00:00:00.yaml', backups[0])
+        self.assertEqual({'i': 2}, self.read_file())
+        # nothing but the config and its backups is left behind
+        self.assertEqual(['config-backups', 'config.yaml'],
+                         sorted(os.listdir(self.tmpdir)))
+
+    def test_saved_file_mode(self):
+        """ a new config.yaml is 0644 and backups are separate copies """
+        self.conf.save()
+        self.assertEqual(0o644, stat.S_IMODE(os.stat(self.cfg_file).st_mode))
+        self.conf.save()
+        backup_path = path.join(self.tmpdir, 'config-backups')
+        backup = path.join(backup_path, os.listdir(backup_path)[0])
+        self.assertEqual(1, os.stat(self.cfg_file).st_nlink)
+        self.assertEqual(0o644, stat.S_IMODE(os.stat(backup).st_mode))
+
+    def test_exit_flush_registry(self):
+        """ only configs with pending changes are flushed at exit, and
+        the registry does not keep them alive
+        """
+        self.assertNotIn(self.conf, config_module._unflushed)
+        self.conf.setopt('a', 1)
+        self.assertIn(self.conf, config_module._unflushed)
+        self.conf.flush()
+        self.assertNotIn(self.conf, config_module._unflushed)
+
+        other = Config({}, path.join(self.tmpdir, 'other.yaml'),
+                       flush_delay=60)
+        other.setopt('a', 1)
+        other._cancel_flush_timer()
+        del other
+        gc.collect()
+        self.assertEqual(0, len([c for c in config_module._unflushed
+                                 if c._cfg_file.startswith(self.tmpdir)]))
+
+
 @unittest.skip
 class TestBadConfig(unittest.TestCase):
 
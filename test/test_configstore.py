@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+# tests configstore.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+from cloudinstall.config import Config
+from cloudinstall.configstore import ConfigStore
+
+log = logging.getLogger('cloudinstall.test_configstore')
+
+
+class ConfigStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'config.db')
+        # two connections stand in for two processes
+        self.installer = ConfigStore(self.path)
+        self.status = ConfigStore(self.path)
+        self.addCleanup(self.installer.close)
+        self.addCleanup(self.status.close)
+
+    def test_changes_from_other_connection(self):
+        self.installer.update({'current_state': 1, 'headless': True})
+        self.assertEqual(self.status.changes(),
+                         {'current_state': 1, 'headless': True})
+        self.assertEqual(self.status.changes(), {})
+
+        self.installer.set('current_state', 2)
+        self.assertEqual(self.status.changes(), {'current_state': 2})
+
+    def test_own_writes_not_reported(self):
+        self.status.set('deploy_complete', True)
+        self.installer.set('current_state', 2)
+        self.assertEqual(self.status.changes(), {'current_state': 2})
+
+    def test_replace_drops_old_keys(self):
+        self.installer.update({'deploy_complete': True})
+        self.installer.update({'current_state': 0}, replace=True)
+        self.assertEqual(self.status.get_all(), {'current_state': 0})
+
+    def test_replace_keeps_serial_increasing(self):
+        self.installer.update({'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(self.status.changes(), {'a': 1, 'b': 2, 'c': 3})
+        self.installer.update({'current_state': 0}, replace=True)
+        self.assertEqual(self.status.changes(), {'current_state': 0})
+
+    def test_changes_without_data_version(self):
+        """ SQLite before 3.8.8 has no PRAGMA data_version """
+        self.status._has_data_version = False
+        self.installer.set('current_state', 1)
+        self.assertEqual(self.status.changes(), {'current_state': 1})
+        self.assertEqual(self.status.changes(), {})
+        self.installer.set('current_state', 2)
+        self.assertEqual(self.status.changes(), {'current_state': 2})
+
+    def test_subscribers(self):
+        cb = MagicMock()
+        self.status.subscribe('deploy_complete', cb)
+        self.installer.update({'deploy_complete': True, 'other': 1})
+        self.status.poll()
+        cb.assert_called_once_with('deploy_complete', True)
+
+    def test_watching_notifies(self):
+        called = threading.Event()
+        self.status.subscribe('current_state',
+                              lambda key, value: called.set())
+        self.status.start_watching()
+        self.installer.set('current_state', 3)
+        self.assertTrue(called.wait(5))
+
+
+class ConfigWithStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        cfg_file = os.path.join(self.tmpdir, 'config.yaml')
+        self.install_cfg = Config({'headless': True}, cfg_file,
+                                  flush_delay=60)
+        self.status_cfg = Config({'edit_placement': True}, cfg_file,
+                                 flush_delay=60)
+        self.install_store = ConfigStore(self.install_cfg.store_path)
+        self.status_store = ConfigStore(self.install_cfg.store_path)
+        self.addCleanup(self.install_store.close)
+        self.addCleanup(self.status_store.close)
+        self.addCleanup(self.install_cfg.flush)
+        self.addCleanup(self.status_cfg.flush)
+
+    def test_shared_values(self):
+        self.install_cfg.attach_store(self.install_store, replace=True)
+        self.status_cfg.attach_store(self.status_store)
+        self.assertTrue(self.status_cfg.getopt('headless'))
+        self.assertTrue(self.status_cfg.getopt('edit_placement'))
+
+        cb = MagicMock()
+        self.status_cfg.subscribe('deploy_complete', cb)
+        self.install_cfg.setopt('deploy_complete', True)
+        self.status_store.poll()
+        cb.assert_called_once_with('deploy_complete', True)
+        self.assertTrue(self.status_cfg.getopt('deploy_complete'))
+
+    def test_store_values_win(self):
+        self.install_cfg.attach_store(self.install_store, replace=True)
+        self.install_cfg.setopt('current_state', 2)
+        # a config.yaml written before the install moved on
+        self.status_cfg._config['current_state'] = 0
+        self.status_cfg.attach_store(self.status_store)
+        self.assertEqual(self.status_cfg.getopt('current_state'), 2)
+        self.assertEqual(self.install_store.get_all()['current_state'], 2)
+        self.assertTrue(self.install_store.get_all()['edit_placement'])
+
+    def test_local_subscribers(self):
+        cb = MagicMock()
+        self.install_cfg.subscribe('current_state', cb)
+        self.install_cfg.setopt('current_state', 1)
+        cb.assert_called_once_with('current_state', 1)
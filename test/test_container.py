@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+#
+# tests api/container.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, call, patch
+
+from cloudinstall.api.container import (CONFIG_ENTRIES_MARKER,
+                                        ContainerSession,
+                                        ContainerRunException,
+                                        LXCContainer, LXDContainer)
+
+log = logging.getLogger('cloudinstall.test_container')
+
+
+class ContainerSessionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # a local shell stands in for lxc-attach
+        self.session = ContainerSession('/bin/sh')
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_run_returns_output(self):
+        self.assertEqual(self.session.run('echo foo; echo bar'),
+                         'foo\nbar')
+
+    def test_run_reuses_process(self):
+        self.session.run('true')
+        proc = self.session.proc
+        self.session.run('true')
+        self.assertIs(proc, self.session.proc)
+
+    def test_run_raises_returncode(self):
+        with self.assertRaises(ContainerRunException) as cm:
+            self.session.run('exit_code() { return 3; }; exit_code')
+        self.assertEqual(cm.exception.args[1], 3)
+
+    def test_output_without_newline(self):
+        self.assertEqual(self.session.run('printf abc'), 'abc')
+
+    def test_timeout_restarts_session(self):
+        with self.assertRaises(ContainerRunException) as cm:
+            self.session.run('sleep 5', timeout=0.2)
+        self.assertEqual(cm.exception.args[1], 255)
+        self.assertEqual(self.session.run('echo ok'), 'ok')
+
+
+class ContainerIPCacheTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        LXCContainer.invalidate_ip('fake')
+
+    @patch.object(LXCContainer, '_lookup_ip')
+    def test_ip_cached_until_restart(self, mock_lookup):
+        mock_lookup.return_value = '10.0.0.2'
+        LXCContainer.ip('fake')
+        LXCContainer.ip('fake')
+        self.assertEqual(mock_lookup.call_count, 1)
+
+        with patch('cloudinstall.api.container.utils') as mock_utils:
+            mock_utils.get_command_output.return_value = dict(status=0)
+            LXCContainer.start('fake', '/dev/null')
+        LXCContainer.ip('fake')
+        self.assertEqual(mock_lookup.call_count, 2)
+
+
+class RunStatusTestCase(unittest.TestCase):
+
+    @patch('cloudinstall.api.container.utils')
+    def test_flushed_before_exec(self, mock_utils):
+        """ exec skips atexit, config and queued log records are written
+        out first
+        """
+        for cls in [LXCContainer, LXDContainer]:
+            calls = MagicMock()
+            config = MagicMock()
+            config.flush = calls.flush
+            with patch.object(cls, 'ip', return_value='10.0.0.2'), \
+                    patch('cloudinstall.api.container.stop_logger',
+                          calls.stop_logger), \
+                    patch('os.execlp', calls.execlp):
+                cls.run_status('fake', 'openstack-status', config)
+            self.assertEqual([c[0] for c in calls.mock_calls],
+                             ['flush', 'stop_logger', 'execlp'])
+
+
+class LXCImageCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        patcher = patch.object(LXCContainer, 'container_root', self.root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.root)
+
+        src = os.path.join(self.root, 'single')
+        os.makedirs(src)
+        with open(os.path.join(src, 'config'), 'w') as f:
+            f.write("lxc.rootfs = {}/rootfs\n"
+                    "lxc.utsname = single\n".format(src))
+        LXCContainer.add_config_entries('single', ['lxc.start.auto = 1'])
+
+    @patch('cloudinstall.api.container.utils')
+    def test_publish_image_strips_install_entries(self, mock_utils):
+        mock_utils.get_command_output.return_value = dict(status=0)
+        LXCContainer.publish_image('single', 'uoi-cache-abc')
+
+        with open(os.path.join(self.root, 'uoi-cache-abc', 'config')) as f:
+            config = f.read()
+        self.assertEqual(config,
+                         "lxc.rootfs = {}/uoi-cache-abc/rootfs\n"
+                         "lxc.utsname = uoi-cache-abc\n".format(self.root))
+        self.assertNotIn(CONFIG_ENTRIES_MARKER, config)
+        self.assertFalse(os.path.exists(os.path.join(
+            self.root, 'uoi-cache-abc.partial')))
+
+    @patch('cloudinstall.api.container.utils')
+    def test_create_from_image_clones(self, mock_utils):
+        mock_utils.get_command_output.return_value = dict(status=0)
+        LXCContainer.create('single2', '/dev/null', image='uoi-cache-abc')
+        cmd = mock_utils.get_command_output.call_args[0][0]
+        self.assertIn('lxc-clone -s -B overlayfs -o uoi-cache-abc '
+                      '-n single2', cmd)
+
+    @patch('cloudinstall.api.container.utils')
+    def test_publish_image_clears_host_identity(self, mock_utils):
+        mock_utils.get_command_output.return_value = dict(status=0)
+        LXCContainer.publish_image('single', 'uoi-cache-abc')
+        cmds = " ".join(c[0][0] for c in
+                        mock_utils.get_command_output.call_args_list)
+        rootfs = os.path.join(self.root, 'uoi-cache-abc.partial', 'rootfs')
+        self.assertIn(rootfs + '/etc/ssh/ssh_host_*', cmds)
+        self.assertIn('truncate -s 0 ' + rootfs + '/etc/machine-id', cmds)
+
+    def test_list_images_oldest_first(self):
+        for age, name in enumerate(['uoi-cache-new', 'uoi-cache-old']):
+            os.makedirs(os.path.join(self.root, name))
+            config = os.path.join(self.root, name, 'config')
+            open(config, 'w').close()
+            os.utime(config, (1000 - age, 1000 - age))
+        os.makedirs(os.path.join(self.root, 'uoi-cache-x.partial'))
+        self.assertEqual(LXCContainer.list_images(),
+                         ['uoi-cache-old', 'uoi-cache-new'])
+
+    @patch.object(LXCContainer, 'delete_image')
+    @patch.object(LXCContainer, 'list_images')
+    def test_prune_images(self, mock_list, mock_delete):
+        mock_list.return_value = ['uoi-cache-1', 'uoi-cache-2',
+                                  'uoi-cache-3', 'uoi-cache-4']
+        LXCContainer.prune_images(keep=2, in_use='uoi-cache-2')
+        self.assertEqual(mock_delete.call_args_list,
+                         [call('uoi-cache-1'), call('uoi-cache-3')])
+
+
+class LXDImageCacheTestCase(unittest.TestCase):
+
+    @patch('cloudinstall.api.container.utils')
+    def test_list_images(self, mock_utils):
+        outputs = {
+            'lxc image alias list':
+            "+-----------------+-------------+\n"
+            "|      ALIAS      | FINGERPRINT |\n"
+            "| ubuntu          | 0123abcd    |\n"
+            "| uoi-cache-bbb   | 4567ef01    |\n"
+            "| uoi-cache-aaa   | 89abcdef    |\n",
+            'lxc image info uoi-cache-bbb':
+            "Uploaded: 2016/04/13 18:52 UTC\n",
+            'lxc image info uoi-cache-aaa':
+            "Uploaded: 2016/05/02 09:10 UTC\n"}
+        mock_utils.get_command_output.side_effect = \
+            lambda cmd, **kw: dict(status=0, output=outputs[cmd])
+        self.assertEqual(LXDContainer.list_images(),
+                         ['uoi-cache-bbb', 'uoi-cache-aaa'])
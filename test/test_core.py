@@ -16,10 +16,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import os
+import tempfile
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import ANY, MagicMock, patch
 
-from cloudinstall.config import Config
+from cloudinstall.config import Config, INSTALL_TYPE_MULTI
 from cloudinstall.core import Controller
 from cloudinstall.juju import JujuState
 
@@ -33,7 +35,11 @@ class WaitForDeployedServicesReadyCoreTestCase(unittest.TestCase):
     """
 
     def setUp(self):
-        self.conf = Config({}, save_backups=False)
+        cfg_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cfg_dir.cleanup)
+        self.conf = Config({}, os.path.join(cfg_dir.name, 'config.yaml'),
+                           save_backups=False)
+        self.addCleanup(self.conf.flush)
         self.mock_ui = MagicMock(name='ui')
         self.mock_log = MagicMock(name='log')
         self.mock_loop = MagicMock(name='loop')
@@ -72,3 +78,48 @@ class WaitForDeployedServicesReadyCoreTestCase(unittest.TestCase):
             self.dc.wait_for_deployed_services_ready()
         print(mock_sleep.mock_calls)
         self.assertEqual(len(mock_sleep.mock_calls), 2)
+
+    def test_phase_changed_in_event_loop(self):
+        """ phase flags set on other threads update the UI from the event
+        loop
+        """
+        r, w = os.pipe()
+        self.addCleanup(os.close, r)
+        self.addCleanup(os.close, w)
+        self.dc._phase_pipe = w
+        with patch.object(self.dc, 'write_profile'):
+            self.conf.setopt('deploy_complete', True)
+        self.assertFalse(self.mock_ui.update_phase_status.called)
+        self.dc._phase_ready(os.read(r, 10))
+        self.mock_ui.update_phase_status.assert_called_once_with(self.conf)
+
+    def test_start_writes_profile(self):
+        """ a failed headless deployment still writes its trace """
+        self.conf.setopt('headless', True)
+        self.dc.initialize.side_effect = Exception("deploy failed")
+        with patch('cloudinstall.core.profiler') as mock_profiler:
+            with self.assertRaises(Exception):
+                self.dc.start()
+        mock_profiler.write.assert_called_once_with(
+            os.path.join(self.conf.cfg_path, 'trace.json'),
+            os.path.join(self.conf.cfg_path, 'trace.folded'), None)
+
+    def test_headless_nothing_to_deploy(self):
+        """ a headless deployment that can't deploy the placement fails
+        rather than waiting for a placement screen
+        """
+        self.conf.setopt('headless', True)
+        self.conf.setopt('install_type', INSTALL_TYPE_MULTI[0])
+        dc = Controller(ui=self.mock_ui, config=self.conf,
+                        loop=self.mock_loop)
+        with patch.object(dc, 'authenticate_juju'), \
+                patch.object(dc, 'begin_deployment') as begin, \
+                patch('cloudinstall.core.connect_to_maas',
+                      return_value=(MagicMock(), MagicMock())), \
+                patch('cloudinstall.core.PlacementController') as pc:
+            pc.return_value.can_deploy.return_value = False
+            dc.initialize()
+        self.mock_loop.exit.assert_called_once_with(1)
+        self.mock_ui.progress_event.assert_called_once_with(
+            'finished', status='error', error=ANY)
+        self.assertFalse(begin.called)
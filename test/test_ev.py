@@ -19,7 +19,7 @@ import logging
 import unittest
 import urwid
 from unittest.mock import MagicMock, ANY
-from cloudinstall.ev import EventLoop
+from cloudinstall.ev import EventLoop, ThrottledMainLoop
 from cloudinstall.config import Config
 from cloudinstall.core import Controller
 from tempfile import NamedTemporaryFile
@@ -134,3 +134,51 @@ class EventLoopCoreTestCase(unittest.TestCase):
             dc.loop.exit(1)
         exc = cm.exception
         self.assertEqual(ev.error_code, exc.code, "Found loop")
+
+
+class ThrottledMainLoopTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.text = urwid.Text("one")
+        self.loop = ThrottledMainLoop(urwid.Filler(self.text),
+                                      screen=MagicMock(),
+                                      event_loop=MagicMock(), max_fps=10)
+        self.loop.screen_size = (20, 5)
+        self.draw = self.loop.screen.draw_screen
+
+    def test_idle_draws_once(self):
+        self.loop.entering_idle()
+        self.loop.last_draw -= 0.1
+        self.loop.entering_idle()
+        self.draw.assert_called_once_with((20, 5), ANY)
+
+    def test_frame_rate(self):
+        self.loop.entering_idle()
+        self.loop.request_redraw()
+        self.loop.entering_idle()
+        self.assertEqual(self.draw.call_count, 1)
+        self.loop.last_draw -= 0.1
+        self.loop.entering_idle()
+        self.assertEqual(self.draw.call_count, 2)
+
+    def test_changed_widgets_redraw(self):
+        self.loop.entering_idle()
+        self.loop.last_draw -= 0.1
+        self.text.set_text("two")
+        self.loop.entering_idle()
+        self.assertEqual(self.draw.call_count, 2)
+        self.assertEqual(self.draw.call_args[0][1].text[2].strip(), b"two")
+
+    def test_alarms_and_input(self):
+        self.loop.entering_idle()
+        self.loop.last_draw -= 0.1
+        # an alarm that changes nothing draws nothing
+        cb = MagicMock()
+        self.loop.set_alarm_in(1, cb)
+        self.loop.event_loop.alarm.call_args[0][1]()
+        cb.assert_called_once_with(self.loop, None)
+        self.loop.entering_idle()
+        self.assertEqual(self.draw.call_count, 1)
+        self.loop.process_input(['x'])
+        self.loop.entering_idle()
+        self.assertEqual(self.draw.call_count, 2)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+#
+# tests fakeapi
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import socket
+import tempfile
+import unittest
+from unittest.mock import patch
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from cloudinstall.core import FakeJujuState
+from cloudinstall.fakeapi import (FakeCloud, Session, make_nodes, DEPLOYED,
+                                  MAAS_API_PATH)
+from cloudinstall.fakeapi.juju import (FakeJujuServer, accept_key,
+                                       encode_frame, read_frame)
+from cloudinstall.fakeapi.maas import FakeMaasServer
+from cloudinstall.fakeapi.synth import (synth_cloud, synth_nodes,
+                                        synth_status, write_fake_api_data)
+from cloudinstall.maas import FakeMaasState
+
+log = logging.getLogger('cloudinstall.test_fakeapi')
+
+
+def call(cloud, request, **params):
+    return cloud.juju_request({'Type': 'Client', 'Request': request,
+                               'RequestId': 1, 'Params': params})
+
+
+class FakeCloudTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cloud = FakeCloud(make_nodes(3))
+
+    def test_add_machines_by_tag(self):
+        node = self.cloud.nodes[1]
+        rv = call(self.cloud, 'AddMachines', MachineParams=[
+            {'Constraints': {'tags': [node['system_id']]}}])
+        self.assertEqual(rv['Response']['Machines'],
+                         [{'Machine': '1', 'Error': None}])
+        status = call(self.cloud, 'FullStatus')['Response']
+        self.assertEqual(status['Machines']['1']['InstanceId'],
+                         node['resource_uri'])
+        self.assertEqual(node['status'], DEPLOYED)
+
+    def test_units_start(self):
+        self.cloud.machine_start = 1000
+        call(self.cloud, 'AddMachines', MachineParams=[{}])
+        call(self.cloud, 'ServiceDeploy', ServiceName='mysql',
+             NumUnits=1, ToMachineSpec='lxc:1')
+        status = call(self.cloud, 'FullStatus')['Response']
+        machine = status['Machines']['1']
+        self.assertEqual(machine['AgentState'], 'pending')
+        self.assertIn('1/lxc/0', machine['Containers'])
+        unit = status['Services']['mysql']['Units']['mysql/0']
+        self.assertEqual(unit['Machine'], '1/lxc/0')
+        self.assertEqual(unit['AgentState'], 'pending')
+
+        self.cloud.machine_start = 0
+        status = call(self.cloud, 'FullStatus')['Response']
+        unit = status['Services']['mysql']['Units']['mysql/0']
+        self.assertEqual(unit['AgentState'], 'started')
+        self.assertEqual(unit['Workload']['Status'], 'active')
+
+    def test_relations(self):
+        for name in ['mysql', 'keystone']:
+            call(self.cloud, 'ServiceDeploy', ServiceName=name,
+                 NumUnits=0)
+        endpoints = ['keystone:shared-db', 'mysql:shared-db']
+        self.assertNotIn('Error', call(self.cloud, 'AddRelation',
+                                       Endpoints=endpoints))
+        rv = call(self.cloud, 'AddRelation', Endpoints=endpoints[::-1])
+        self.assertEqual(rv['Error'], "relation already exists")
+        status = call(self.cloud, 'FullStatus')['Response']
+        self.assertEqual(status['Services']['mysql']['Relations'],
+                         {'shared-db': ['keystone']})
+        self.assertEqual(self.cloud.calls['Client.AddRelation'], 2)
+
+    def test_session_replay(self):
+        self.cloud.session = Session(juju=[
+            {'Type': 'Client', 'Request': 'FullStatus', 'Response': {'n': 1}},
+            {'Type': 'Client', 'Request': 'FullStatus', 'Response': {'n': 2}},
+        ], maas=[{'method': 'GET', 'path': '/nodes/', 'op': 'list',
+                  'body': []}])
+        responses = [call(self.cloud, 'FullStatus')['Response']['n']
+                     for _ in range(3)]
+        self.assertEqual(responses, [1, 2, 2])
+        self.assertEqual(self.cloud.maas_request('GET', '/nodes/',
+                                                 {'op': 'list'}),
+                         (200, []))
+        # requests without recordings come from the model
+        self.assertNotIn('Error', call(self.cloud, 'AddMachines',
+                                       MachineParams=[{}]))
+
+
+class FakeServersTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cloud = FakeCloud(make_nodes(2, bootstrap=False))
+
+    def start(self, server):
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_maas_server(self):
+        server = self.start(FakeMaasServer(self.cloud))
+        base = 'http://{}{}'.format(server.api_host, MAAS_API_PATH)
+
+        nodes = json.loads(urlopen(base + '/nodes/?op=list').read().decode())
+        self.assertEqual([n['hostname'] for n in nodes],
+                         ['node0.maas', 'node1.maas'])
+
+        def post(path, **params):
+            return urlopen(base + path, urlencode(params).encode()).read()
+        post('/tags/', op='new', name='fast')
+        post('/tags/fast/', op='update_nodes', add='node-00001')
+        self.assertEqual(self.cloud.nodes[1]['tag_names'], ['fast'])
+        self.assertEqual(self.cloud.calls['POST /tags/*/ update_nodes'], 1)
+
+    def test_juju_server(self):
+        server = self.start(FakeJujuServer(self.cloud))
+        host, port = server.server_address[:2]
+        sock = socket.create_connection((host, port), timeout=5)
+        self.addCleanup(sock.close)
+        key = 'dGhlIHNhbXBsZSBub25jZQ=='
+        sock.sendall(("GET / HTTP/1.1\r\nHost: {}:{}\r\n"
+                      "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                      "Sec-WebSocket-Key: {}\r\n"
+                      "Sec-WebSocket-Version: 13\r\n\r\n").format(
+                          host, port, key).encode())
+        rfile = sock.makefile('rb')
+        headers = []
+        while True:
+            line = rfile.readline().strip()
+            if not line:
+                break
+            headers.append(line.decode())
+        self.assertIn("101", headers[0])
+        self.assertIn("Sec-WebSocket-Accept: " + accept_key(key), headers)
+        self.assertEqual(accept_key(key), 's3pPLMBiTxaQ9kYGzzhZRbK+xOo=')
+
+        msg = {'Type': 'Admin', 'Request': 'Login', 'RequestId': 7,
+               'Params': {'x': 'y' * 200}}
+        sock.sendall(encode_frame(json.dumps(msg).encode(),
+                                  mask=os.urandom(4)))
+        fin, opcode, payload = read_frame(rfile)
+        self.assertEqual(json.loads(payload.decode()),
+                         {'RequestId': 7, 'Response': {}})
+        self.assertEqual(self.cloud.calls['Admin.Login'], 1)
+
+
+class SynthTestCase(unittest.TestCase):
+
+    def test_deterministic(self):
+        self.assertEqual(synth_nodes(50, seed=3), synth_nodes(50, seed=3))
+        self.assertNotEqual(synth_nodes(50, seed=3), synth_nodes(50, seed=4))
+        self.assertEqual(synth_status(20, seed=3), synth_status(20, seed=3))
+
+    def test_counts(self):
+        nodes = synth_nodes(40)
+        self.assertEqual(len(nodes), 41)
+        self.assertEqual(nodes[0]['hostname'], 'juju-bootstrap.maas')
+        status = synth_status(40, services=8, units=100)
+        self.assertEqual(len(status['Machines']), 41)
+        self.assertEqual(len(status['Services']), 8)
+        units = [u for s in status['Services'].values()
+                 for u in s['Units'].values()]
+        self.assertEqual(len(units), 100)
+        for u in units:
+            mid = u['Machine'].split('/')[0]
+            machine = status['Machines'][mid]
+            self.assertTrue(u['Machine'] == mid or
+                            u['Machine'] in machine['Containers'])
+
+    def test_cloud_consistent(self):
+        nodes, status = synth_cloud(20, 10)
+        by_uri = {n['resource_uri']: n for n in nodes}
+        for mid, m in status['Machines'].items():
+            if mid != '0':
+                self.assertEqual(by_uri[m['InstanceId']]['status'],
+                                 DEPLOYED)
+
+    def test_fake_cloud_status(self):
+        nodes, status = synth_cloud(10, 5)
+        cloud = FakeCloud(nodes, status=status)
+        full = call(cloud, 'FullStatus')['Response']
+        self.assertEqual(set(full['Machines']), set(status['Machines']))
+        for name, svc in status['Services'].items():
+            for unit_name, u in svc['Units'].items():
+                self.assertEqual(
+                    full['Services'][name]['Units'][unit_name]['AgentState'],
+                    u['AgentState'])
+
+        # new machines and units go after the existing ones
+        rv = call(cloud, 'AddMachines', MachineParams=[{}])
+        self.assertEqual(rv['Response']['Machines'][0]['Machine'], '6')
+        name = sorted(status['Services'])[0]
+        call(cloud, 'AddServiceUnits', ServiceName=name, NumUnits=1)
+        full = call(cloud, 'FullStatus')['Response']
+        self.assertIn("{}/{}".format(name, len(status['Services'][name][
+            'Units'])), full['Services'][name]['Units'])
+
+    def test_fake_api_data(self):
+        nodes, status = synth_cloud(10, 5)
+        with tempfile.TemporaryDirectory() as d:
+            write_fake_api_data(d, nodes, status)
+            with patch.dict(os.environ, {'FAKE_API_DATA': d}):
+                maas_state = FakeMaasState()
+                juju_state = FakeJujuState()
+                self.assertEqual(len(maas_state.machines()), 10)
+                self.assertEqual(sum(maas_state.machines_summary().values()),
+                                 11)
+                self.assertEqual(len(juju_state.machines()), 5)
+                self.assertEqual(
+                    sorted(s.service_name for s in juju_state.services),
+                    sorted(status['Services']))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#
+# tests api/inotify.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from cloudinstall.api.inotify import FileWatcher
+
+log = logging.getLogger('cloudinstall.test_inotify')
+
+
+class FileWatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.target = os.path.join(self.tmpdir, 'run', 'cloud-init',
+                                   'result.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _create_later(self, delay=0.2):
+        def create():
+            time.sleep(delay)
+            os.makedirs(os.path.dirname(self.target))
+            with open(self.target, 'w') as f:
+                f.write('{}')
+        t = threading.Thread(target=create)
+        t.start()
+        return t
+
+    def test_wakes_when_file_created_in_new_dir(self):
+        with FileWatcher(self.target) as watcher:
+            if not watcher.uses_inotify:
+                self.skipTest("inotify not available")
+            t = self._create_later()
+            start = time.time()
+            while not watcher.exists():
+                self.assertTrue(time.time() - start < 5)
+                watcher.wait(timeout=5)
+            t.join()
+            self.assertTrue(time.time() - start < 5)
+
+    def test_wait_times_out(self):
+        with FileWatcher(self.target) as watcher:
+            if not watcher.uses_inotify:
+                self.skipTest("inotify not available")
+            self.assertFalse(watcher.wait(timeout=0.05))
+
+    @patch('cloudinstall.api.inotify._get_libc')
+    def test_polling_fallback_backs_off(self, mock_libc):
+        mock_libc.return_value = None
+        with patch('cloudinstall.api.inotify.time') as mock_time:
+            watcher = FileWatcher(self.target, min_interval=0.1,
+                                  max_interval=0.4)
+            self.assertFalse(watcher.uses_inotify)
+            self.assertFalse(watcher.exists())
+            for _ in range(4):
+                self.assertTrue(watcher.wait(timeout=1))
+            delays = [c[0][0] for c in mock_time.sleep.call_args_list]
+        self.assertEqual(delays, [0.1, 0.2, 0.4, 0.4])
+
+    def test_no_path_always_exists(self):
+        watcher = FileWatcher(None)
+        self.assertTrue(watcher.exists())
+        self.assertFalse(watcher.uses_inotify)
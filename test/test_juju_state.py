@@ -75,3 +75,16 @@ class JujuStateTestCase(unittest.TestCase):
                      if b != 'started']
         self.assertEqual(len(not_ready), 2)
         self.assertFalse(juju_state.all_agents_started())
+
+    def test_machine(self):
+        """ Looks machines up by id, never returning bootstrap """
+        juju = MagicMock()
+        juju.status.return_value = {'Machines': {
+            '0': {'InstanceId': 'bootstrap'},
+            '1': {'InstanceId': 'i-1', 'Hardware': 'arch=amd64'}}}
+        juju_state = JujuState(juju=juju)
+        self.assertEqual(juju_state.machine('1').instance_id, 'i-1')
+        self.assertEqual(juju_state.machine('0').machine_id, '-')
+        self.assertEqual(juju_state.machine('2').machine_id, '-')
+        self.assertEqual(juju_state.base_machine('1/lxc/0').instance_id,
+                         'i-1')
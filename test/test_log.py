@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# tests log.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from cloudinstall.log import JSONFormatter, setup_logger, stop_logger
+
+log = logging.getLogger('cloudinstall.test_log')
+
+
+class ThreadRecorder:
+
+    """ Remembers the thread it was formatted on """
+
+    def __repr__(self):
+        self.thread = threading.current_thread()
+        return "recorded"
+
+
+class LogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.logfile = os.path.join(self.tempdir.name, '.cloud-install',
+                                    'commands.log')
+        root = logging.getLogger('')
+        handlers, level = list(root.handlers), root.level
+
+        def restore():
+            stop_logger()
+            for h in root.handlers[:]:
+                if h not in handlers:
+                    root.removeHandler(h)
+                    h.close()
+            root.setLevel(level)
+        self.addCleanup(restore)
+
+    def setup(self, **env):
+        env['HOME'] = self.tempdir.name
+        with patch.dict(os.environ, env):
+            setup_logger()
+
+    def test_json_formatter(self):
+        record = logging.LogRecord('cloudinstall.x', logging.INFO,
+                                   'x.py', 7, "deployed %s", ('nova',),
+                                   None)
+        record.charm = 'nova-compute'
+        entry = json.loads(JSONFormatter().format(record))
+        self.assertEqual(entry['message'], "deployed nova")
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['line'], 7)
+        self.assertEqual(entry['charm'], 'nova-compute')
+
+    def test_formats_on_logging_thread(self):
+        self.setup()
+        arg = ThreadRecorder()
+        log.debug("value %s", arg)
+        stop_logger()
+        self.assertNotEqual(arg.thread, threading.current_thread())
+        with open(self.logfile) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].endswith("value recorded"))
+
+    def test_json_file_and_filter(self):
+        self.setup(UCI_LOGFORMAT='json')
+        log.info("hello", extra={'phase': 'deploy'})
+        logging.getLogger('macumba').info("filtered")
+        stop_logger()
+        # after stopping, records are written directly
+        log.info("late")
+        with open(self.logfile) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual([e['message'] for e in entries], ["hello", "late"])
+        self.assertEqual(entries[0]['phase'], 'deploy')
@@ -23,7 +23,7 @@ from unittest.mock import MagicMock, PropertyMock
 import json
 
 from cloudinstall.maas import (MaasMachine, MaasMachineStatus, MaasState,
-                               satisfies)
+                               MachineTable, compile_constraints, satisfies)
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'maas-output')
 
@@ -75,6 +75,36 @@ class SatisfiesTestCase(unittest.TestCase):
         self._do_test(dict(arch='ENIAC'), 0, machine=self.machine2)
 
 
+class ConstraintsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.machines = [
+            MaasMachine('m{}'.format(i),
+                        {'cpu_count': 1 + i % 8,
+                         'storage': 10240 * (1 + i % 4),
+                         'memory': 1024 * (1 + i % 16),
+                         'architecture': ['amd64', 'arm64'][i % 2]})
+            for i in range(100)]
+        self.machines.append(MaasMachine('wild', {'cpu_count': '*',
+                                                  'storage': '*',
+                                                  'memory': '*',
+                                                  'architecture': '*'}))
+
+    def test_compiled_once(self):
+        cons = {'mem': '4G', 'arch': 'amd64'}
+        self.assertIs(compile_constraints(cons),
+                      compile_constraints(dict(cons)))
+
+    def test_matching_agrees_with_satisfies(self):
+        table = MachineTable(self.machines)
+        for cons in [{}, {'mem': '4G'}, {'arch': 'arm64', 'cpu_cores': 4},
+                     {'root-disk': 30000, 'mem': 8192},
+                     {'mem': '1T'}]:
+            expected = [m for m in self.machines if satisfies(m, cons)[0]]
+            self.assertEqual(compile_constraints(cons).matching(table),
+                             expected)
+
+
 class MaasMachineTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -160,3 +190,14 @@ class MaasStateTestCase(unittest.TestCase):
         s = MaasState(self.mock_client_oneready)
         ready_machines = s.machines(MaasMachineStatus.READY)
         self.assertEqual(len(ready_machines), 1)
+
+    def test_machine(self):
+        s = MaasState(self.mock_client_oneready)
+        m = s.machines()[0]
+        found = s.machine(m.instance_id)
+        self.assertEqual(found.hostname, m.hostname)
+        # looked up in an index built once per load of the nodes
+        self.assertIs(s.machine(m.instance_id), found)
+        self.assertIsNone(s.machine('/MAAS/api/1.0/nodes/missing/'))
+        s.invalidate_nodes_cache()
+        self.assertIsNot(s.machine(m.instance_id), found)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+#
+# tests machine.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+
+from cloudinstall.machine import HardwareInfoCache
+
+log = logging.getLogger('cloudinstall.test_machine')
+
+
+class HardwareInfoCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = HardwareInfoCache()
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('1', 'i-1'))
+        self.cache.set('1', 'i-1', {'arch': 'amd64'})
+        self.assertEqual(self.cache.get('1', 'i-1'), {'arch': 'amd64'})
+        self.assertIsNone(self.cache.get('1', 'i-2'))
+
+    def test_unprovisioned_not_cached(self):
+        self.cache.set('1', 'pending', {'arch': 'N/A'})
+        self.cache.set('2', None, {'arch': 'N/A'})
+        self.assertEqual(len(self.cache), 0)
+
+    def test_reprovision_drops_old_entry(self):
+        self.cache.set('1', 'i-1', {'arch': 'amd64'})
+        self.cache.set('1/lxc/0', 'i-1', {'arch': 'amd64'})
+        self.cache.set('1', 'i-2', {'arch': 'arm64'})
+        self.assertIsNone(self.cache.get('1', 'i-1'))
+        self.assertEqual(self.cache.get('1', 'i-2'), {'arch': 'arm64'})
+        self.assertEqual(len(self.cache), 2)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#
+# tests metrics.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+from urllib.request import urlopen
+
+from cloudinstall import metrics
+from cloudinstall.metrics import Counter, Gauge, Histogram
+from cloudinstall.profiler import profiler
+
+log = logging.getLogger('cloudinstall.test_metrics')
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def test_counter(self):
+        c = Counter('test_total', "A counter", ['kind'])
+        c.inc(kind='a')
+        c.inc(2, kind='a')
+        c.inc(kind='b"')
+        self.assertEqual(c.exposition(),
+                         '# HELP test_total A counter\n'
+                         '# TYPE test_total counter\n'
+                         'test_total{kind="a"} 3.0\n'
+                         'test_total{kind="b\\""} 1.0')
+        with self.assertRaises(ValueError):
+            c.inc(other='x')
+
+    def test_gauge(self):
+        g = Gauge('test_gauge', "A gauge")
+        g.set(4)
+        g.set(2)
+        self.assertTrue(g.exposition().endswith('\ntest_gauge 2.0'))
+
+    def test_histogram(self):
+        h = Histogram('test_seconds', "A histogram", buckets=(0.1, 1.0))
+        for v in (0.05, 0.5, 0.5, 5):
+            h.observe(v)
+        lines = h.exposition().split('\n')[2:]
+        self.assertEqual(lines, ['test_seconds_bucket{le="0.1"} 1.0',
+                                 'test_seconds_bucket{le="1.0"} 3.0',
+                                 'test_seconds_bucket{le="+Inf"} 4.0',
+                                 'test_seconds_sum 6.05',
+                                 'test_seconds_count 4.0'])
+
+    def test_spans_feed_request_latency(self):
+        before = dict(metrics.juju_request_seconds._values)
+        profiler.add("juju status", "juju", 1.0, 1.2)
+        counts, total = metrics.juju_request_seconds._values[('status',)]
+        old = before.get(('status',), ([], 0.0))[1]
+        self.assertAlmostEqual(total - old, 0.2)
+
+    def test_http_server(self):
+        server = metrics.start_http_server(0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = 'http://127.0.0.1:{}/'.format(server.server_port)
+        body = urlopen(url + 'metrics').read().decode()
+        self.assertIn('# TYPE installer_pending_deploys gauge', body)
+        self.assertIn('installer_ui_frame_seconds', body)
+        with self.assertRaises(Exception):
+            urlopen(url + 'other')
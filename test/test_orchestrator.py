@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+#
+# tests orchestrator.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+import yaml
+
+from cloudinstall import juju, maas
+from cloudinstall.charms import get_charm_config
+from cloudinstall.config import (Config, INSTALL_TYPE_MULTI,
+                                 INSTALL_TYPE_SINGLE)
+from cloudinstall.orchestrator import (Environment, Orchestrator,
+                                       OrchestratorException)
+from cloudinstall.profiler import span
+from cloudinstall.progress import ProgressStream
+
+log = logging.getLogger('cloudinstall.test_orchestrator')
+
+
+class UnclosedBytesIO(io.BytesIO):
+
+    def close(self):
+        pass
+
+
+class OrchestratorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # test_utils and test_landscape_install leave PropertyMocks on
+        # these
+        for name, prop in [
+                ('cfg_path', property(lambda c: os.path.dirname(c.cfg_file))),
+                ('pidfile', property(lambda c: os.path.join(
+                    c.cfg_path, 'openstack.pid')))]:
+            patcher = patch.object(Config, name, prop)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.out = UnclosedBytesIO()
+        self.progress = ProgressStream(self.out)
+
+    def make_env(self, name, install_type=INSTALL_TYPE_MULTI[0]):
+        cfg_dir = os.path.join(self.tmpdir.name, name)
+        os.makedirs(cfg_dir)
+        cfg_file = os.path.join(cfg_dir, 'config.yaml')
+        with open(cfg_file, 'w') as f:
+            yaml.safe_dump({'install_type': install_type}, f)
+        env = Environment.from_config_file(cfg_file, progress=self.progress)
+        self.addCleanup(env.config.flush)
+        return env
+
+    def events(self):
+        return [json.loads(line.decode())
+                for line in self.out.getvalue().splitlines()]
+
+    def test_run(self):
+        envs = [self.make_env('zone1'), self.make_env('zone2'),
+                self.make_env('zone3')]
+        self.assertEqual([e.name for e in envs], ['zone1', 'zone2', 'zone3'])
+        self.assertTrue(all(e.config.getopt('headless') for e in envs))
+        threads = {}
+        started = threading.Barrier(2, timeout=5)
+
+        def deploy(env, err):
+            threads[env.name] = threading.current_thread().name
+            self.assertTrue(os.path.isfile(env.config.pidfile))
+            if env.name != 'zone3':
+                # zone1 and zone2 run at the same time
+                started.wait()
+            with span("deploy " + env.name):
+                pass
+            if isinstance(err, Exception):
+                raise err
+            env.controller.ui.status_info_message("done")
+            env.loop.exit(err)
+
+        for env, err in zip(envs, [0, RuntimeError("no maas"), 2]):
+            env.controller.initialize = MagicMock(
+                side_effect=lambda env=env, err=err: deploy(env, err))
+
+        results = Orchestrator(envs, max_parallel=2).run()
+        self.assertEqual(results, {'zone1': 0, 'zone2': 1, 'zone3': 2})
+        self.assertEqual(threads, {n: n for n in results})
+        for env in envs:
+            self.assertFalse(os.path.exists(env.config.pidfile))
+        events = [(e['install'], e['event']) for e in self.events()]
+        self.assertEqual(sorted(events),
+                         [('zone1', 'status'), ('zone2', 'finished'),
+                          ('zone3', 'status')])
+        # zone3 reuses a thread, each trace only has its own spans
+        for env in envs:
+            with open(os.path.join(env.config.cfg_path, 'trace.json')) as f:
+                trace = json.loads(f.read().rstrip(",\n") + "]")
+            self.assertEqual([e['name'] for e in trace if e['ph'] == 'X'],
+                             ["deploy " + env.name])
+
+    def test_already_running(self):
+        env = self.make_env('zone1')
+        with open(env.config.pidfile, 'w') as f:
+            f.write('1')
+        env.controller.initialize = MagicMock()
+        self.assertEqual(Orchestrator([env]).run(), {'zone1': 1})
+        self.assertFalse(env.controller.initialize.called)
+
+    def test_invalid(self):
+        self.assertRaises(OrchestratorException, self.make_env, 'single',
+                          INSTALL_TYPE_SINGLE[0])
+        env = self.make_env('zone1')
+        self.assertRaises(OrchestratorException, Orchestrator, [env, env])
+
+
+class SharedCacheTestCase(unittest.TestCase):
+
+    def test_charm_config(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.yaml') as f:
+            f.write("mysql: {dataset-size: 10%}\n")
+            f.flush()
+            first, raw = get_charm_config(f.name)
+            self.assertEqual(first, {'mysql': {'dataset-size': '10%'}})
+            self.assertIs(get_charm_config(f.name)[0], first)
+
+            f.write("keystone: {}\n")
+            f.flush()
+            st = os.stat(f.name)
+            os.utime(f.name, (st.st_atime, st.st_mtime + 10))
+            self.assertIn('keystone', get_charm_config(f.name)[0])
+        self.assertEqual(get_charm_config(f.name), ({}, None))
+
+    def test_query_cs(self):
+        with patch.dict(juju._cs_cache, clear=True), \
+                patch('macumba.api.query_cs',
+                      return_value={'Id': 'cs:trusty/ntp-12'}) as query:
+            first = juju.query_cs('ntp')
+            first['Id'] = 'changed'
+            self.assertEqual(juju.query_cs('ntp')['Id'], 'cs:trusty/ntp-12')
+        self.assertEqual(query.call_count, 1)
+
+    def test_maas_session(self):
+        auth = MagicMock(api_url='http://maas/MAAS/api/1.0')
+        with patch.object(maas, '_session', None), \
+                patch.object(maas, 'requests') as requests, \
+                patch.object(maas.TracedMaasClient, '_oauth'):
+            maas.TracedMaasClient(auth).get('/nodes/')
+            maas.TracedMaasClient(auth).post('/nodes/', {'op': 'acquire'})
+        session = requests.Session.return_value
+        self.assertEqual(requests.Session.call_count, 1)
+        self.assertEqual(session.get.call_args[1]['url'],
+                         'http://maas/MAAS/api/1.0/nodes/')
+        self.assertEqual(session.post.call_args[1]['data'],
+                         {'op': 'acquire'})
@@ -455,6 +455,64 @@ class PlacementControllerTestCase(unittest.TestCase):
         self.pc.clear_assignments(self.mock_machine)
         self.pc.clear_assignments(self.mock_machine_2)
 
+    def test_indexes_match_rebuild(self):
+        """Incrementally kept indexes match ones rebuilt from scratch"""
+        self.pc.assign(self.mock_machine, CharmNovaCompute, AssignmentType.LXC)
+        self.pc.assign(self.mock_machine_2, CharmNovaCompute,
+                       AssignmentType.KVM)
+        self.pc.assign(self.mock_machine, CharmKeystone, AssignmentType.LXC)
+        self.pc.assign(self.mock_machine_2, CharmKeystone, AssignmentType.KVM)
+        self.pc.mark_deployed(self.mock_machine_2, CharmNovaCompute,
+                              AssignmentType.KVM)
+        self.pc.remove_one_assignment(self.mock_machine, CharmNovaCompute)
+        self.pc.clear_assignments(self.mock_machine_2)
+
+        ad = dict(self.pc.assignment_index.by_charm)
+        dd = dict(self.pc.deployment_index.by_charm)
+        self.pc.reset_assigned_deployed()
+        self.assertEqual(ad, dict(self.pc.assignment_index.by_charm))
+        self.assertEqual(dd, dict(self.pc.deployment_index.by_charm))
+        self.assertFalse(self.pc.is_assigned(CharmKeystone))
+        self.assertTrue(self.pc.is_deployed(CharmNovaCompute))
+
+    def test_get_assignments_uses_machine_map(self):
+        """Looking up assignments only asks MAAS for unknown machines"""
+        self.pc.assign(self.mock_machine, CharmNovaCompute, AssignmentType.LXC)
+        self.pc.get_assignments(CharmNovaCompute)
+        self.mock_maas_state.reset_mock()
+        for i in range(3):
+            self.assertEqual(self.pc.get_assignments(CharmNovaCompute),
+                             {AssignmentType.LXC: [self.mock_machine]})
+        self.assertEqual(self.mock_maas_state.machines.call_count, 0)
+
+    def test_temp_copy_isolated_until_update(self):
+        """Changes to a temp copy only reach the original on update"""
+        self.pc.assign(self.mock_machine, CharmKeystone, AssignmentType.LXC)
+        self.pc.assign(self.mock_machine, CharmNovaCompute, AssignmentType.KVM)
+
+        temp = self.pc.get_temp_copy()
+        temp.assign(self.mock_machine_2, CharmKeystone, AssignmentType.KVM)
+        temp.clear_assignments(self.mock_machine)
+        self.assertEqual(temp.get_assignments(CharmKeystone),
+                         {AssignmentType.KVM: [self.mock_machine_2]})
+        self.assertFalse(temp.is_assigned(CharmNovaCompute))
+
+        self.assertEqual(self.pc.get_assignments(CharmKeystone),
+                         {AssignmentType.LXC: [self.mock_machine]})
+        self.assertTrue(self.pc.is_assigned(CharmNovaCompute))
+        self.assertEqual(self.pc.assignments[self.mock_machine.instance_id]
+                         [AssignmentType.LXC], [CharmKeystone])
+
+        self.pc.update_from_controller(temp)
+        self.assertEqual(self.pc.get_assignments(CharmKeystone),
+                         {AssignmentType.KVM: [self.mock_machine_2]})
+        self.assertFalse(self.pc.is_assigned(CharmNovaCompute))
+        self.assertNotIn(self.mock_machine.instance_id, self.pc.assignments)
+
+        ad = dict(self.pc.assignment_index.by_charm)
+        self.pc.reset_assigned_deployed()
+        self.assertEqual(ad, dict(self.pc.assignment_index.by_charm))
+
     def test_gen_defaults_raises_with_no_maas_state(self):
         pc = PlacementController(None, self.conf)
         self.assertRaises(PlacementError, pc.gen_defaults)
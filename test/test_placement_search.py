@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#
+# tests placement/search.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import time
+import unittest
+
+from cloudinstall.placement.search import SearchIndex
+
+log = logging.getLogger('cloudinstall.test_placement_search')
+
+
+class SearchIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SearchIndex()
+        self.index.update('a', {'hostname': 'node-a.maas', 'tag': ['ssd'],
+                                'mem': 32768, 'cores': 8},
+                          "hostname:node-a.maas mem:32.0G")
+        self.index.update('b', {'hostname': 'node-b.maas', 'tag': ['hdd'],
+                                'mem': 8192, 'cores': 4},
+                          "hostname:node-b.maas mem:8.0G")
+
+    def test_empty_query(self):
+        self.assertIsNone(self.index.search(""))
+        self.assertIsNone(self.index.search("   "))
+
+    def test_substring(self):
+        self.assertEqual(self.index.search("node"), {'a', 'b'})
+        self.assertEqual(self.index.search("e-b"), {'b'})
+        self.assertEqual(self.index.search("zzz"), set())
+
+    def test_field_prefix(self):
+        self.assertEqual(self.index.search("tag:ss"), {'a'})
+        self.assertEqual(self.index.search("hostname:node-b"), {'b'})
+        # filter label text still matches as a substring
+        self.assertEqual(self.index.search("mem:8.0"), {'b'})
+
+    def test_comparisons(self):
+        self.assertEqual(self.index.search("mem>16G"), {'a'})
+        self.assertEqual(self.index.search("mem<=8192"), {'b'})
+        self.assertEqual(self.index.search("cores>=4"), {'a', 'b'})
+        self.assertEqual(self.index.search("tag:ssd mem>16G"), {'a'})
+        self.assertEqual(self.index.search("tag:hdd mem>16G"), set())
+
+    def test_update_and_remove(self):
+        self.index.update('b', {'hostname': 'node-b.maas', 'tag': ['ssd'],
+                                'mem': 8192})
+        self.assertEqual(self.index.search("tag:ssd"), {'a', 'b'})
+        self.assertEqual(self.index.search("tag:hdd"), set())
+        self.index.retain({'b'})
+        self.assertEqual(self.index.search("node"), {'b'})
+        self.assertNotIn('hdd', self.index.tokens)
+
+    def test_many_documents(self):
+        index = SearchIndex()
+        for i in range(5000):
+            index.update(i, {'hostname': 'node{}.maas'.format(i),
+                             'tag': ['ssd' if i % 2 else 'hdd'],
+                             'mem': 1024 * (i % 64)})
+        start = time.time()
+        keys = index.search("tag:ssd mem>32G node12")
+        elapsed = time.time() - start
+        log.debug("search took {:.6f}s".format(elapsed))
+        self.assertEqual(keys, set(i for i in range(5000)
+                                   if i % 2 and i % 64 > 32 and
+                                   'node12' in 'node{}.maas'.format(i)))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# tests placement/solver.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from cloudinstall.maas import satisfies
+from cloudinstall.placement.controller import PlaceholderMachine
+from cloudinstall.placement.solver import PlacementSolver
+
+log = logging.getLogger('cloudinstall.test_placement_solver')
+
+
+def make_machine(name, memory, storage=102400, cpu_count=4):
+    return PlaceholderMachine(name, name,
+                              {'architecture': 'amd64',
+                               'memory': memory,
+                               'storage': storage,
+                               'cpu_count': cpu_count})
+
+
+def make_charm(name, constraints, units=1):
+    cc = MagicMock(name=name)
+    cc.charm_name = name
+    cc.constraints = constraints
+    cc.required_num_units.return_value = units
+    return cc
+
+
+def fits(machine, constraints):
+    return satisfies(machine, constraints)[0]
+
+
+class PlacementSolverTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.big = make_machine('big', 65536)
+        self.medium = make_machine('medium', 8192)
+        self.small = make_machine('small', 2048)
+
+    def test_take_best_fit(self):
+        """The smallest machine that fits is used"""
+        solver = PlacementSolver([self.big, self.medium, self.small], fits)
+        self.assertEqual(solver.take({'mem': 4096}), self.medium)
+        self.assertEqual(solver.take({'mem': 4096}), self.big)
+        self.assertIsNone(solver.take({'mem': 4096}))
+        self.assertEqual(len(solver), 1)
+
+    def test_place_isolated_most_demanding_first(self):
+        """A large charm listed last still gets the large machine"""
+        small_charm = make_charm('small', {'mem': 1024}, units=2)
+        large_charm = make_charm('large', {'mem': 32768})
+        solver = PlacementSolver([self.big, self.medium, self.small], fits)
+        placed, short = solver.place_isolated([small_charm, large_charm])
+        self.assertEqual(short, [])
+        self.assertEqual(placed, [(large_charm, self.big),
+                                  (small_charm, self.small),
+                                  (small_charm, self.medium)])
+
+    def test_place_shared_falls_back_to_largest(self):
+        charms = [make_charm('a', {'mem': 65536}),
+                  make_charm('b', {'mem': 65536})]
+        solver = PlacementSolver([self.big, self.small], fits)
+        self.assertEqual(solver.place_shared(charms), self.big)
+
+    def test_many_units_many_machines(self):
+        machines = [make_machine('m{}'.format(i), 1024 * (1 + i % 64))
+                    for i in range(500)]
+        charms = [make_charm('c{}'.format(i), {'mem': 1024 * (1 + i % 32)},
+                             units=4)
+                  for i in range(100)]
+        solver = PlacementSolver(machines, fits)
+        start = time.time()
+        placed, short = solver.place_isolated(charms)
+        elapsed = time.time() - start
+        log.debug("placed {} units in {:.3f}s".format(len(placed), elapsed))
+        self.assertEqual(len(placed), 400)
+        self.assertEqual(short, [])
+        for cc, m in placed:
+            self.assertTrue(fits(m, cc.constraints))
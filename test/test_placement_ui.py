@@ -318,6 +318,43 @@ class MachinesListTestCase(unittest.TestCase):
         print("ml.machinewidgets is {}".format(ml.machine_widgets))
         self.assertEqual(1, len(ml.machine_widgets))
 
+    def test_update_only_changed_machines(self, mock_machinewidget):
+        mock_machinewidget.side_effect = lambda m, *args: MagicMock(machine=m)
+        self.mock_maas_state.machines.return_value = [self.mock_machine,
+                                                      self.mock_machine2]
+        ml = MachinesList(self.pc, self.actions)
+        widgets = {w.machine.instance_id: w for w in ml.machine_widgets}
+        n_contents = len(ml.machine_pile.contents)
+        mock_machinewidget.reset_mock()
+        for w in ml.machine_widgets:
+            w.reset_mock()
+
+        ml.update()
+        self.assertFalse(mock_machinewidget.called)
+        self.assertEqual(len(ml.machine_pile.contents), n_contents)
+
+        self.pc.assign(self.mock_machine2, CharmNovaCompute,
+                       AssignmentType.LXC)
+        ml.update()
+        self.assertEqual(widgets[self.mock_machine.instance_id]
+                         .update.call_count, 0)
+        self.assertEqual(widgets[self.mock_machine2.instance_id]
+                         .update.call_count, 1)
+
+    def test_remove_machine_keeps_rows(self, mock_machinewidget):
+        mock_machinewidget.side_effect = lambda m, *args: MagicMock(machine=m)
+        self.mock_maas_state.machines.return_value = [self.mock_machine,
+                                                      self.mock_machine2,
+                                                      self.mock_machine3]
+        ml = MachinesList(self.pc, self.actions)
+        self.mock_maas_state.machines.return_value = [self.mock_machine,
+                                                      self.mock_machine3]
+        ml.update()
+        rows = [w for w, _ in ml.machine_pile.contents[3::2]]
+        self.assertEqual(rows, ml.machine_widgets)
+        self.assertEqual([w.machine for w in rows[:2]],
+                         [self.mock_machine, self.mock_machine3])
+
 
 @patch('cloudinstall.placement.ui.services_list.ServiceWidget')
 class ServicesListTestCase(unittest.TestCase):
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#
+# tests profiler.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cloudinstall.profiler import (Profiler, PHASES_TID, TracedProxy,
+                                   profiler, traced)
+from cloudinstall.maas import TracedMaasClient
+from cloudinstall.task import TaskerConsole
+
+log = logging.getLogger('cloudinstall.test_profiler')
+
+
+class ProfilerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = Profiler()
+
+    def test_nested_spans(self):
+        with self.profiler.span("outer", "test"):
+            with self.profiler.span("inner", "test", n=1):
+                pass
+        inner, outer = self.profiler.spans
+        self.assertEqual(inner.path, ("outer", "inner"))
+        self.assertEqual(inner.args, {'n': 1})
+        self.assertEqual(outer.path, ("outer",))
+        self.assertLessEqual(outer.start, inner.start)
+        self.assertGreaterEqual(outer.end, inner.end)
+
+    def test_spans_per_thread(self):
+        def work():
+            with self.profiler.span("thread", "test"):
+                pass
+        with self.profiler.span("main", "test"):
+            t = threading.Thread(target=work, name="worker")
+            t.start()
+            t.join()
+        thread_span, main_span = self.profiler.spans
+        self.assertEqual(thread_span.path, ("thread",))
+        self.assertNotEqual(thread_span.tid, main_span.tid)
+        self.assertEqual(self.profiler.thread_names[thread_span.tid],
+                         "worker")
+
+    def test_chrome_trace(self):
+        self.profiler.add("phase", "phase", 10.0, 12.5, tid=PHASES_TID)
+        trace = self.profiler.chrome_trace()
+        events = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['ts'], 10000000)
+        self.assertEqual(events[0]['dur'], 2500000)
+        self.assertEqual(events[0]['tid'], PHASES_TID)
+        names = [e for e in trace['traceEvents'] if e['ph'] == 'M']
+        self.assertIn("install phases", [e['args']['name'] for e in names])
+
+    def test_folded(self):
+        self.profiler.add("a", "", 0.0, 3.0, path=("a",))
+        self.profiler.add("b", "", 1.0, 2.0, path=("a", "b"))
+        self.assertEqual(self.profiler.folded(), "a 2000000\na;b 1000000\n")
+
+    def test_append_trace(self):
+        with tempfile.TemporaryDirectory() as d:
+            trace_path = os.path.join(d, 'trace.json')
+            self.profiler.add("a", "", 0.0, 1.0, tid=PHASES_TID)
+            self.profiler.append_trace(trace_path)
+            self.profiler.add("b", "", 1.0, 2.0, tid=PHASES_TID)
+            self.profiler.add("c", "", 2.0, 3.0, tid=PHASES_TID)
+            self.profiler.append_trace(trace_path)
+            self.profiler.append_trace(trace_path)
+            with open(trace_path) as f:
+                text = f.read()
+        events = json.loads(text.rstrip(",\n") + "]")
+        self.assertEqual([e['name'] for e in events if e['ph'] == 'X'],
+                         ["a", "b", "c"])
+        self.assertEqual(len([e for e in events if e['ph'] == 'M']), 1)
+
+    def test_append_trace_processes(self):
+        """ openstack-status appends to the trace openstack-install
+        started
+        """
+        status = Profiler()
+        with tempfile.TemporaryDirectory() as d:
+            trace_path = os.path.join(d, 'trace.json')
+            self.profiler.add("install", "", 0.0, 1.0, tid=PHASES_TID)
+            self.profiler.append_trace(trace_path)
+            status.add("status", "", 1.0, 2.0, tid=PHASES_TID)
+            status.append_trace(trace_path)
+            with open(trace_path) as f:
+                text = f.read()
+        events = json.loads(text.rstrip(",\n") + "]")
+        self.assertEqual([e['name'] for e in events if e['ph'] == 'X'],
+                         ["install", "status"])
+
+    def test_max_spans(self):
+        p = Profiler(max_spans=2)
+        for i in range(3):
+            p.add(str(i), "", 0, 1)
+        self.assertEqual([s.name for s in p.spans], ["1", "2"])
+
+
+class TracingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        profiler.clear()
+        self.addCleanup(profiler.clear)
+
+    def test_traced(self):
+        @traced('test')
+        def f(x):
+            return x + 1
+        self.assertEqual(f(1), 2)
+        self.assertEqual(profiler.spans[-1].name, 'f')
+
+    def test_traced_proxy(self):
+        client = MagicMock()
+        client.status.return_value = {'Machines': {}}
+        client.url = "wss://x"
+        proxy = TracedProxy(client, 'juju')
+        self.assertEqual(proxy.status(), {'Machines': {}})
+        self.assertEqual(proxy.url, "wss://x")
+        self.assertEqual(profiler.spans[-1].name, 'juju status')
+        self.assertEqual(profiler.spans[-1].cat, 'juju')
+
+    def test_maas_requests(self):
+        auth = MagicMock(api_url='http://maas/MAAS/api/1.0')
+        with patch('cloudinstall.maas.http_session') as session, \
+                patch.object(TracedMaasClient, '_oauth'):
+            session.return_value.get.return_value.ok = False
+            TracedMaasClient(auth).nodes
+        self.assertEqual(profiler.spans[-1].name, 'maas GET')
+        self.assertEqual(profiler.spans[-1].args, {'url': '/nodes/'})
+
+    @patch('cloudinstall.task.write_timings')
+    def test_tasker_console_records_phases(self, mock_write):
+        tasker = TaskerConsole(MagicMock(), MagicMock(), MagicMock())
+        tasker.start_task("A")
+        tasker.start_task("B")
+        tasker.stop_current_task()
+        tasker.stop_current_task()
+        self.assertEqual([t[0] for t in tasker.timings], ["A", "B"])
+        self.assertTrue(all(e is not None for _, _, e in tasker.timings))
+        self.assertEqual([(s.name, s.tid) for s in profiler.spans],
+                         [("A", PHASES_TID), ("B", PHASES_TID)])
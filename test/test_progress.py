@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+#
+# tests progress.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock, PropertyMock, patch
+
+from cloudinstall.config import Config
+from cloudinstall.consoleui import ConsoleUI
+from cloudinstall.core import Controller
+from cloudinstall.juju import JujuState
+from cloudinstall.progress import ProgressStream, from_config
+from cloudinstall.service import Service
+
+log = logging.getLogger('cloudinstall.test_progress')
+
+
+def read_events(f):
+    return [json.loads(line.decode()) for line in f.read().splitlines()]
+
+
+class ProgressStreamTestCase(unittest.TestCase):
+
+    def test_fd(self):
+        r, w = os.pipe()
+        stream = ProgressStream('fd:{}'.format(w), install_id='abc')
+        stream.emit('deploy', service='mysql', machine='lxc:1')
+        stream.close()
+        os.close(w)
+        with os.fdopen(r, 'rb') as f:
+            events = read_events(f)
+        self.assertEqual(len(events), 1)
+        e = events[0]
+        self.assertEqual((e['event'], e['install'], e['service'],
+                          e['machine']), ('deploy', 'abc', 'mysql', 'lxc:1'))
+        self.assertGreaterEqual(e['elapsed'], 0)
+
+    def test_unix_socket(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'progress.sock')
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.addCleanup(server.close)
+            server.bind(path)
+            server.listen(1)
+            stream = ProgressStream('unix:' + path)
+            conn, _ = server.accept()
+            stream.emit('status', message="one")
+            stream.emit('status', message="two")
+            stream.close()
+            with conn.makefile('rb') as f:
+                events = read_events(f)
+            conn.close()
+        self.assertEqual([e['message'] for e in events], ["one", "two"])
+        self.assertNotIn('install', events[0])
+
+    def test_reader_gone(self):
+        a, b = socket.socketpair()
+        b.close()
+        stream = ProgressStream('fd:{}'.format(a.fileno()))
+        self.addCleanup(a.close)
+        stream.emit('status', message="nobody listening")
+        self.assertTrue(stream.closed)
+        # further events are dropped
+        stream.emit('status', message="still nobody")
+
+
+# openstack-status after the exec, reading the config install wrote
+STATUS = """
+import sys
+import yaml
+from cloudinstall.config import Config
+from cloudinstall.progress import from_config
+from cloudinstall.utils import slurp
+config = Config(yaml.load(slurp(sys.argv[1])), sys.argv[1],
+                save_backups=False)
+from_config(config).emit('deploy', service='mysql')
+"""
+
+
+class HandoffTestCase(unittest.TestCase):
+
+    def test_install_to_status(self):
+        """ openstack-status carries on the fd stream of openstack-install
+        """
+        r, w = os.pipe()
+        with tempfile.TemporaryDirectory() as d:
+            cfg_file = os.path.join(d, 'config.yaml')
+            config = Config({}, cfg_file, save_backups=False)
+            config.setopt('progress', 'fd:{}'.format(w))
+            config.setopt('session_id', 'abc')
+            config.flush()
+            stream = from_config(config)
+            stream.emit('phase_end', phase="Bootstrapping Juju")
+            subprocess.check_call(
+                [sys.executable, '-c', STATUS, cfg_file], close_fds=False,
+                env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+        stream.close()
+        os.close(w)
+        with os.fdopen(r, 'rb') as f:
+            events = read_events(f)
+        self.assertEqual([(e['event'], e['install']) for e in events],
+                         [('phase_end', 'abc'), ('deploy', 'abc')])
+
+    def test_unset(self):
+        config = MagicMock()
+        config.getopt.return_value = None
+        self.assertIsNone(from_config(config))
+
+
+class HeadlessProgressTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.out = tempfile.NamedTemporaryFile()
+        self.addCleanup(self.out.close)
+        self.ui = ConsoleUI(progress=ProgressStream(self.out.name))
+        self.addCleanup(self.ui.progress.close)
+
+    def events(self):
+        self.out.seek(0)
+        return read_events(self.out)
+
+    def test_ui_messages(self):
+        self.ui.status_info_message("Deploying")
+        self.ui.status_error_message("Broken")
+        self.ui.set_pending_deploys(['MySQL', 'Keystone'])
+        self.assertEqual([(e['event'], e.get('message', e.get('services')))
+                          for e in self.events()],
+                         [('status', "Deploying"), ('error', "Broken"),
+                          ('pending_deploys', ['MySQL', 'Keystone'])])
+
+    def test_phases(self):
+        tasker = self.ui.tasker(MagicMock(), MagicMock())
+        with patch.object(tasker, 'write_timings'):
+            tasker.start_task("Bootstrapping Juju")
+            tasker.start_task("Deploying Services")
+            tasker.stop_current_task()
+        self.assertEqual([(e['event'], e['phase']) for e in self.events()],
+                         [('phase_start', "Bootstrapping Juju"),
+                          ('phase_end', "Bootstrapping Juju"),
+                          ('phase_start', "Deploying Services"),
+                          ('phase_end', "Deploying Services")])
+        self.assertIn('seconds', self.events()[-1])
+
+    def test_unit_states(self):
+        units = {'mysql/0': {'AgentState': 'pending', 'Machine': '1'}}
+        # test_juju_state leaves a PropertyMock on JujuState.services
+        services = [Service('mysql', {'Units': units})]
+        patcher = patch.object(JujuState, 'services',
+                               new_callable=PropertyMock,
+                               return_value=services)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cfg_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cfg_dir.cleanup)
+        config = Config({}, os.path.join(cfg_dir.name, 'config.yaml'),
+                        save_backups=False)
+        self.addCleanup(config.flush)
+        dc = Controller(ui=self.ui, config=config, loop=MagicMock())
+        dc.juju_state = JujuState(MagicMock())
+        dc.report_unit_states()
+        dc.report_unit_states()
+        units['mysql/0']['AgentState'] = 'started'
+        dc.report_unit_states()
+        self.assertEqual([(e['unit'], e['machine'], e['previous'],
+                           e['state'])
+                          for e in self.events()
+                          if e['event'] == 'unit_state'],
+                         [('mysql/0', '1', None, 'pending'),
+                          ('mysql/0', '1', 'pending', 'started')])
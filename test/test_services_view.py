@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#
+# tests ui/views/services.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+from unittest.mock import MagicMock, patch
+
+from cloudinstall.service import Service
+from cloudinstall.ui.views.services import ServicesView
+
+log = logging.getLogger('cloudinstall.test_services_view')
+
+HWINFO = dict(container="-", machine="1", arch="amd64", cpu_cores="2",
+              mem="4G", storage="20G")
+
+
+class ServicesViewTestCase(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.object(ServicesView, '_get_hardware_info',
+                               side_effect=lambda u: dict(HWINFO))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('cloudinstall.ui.views.services.'
+                        'subscribe_sync_status')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.units = {'keystone/0': {'AgentState': "started",
+                                     'Machine': "1",
+                                     'PublicAddress': "10.0.0.2"}}
+        self.charm_class = MagicMock(constraints=None)
+        juju_state = MagicMock()
+        juju_state.machine.return_value.agent_state = "started"
+        self.view = ServicesView(self.nodes(), juju_state, None,
+                                 MagicMock())
+
+    def nodes(self):
+        # a new Service, like the ones built from each juju status
+        return [(self.charm_class,
+                 Service('keystone', {'Units': self.units}))]
+
+    def test_refresh_unchanged(self):
+        self.view.walker._modified = MagicMock()
+        self.view.refresh_nodes(self.nodes())
+        self.view.refresh_nodes(self.nodes())
+        self.assertFalse(self.view.walker._modified.called)
+
+    def test_refresh_changed(self):
+        self.view.walker._modified = MagicMock()
+        self.units['keystone/0']['AgentState'] = "stopped"
+        self.view.refresh_nodes(self.nodes())
+        self.assertEqual(self.view.walker._modified.call_count, 1)
+        row = self.view.walker.rows['keystone/0']
+        self.assertEqual(row.state[1], "stopped")
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#
+# tests status.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+from unittest.mock import MagicMock, call, patch
+
+from cloudinstall import status
+from cloudinstall.status import StatusListener, SYNC_STATUS_EXCHANGE
+
+log = logging.getLogger('cloudinstall.test_status')
+
+SYNC = SYNC_STATUS_EXCHANGE
+
+
+class Subscriber:
+
+    def __init__(self):
+        self.statuses = []
+
+    def changed(self, exchange, s):
+        self.statuses.append((exchange, s))
+
+
+class SyncStatusTestCase(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.multiple('cloudinstall.status', statuses={},
+                                 _partial=b"", _subscribers=[],
+                                 listener=None, not_found_message="")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_read_status(self):
+        sub = Subscriber()
+        status.subscribe_sync_status(sub.changed)
+        status._read_status(b'["%s", "one"]\n["%s", "two' % (
+            SYNC.encode(), SYNC.encode()))
+        self.assertEqual(status.get_sync_status(), "one")
+        status._read_status(b' lines\\nhere"]\n["other", "x"]\n')
+        self.assertEqual(status.get_sync_status(), "two lines\nhere")
+        self.assertEqual(status.get_status("other"), "x")
+        # repeated statuses don't notify
+        status._read_status(b'["other", "x"]\n')
+        self.assertEqual(sub.statuses, [(SYNC, "one"),
+                                        (SYNC, "two lines\nhere"),
+                                        ("other", "x")])
+
+    def test_subscribers_are_weak(self):
+        sub = Subscriber()
+        status.subscribe_sync_status(sub.changed)
+        del sub
+        status._read_status(b'["x", "one"]\n')
+        self.assertEqual(status._subscribers, [])
+
+    def test_closed_pipe_removes_watch(self):
+        self.assertFalse(status._read_status(b''))
+
+    @patch('cloudinstall.status.os.write')
+    @patch('cloudinstall.status.StatusListener.start')
+    def test_start_listener(self, mock_start, mock_write):
+        loop = MagicMock()
+        loop.watch_pipe.return_value = 42
+        config = MagicMock()
+        config.getopt.return_value = False
+        status.start_sync_status_listener(loop, config)
+        status.start_sync_status_listener(loop, config)
+        mock_start.assert_called_once_with()
+        self.assertEqual(status.listener.exchanges, [SYNC])
+        self.assertEqual(status.get_sync_status(),
+                         "Waiting for initial status.")
+        status.listener.on_status(SYNC, "hi")
+        mock_write.assert_called_once_with(
+            42, ('["%s", "hi"]\n' % SYNC).encode())
+
+    def test_headless_no_listener(self):
+        loop = MagicMock()
+        loop.watch_pipe.return_value = None
+        status.start_sync_status_listener(loop, MagicMock())
+        self.assertIsNone(status.listener)
+
+
+class StatusListenerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.on_status = MagicMock()
+        self.get_url = MagicMock(return_value="amqp://u:p@host/vhost")
+        self.listener = StatusListener(self.get_url, ["a", "b"],
+                                       on_status=self.on_status)
+
+    def message(self, exchange):
+        return MagicMock(delivery_info={'exchange': exchange})
+
+    def test_coalesces_bursts(self):
+        for i in range(5):
+            self.listener._on_message({'status': 'ok',
+                                       'message': str(i)},
+                                      self.message("a"))
+        self.listener._on_message({'status': 'Error', 'message': 'bad'},
+                                  self.message("b"))
+        self.assertEqual(self.on_status.call_args_list, [call("a", "0")])
+        self.listener.flush()
+        self.assertEqual(self.on_status.call_args_list[1:],
+                         [call("a", "4"), call("b", status.ERROR_MESSAGE)])
+        self.assertEqual(self.listener.latest("a"), "4")
+
+    def test_reconnects_with_backoff(self):
+        kombu = MagicMock()
+        kombu.Connection.side_effect = OSError("connection refused")
+        waits = []
+
+        def wait(t):
+            waits.append(t)
+            if len(waits) == 12:
+                self.listener._stop.set()
+        self.listener._stop.wait = wait
+        with patch.dict('sys.modules', kombu=kombu):
+            self.listener.run()
+        self.assertEqual(waits, [1, 2, 4, 8, 16, 32, 60, 60, 60, 60, 60,
+                                 60])
+        # credentials were read again after every 5 failures
+        self.assertEqual(self.get_url.call_count, 3)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+# tests ui/lists.py
+#
+# Copyright 2016 Canonical, Ltd.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import unittest
+from unittest.mock import MagicMock
+
+from urwid import ListBox, Text
+
+from cloudinstall.ui.lists import VirtualListWalker
+
+log = logging.getLogger('cloudinstall.test_ui_lists')
+
+
+class VirtualListWalkerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.create = MagicMock(side_effect=lambda k, d: Text(d))
+        self.walker = VirtualListWalker(self.create, margin=30)
+        for i in range(2000):
+            self.walker.set_row(i, "row {}".format(i))
+        self.listbox = ListBox(self.walker)
+
+    def test_render_builds_visible_rows(self):
+        canvas = self.listbox.render((40, 10), focus=True)
+        self.assertEqual(canvas.text[0].decode().strip(), "row 0")
+        self.assertLessEqual(self.create.call_count, 11)
+
+    def test_scrolling_drops_far_widgets(self):
+        for pos in range(0, 2000, 5):
+            self.listbox.set_focus(pos)
+            self.listbox.render((40, 10), focus=True)
+        self.assertLessEqual(len(self.walker.widgets), 61)
+        self.assertIn(1995, self.walker.widgets)
+        self.assertNotIn(0, self.walker.widgets)
+
+    def test_set_row(self):
+        self.listbox.render((40, 10), focus=True)
+        self.assertFalse(self.walker.set_row(1, "row 1"))
+        self.assertTrue(self.walker.set_row(1, "changed"))
+        # rebuilt on the next render, without an update function
+        self.assertNotIn(1, self.walker.widgets)
+        canvas = self.listbox.render((40, 10), focus=True)
+        self.assertEqual(canvas.text[1].decode().strip(), "changed")
+
+    def test_update(self):
+        update = MagicMock()
+        self.walker.update = update
+        self.listbox.render((40, 10), focus=True)
+        self.walker.set_row(2, "changed")
+        update.assert_called_once_with(self.walker.widgets[2], "changed")
+        # rows that aren't on screen have no widget to update
+        self.walker.set_row(1500, "changed")
+        self.assertEqual(update.call_count, 1)
+
+    def test_remove(self):
+        self.walker.set_focus(1999)
+        self.walker.remove(1999)
+        self.walker.remove(0)
+        self.assertEqual(len(self.walker), 1998)
+        self.assertEqual(self.walker.focus, 1997)
+        self.assertEqual(self.walker[0].text, "row 1")